@@ -1,39 +1,256 @@
+import time
+# Mốc đo thời gian khởi động (import toàn bộ module -> app sẵn sàng), xem create_app()
+_IMPORT_STARTED = time.perf_counter()
 import os
 from flask import (
     Flask, request, jsonify, render_template, 
-    Blueprint, redirect, url_for, session, g,
-    send_from_directory, flash
+    Blueprint, redirect, url_for, session, g, current_app, has_app_context,
+    send_from_directory, flash, Response, has_request_context, make_response
 )
 from flask_sqlalchemy import SQLAlchemy
+from markupsafe import Markup
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from werkzeug.security import generate_password_hash
+from werkzeug.datastructures import FileStorage
+from werkzeug.local import LocalProxy
+from werkzeug.utils import secure_filename, safe_join
 from functools import wraps
+import multiprocessing
 import datetime 
+import mimetypes
+import json
+import csv
+import io
+import math
+import zipfile
+import threading
+from collections import Counter
 import re 
+import unicodedata
+import hashlib
+import uuid
+import sqlite3
+import secrets
+from catalog_cache import CatalogCache, snapshot
+from cart_store import MemoryCartStore, SQLCartStore, empty_cart
+from password_hasher import PasswordHasher, HashingBusy, benchmark_method
+from metrics import MetricsRegistry, render_prometheus
+from query_guard import QueryBudgetExceeded, query_budget, statement_shape, find_problems
+from migrations import run_migrations, pending_migrations
+from job_queue import JobQueue, JOB_STATUSES
+from compression import (
+    ENCODING_SUFFIXES, supported_encodings, is_compressible, choose_encoding, compress_bytes,
+    encoded_etag, fresh_precompressed, precompress_tree, brotli_available
+)
+from image_variants import (
+    VARIANT_WIDTHS, VARIANT_DIRNAME, pillow_available,
+    variant_filename, generate_variants, remove_variants
+)
 
 # --- Cài đặt ban đầu ---
-app = Flask(__name__)
-CORS(app)
-app.config['SECRET_KEY'] = 'BnHHnB4389sn--Padfd***!@@#hhhahf'
-
-# Cấu hình cơ sở dữ liệu
+# App được tạo trong create_app() (cuối tệp); ở đây chỉ khai báo extension, model,
+# blueprint. `app` của module = create_app() với cấu hình từ biến môi trường.
+cors = CORS()
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'users.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# --- HỒ SƠ CẤU HÌNH SQLITE (chọn bằng biến môi trường DB_PROFILE) ---
+# 'default'    : giữ nguyên mặc định của SQLite (journal rollback, ghi chặn đọc)
+# 'production' : WAL để người đọc không bị chặn khi checkout/liên hệ đang ghi
+# Pool: một request giữ kết nối của session trong khi giỏ hàng (SqliteCartStore) mượn thêm
+# một kết nối, nên pool_size + max_overflow phải lớn hơn số luồng xử lý request của tiến
+# trình (gthread threads + JOB_WORKERS); nếu không, các luồng chờ nhau tới pool_timeout.
+SHARED_POOL = {
+    'pool_size': 10,
+    'max_overflow': 10,
+    'pool_timeout': 10,
+}
+SQLITE_PROFILES = {
+    'default': {
+        'pragmas': {},
+        'pool': dict(SHARED_POOL),
+    },
+    'production': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',     # an toàn với WAL, ít fsync hơn FULL
+            'busy_timeout': 5000,        # ms chờ khóa ghi thay vì lỗi 'database is locked'
+            'mmap_size': 268435456,      # 256MB đọc qua mmap
+            'cache_size': -65536,        # số âm = KiB -> 64MB page cache mỗi kết nối
+            'temp_store': 'MEMORY',
+        },
+        'pool': dict(SHARED_POOL, pool_recycle=3600),
+    },
+}
 
 # --- CẤU HÌNH UPLOAD ---
 PRODUCT_UPLOAD_FOLDER = os.path.join(basedir, 'static', 'images')
-app.config['PRODUCT_UPLOAD_FOLDER'] = PRODUCT_UPLOAD_FOLDER
 GALLERY_UPLOAD_FOLDER = os.path.join(basedir, 'static', 'gallery')
-app.config['GALLERY_UPLOAD_FOLDER'] = GALLERY_UPLOAD_FOLDER
 PAYMENT_UPLOAD_FOLDER = os.path.join(basedir, 'static', 'payment')
-app.config['PAYMENT_UPLOAD_FOLDER'] = PAYMENT_UPLOAD_FOLDER
 PROOF_UPLOAD_FOLDER = os.path.join(basedir, 'static', 'proofs')
-app.config['PROOF_UPLOAD_FOLDER'] = PROOF_UPLOAD_FOLDER
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-
-db = SQLAlchemy(app)
+# Tệp upload được lưu theo tên = hash nội dung nên có thể cache vĩnh viễn
+UPLOAD_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+CONTENT_HASH_LENGTH = 32
+
+# --- GIỚI HẠN GIỎ HÀNG ---
+# Số sản phẩm khác nhau tối đa trong giỏ. Checkout chạy 1 UPDATE kho cho mỗi dòng, nên
+# ngân sách truy vấn của process_checkout_api = CHECKOUT_FIXED_QUERIES + CART_MAX_LINES.
+CART_MAX_LINES = 20
+# Lệnh cố định của checkout: đọc giỏ, giá sản phẩm, đơn, chi tiết đơn, sales_rollup,
+# bộ đếm KPI, phiên bản catalog, sự kiện admin, lưu giỏ + dọn sự kiện cũ (mỗi giờ) và
+# tra kho khi thiếu hàng
+CHECKOUT_FIXED_QUERIES = 11
+
+# --- NHẬP SẢN PHẨM ---
+# Chỉ giữ chi tiết ngần này lỗi trong báo cáo nhập (vẫn đếm đủ số dòng lỗi)
+PRODUCT_IMPORT_MAX_ERRORS = 1000
+
+# --- CẤU HÌNH TÌM KIẾM ---
+SEARCH_RESULT_LIMIT = 100
+
+# --- CẤU HÌNH PHÂN TRANG ---
+ORDERS_PER_PAGE = 50
+GALLERY_PER_PAGE = 12
+ORDER_STATUSES = ['pending', 'confirmed', 'shipped', 'delivered', 'rejected']
+# Chuyển trạng thái được phép khi đổi hàng loạt; 'delivered' và 'rejected' là trạng thái cuối.
+# Mở lại đơn đã hủy chỉ làm từng đơn qua update_order_status_api: hàng đã hoàn kho được trừ
+# lại bằng UPDATE có điều kiện như checkout, không đủ hàng thì từ chối (409).
+ORDER_STATUS_TRANSITIONS = {
+    'pending': {'confirmed', 'shipped', 'rejected'},
+    'confirmed': {'shipped', 'delivered', 'rejected'},
+    'shipped': {'delivered', 'rejected'},
+    'delivered': set(),
+    'rejected': set(),
+}
+# Các trạng thái được tính vào doanh thu trên trang thống kê
+REVENUE_STATUSES = ['confirmed', 'shipped', 'delivered']
+
+
+def configure_app(app, config=None):
+    """Nạp cấu hình mặc định (đọc biến môi trường lúc gọi), ghi đè bằng config rồi tính
+    các giá trị phụ thuộc (PRAGMA, pool) theo DB_PROFILE và URI cuối cùng."""
+    app.config['SECRET_KEY'] = 'BnHHnB4389sn--Padfd***!@@#hhhahf'
+
+    # Cấu hình cơ sở dữ liệu
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///' + os.path.join(basedir, 'users.db'))
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['DB_PROFILE'] = os.environ.get('DB_PROFILE', 'default')
+
+    # Upload
+    app.config['PRODUCT_UPLOAD_FOLDER'] = PRODUCT_UPLOAD_FOLDER
+    app.config['GALLERY_UPLOAD_FOLDER'] = GALLERY_UPLOAD_FOLDER
+    app.config['PAYMENT_UPLOAD_FOLDER'] = PAYMENT_UPLOAD_FOLDER
+    app.config['PROOF_UPLOAD_FOLDER'] = PROOF_UPLOAD_FOLDER
+    # Số process tạo ảnh thu nhỏ (thumbnail/WebP) chạy nền
+    app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', 2))
+
+    # Cache catalog
+    app.config['CATALOG_CACHE_TTL'] = int(os.environ.get('CATALOG_CACHE_TTL', 60))
+    app.config['CATALOG_CACHE_MAX_ENTRIES'] = int(os.environ.get('CATALOG_CACHE_MAX_ENTRIES', 256))
+
+    # Giỏ hàng phía server: 'sqlite' (mặc định, dùng chung giữa các worker) hoặc 'memory' (1 worker, dev/test)
+    app.config['CART_STORE'] = os.environ.get('CART_STORE', 'sqlite')
+    app.config['CART_TTL'] = int(os.environ.get('CART_TTL', 7 * 24 * 3600))
+
+    # Băm mật khẩu: phương thức theo cú pháp werkzeug; đổi cost ở đây thì hash cũ tự nâng
+    # cấp khi đăng nhập
+    app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 32))
+
+    # Đo hiệu năng (Prometheus): mỗi worker ghi snapshot số liệu vào thư mục này; nên xóa
+    # thư mục khi triển khai bản mới
+    app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR', os.path.join(app.instance_path, 'metrics'))
+    app.config['METRICS_FLUSH_INTERVAL'] = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+    # Kiểm tra số truy vấn (phát hiện N+1): luôn bật khi chạy debug; QUERY_GUARD=1 để bật ở
+    # môi trường khác. QUERY_GUARD_STRICT=1 biến cảnh báo thành lỗi (dùng khi chạy test/CI).
+    app.config['QUERY_GUARD'] = os.environ.get('QUERY_GUARD') == '1'
+    app.config['QUERY_GUARD_STRICT'] = os.environ.get('QUERY_GUARD_STRICT') == '1'
+    # Một dạng câu lệnh chạy từ ngần này lần trở lên trong một request bị coi là N+1
+    app.config['QUERY_GUARD_REPEAT_THRESHOLD'] = int(os.environ.get('QUERY_GUARD_REPEAT_THRESHOLD', 3))
+
+    # Thông báo thời gian thực (SSE) cho admin
+    app.config['ADMIN_EVENT_RETENTION_HOURS'] = int(os.environ.get('ADMIN_EVENT_RETENTION_HOURS', 24))
+    # Chu kỳ tối đa giữa hai lần đọc bảng admin_event (sự kiện từ worker khác);
+    # sự kiện trong cùng tiến trình được đẩy đi ngay
+    app.config['SSE_POLL_INTERVAL'] = float(os.environ.get('SSE_POLL_INTERVAL', 1.0))
+    app.config['SSE_HEARTBEAT'] = 15
+    # Đóng luồng sau N giây; EventSource tự kết nối lại kèm Last-Event-ID nên không mất sự kiện
+    app.config['SSE_MAX_DURATION'] = int(os.environ.get('SSE_MAX_DURATION', 300))
+
+    # Hàng đợi việc nền: số luồng worker trong MỖI tiến trình web; 0 = không chạy trong
+    # web, dùng 'flask run-jobs'
+    app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+    app.config['JOB_POLL_INTERVAL'] = float(os.environ.get('JOB_POLL_INTERVAL', 1.0))
+    # Việc 'running' lâu hơn ngần này giây coi như worker đã chết và được chạy lại
+    app.config['JOB_LEASE_SECONDS'] = int(os.environ.get('JOB_LEASE_SECONDS', 600))
+    app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+    app.config['JOB_RETENTION_DAYS'] = int(os.environ.get('JOB_RETENTION_DAYS', 7))
+
+    # Bảng điều khiển: sản phẩm có tồn kho <= ngưỡng này được tính là sắp hết hàng (đổi
+    # ngưỡng -> bộ đếm tự tính lại khi khởi động)
+    app.config['LOW_STOCK_THRESHOLD'] = int(os.environ.get('LOW_STOCK_THRESHOLD', 5))
+
+    # Nén response: response nhỏ hơn ngưỡng này (byte) gửi nguyên, nén không lợi hơn chi
+    # phí CPU và header
+    app.config['COMPRESSION_MIN_SIZE'] = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+    # Mức nén cho response động: ưu tiên tốc độ; tệp tĩnh nén sẵn dùng mức cao nhất
+    app.config['COMPRESSION_GZIP_LEVEL'] = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+    app.config['COMPRESSION_BROTLI_QUALITY'] = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 5))
+
+    # Xuất đơn hàng: số dòng đọc từ DB mỗi lô; bộ nhớ dùng tỉ lệ với số này, không với số đơn
+    app.config['ORDER_EXPORT_BATCH'] = int(os.environ.get('ORDER_EXPORT_BATCH', 1000))
+
+    # Số thay đổi giá/tồn kho tối đa trong một lần gọi /api/products/batch-update
+    app.config['PRODUCT_BATCH_MAX_ITEMS'] = int(os.environ.get('PRODUCT_BATCH_MAX_ITEMS', 1000))
+    # Số dòng CSV mỗi lệnh INSERT hàng loạt khi nhập sản phẩm
+    app.config['PRODUCT_IMPORT_BATCH'] = int(os.environ.get('PRODUCT_IMPORT_BATCH', 500))
+    # Ảnh trong tệp ZIP lớn hơn ngưỡng này (byte) bị từ chối (chống zip bomb)
+    app.config['PRODUCT_IMPORT_MAX_IMAGE_SIZE'] = int(os.environ.get('PRODUCT_IMPORT_MAX_IMAGE_SIZE', 10 * 1024 * 1024))
+
+    # Đổi trạng thái đơn hàng loạt
+    app.config['ORDER_BULK_MAX_ITEMS'] = int(os.environ.get('ORDER_BULK_MAX_ITEMS', 500))
+
+    app.config.update(config or {})
+
+    if app.config['DB_PROFILE'] not in SQLITE_PROFILES:
+        raise RuntimeError(f"DB_PROFILE không hợp lệ: {app.config['DB_PROFILE']} (chọn {', '.join(SQLITE_PROFILES)})")
+    profile = SQLITE_PROFILES[app.config['DB_PROFILE']]
+    # Có thể ghi đè từng PRAGMA bằng create_app({'SQLITE_PRAGMAS': {...}})
+    app.config.setdefault('SQLITE_PRAGMAS', dict(profile['pragmas']))
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if uri.startswith('sqlite:///') and uri != 'sqlite:///:memory:':
+        # Cấu hình pool chỉ áp dụng cho SQLite dạng tệp (QueuePool)
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', dict(profile['pool']))
+
+db = SQLAlchemy()
+
+def apply_sqlite_pragmas(app, dbapi_connection):
+    """Áp dụng các PRAGMA của hồ sơ đã chọn cho mỗi kết nối SQLite mới của app."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in app.config['SQLITE_PRAGMAS'].items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+# Hook, lệnh CLI và template global áp dụng cho cả app (đăng ký trong create_app)
+core_bp = Blueprint('core', __name__, cli_group=None)
+
+def app_service(name):
+    """Đối tượng dịch vụ (cache, giỏ hàng, hàng đợi...) của app đang chạy: mỗi app tạo
+    bằng create_app có bản riêng theo cấu hình của nó, lưu trong app.extensions."""
+    return LocalProxy(lambda: current_app.extensions['services'][name])
+
+def setup_context(flask_app=None):
+    """App context cho việc chạy ngoài request (thiết lập, script, hook của gunicorn): app
+    truyền vào, app của context đang mở (vd lệnh flask), nếu không thì app mặc định của module."""
+    if flask_app is None:
+        flask_app = current_app._get_current_object() if has_app_context() else app
+    return flask_app.app_context()
 
 # --- Định nghĩa Model (Bảng) ---
 class User(db.Model):
@@ -70,6 +287,12 @@ class PaymentInfo(db.Model):
     qr_code_filename = db.Column(db.String(200), nullable=True)
 
 class Order(db.Model):
+    # Chỉ mục cho trang giao dịch (lọc trạng thái + sắp theo thời gian) và lịch sử đơn của khách.
+    # DB đã có sẵn được bổ sung bằng migrations.py (flask migrate-db).
+    __table_args__ = (
+        db.Index('ix_order_status_created_at', 'status', 'created_at'),
+        db.Index('ix_order_customer_id_created_at', 'customer_id', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     customer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True) 
     
@@ -80,21 +303,24 @@ class Order(db.Model):
     total_price = db.Column(db.Float, nullable=False)
     payment_method = db.Column(db.String(50), nullable=False, default='cash') 
     status = db.Column(db.String(50), nullable=False, default='pending') 
-    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow, index=True)
     payment_proof_filename = db.Column(db.String(200), nullable=True)
     
     items = db.relationship('OrderItem', backref='order', lazy=True, cascade="all, delete-orphan")
 
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
     quantity = db.Column(db.Integer, nullable=False)
     price_at_purchase = db.Column(db.Float, nullable=False) 
     
     product = db.relationship('Product', lazy=True)
     
 class Message(db.Model):
+    __table_args__ = (
+        db.Index('ix_message_is_read_created_at', 'is_read', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(100), nullable=True)
@@ -102,8 +328,776 @@ class Message(db.Model):
     subject = db.Column(db.String(200), nullable=True)
     content = db.Column(db.Text, nullable=False)
     is_read = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow, index=True)
+
+class AdminEvent(db.Model):
+    """Nhật ký thay đổi cho luồng SSE của admin (đơn mới, đổi trạng thái, tin nhắn mới).
+    Ghi cùng transaction với thay đổi; mọi worker đọc theo id tăng dần."""
+    __tablename__ = 'admin_event'
+    # AUTOINCREMENT: không tái sử dụng id sau khi dọn sự kiện cũ (Last-Event-ID luôn tăng)
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
 
+class BackgroundJob(db.Model):
+    """Việc nền bền vững (xem job_queue.py): tạo biến thể ảnh, xóa tệp upload..."""
+    __tablename__ = 'background_job'
+    __table_args__ = (
+        # Worker lấy việc theo (status='queued', run_at <= now) ORDER BY run_at
+        db.Index('ix_background_job_status_run_at', 'status', 'run_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued/running/done/failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    locked_by = db.Column(db.String(100), nullable=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+class CatalogVersion(db.Model):
+    """Bộ đếm phiên bản catalog (1 dòng, id=1). Tăng mỗi khi admin thay đổi dữ liệu
+    hiển thị ở cửa hàng, để cache trong mọi worker tự làm mới."""
+    __tablename__ = 'catalog_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class CartSession(db.Model):
+    """Giỏ hàng lưu phía server; cookie session chỉ giữ cart_id."""
+    __tablename__ = 'cart_session'
+    cart_id = db.Column(db.String(64), primary_key=True)
+    items = db.Column(db.Text, nullable=False, default='{}')       # JSON {product_id: quantity}
+    checkout = db.Column(db.Text, nullable=False, default='{}')    # JSON đơn đang chờ thanh toán
+    item_count = db.Column(db.Integer, nullable=False, default=0)  # tổng số lượng, tính sẵn
+    expires_at = db.Column(db.Float, nullable=False, index=True)   # unix timestamp
+
+class SalesRollup(db.Model):
+    """Tổng hợp doanh số theo (ngày đặt hàng, sản phẩm, trạng thái đơn).
+    Được cập nhật cộng dồn khi tạo đơn / đổi trạng thái, dùng cho trang thống kê."""
+    __tablename__ = 'sales_rollup'
+    day = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    status = db.Column(db.String(50), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+class DashboardCounter(db.Model):
+    """Bộ đếm KPI của trang chính admin, cộng dồn cùng transaction với thay đổi
+    (đơn mới/đổi trạng thái, tin nhắn, tồn kho) để trang chính không phải quét Order/Message.
+    Khóa theo ngày (UTC, giống sales_rollup) có dạng 'revenue:2025-01-31'."""
+    __tablename__ = 'dashboard_counter'
+    key = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Float, nullable=False, default=0)
+
+
+# --- CHỈ MỤC TÌM KIẾM SẢN PHẨM (SQLite FTS5) ---
+# Bảng ảo product_fts lưu name/description đã bỏ dấu, rowid = Product.id.
+# Được đồng bộ bằng mapper event nên mọi đường ghi (thêm/sửa/xóa) đều
+# cập nhật chỉ mục trong cùng transaction với thay đổi của Product.
+def strip_diacritics(text):
+    """Bỏ dấu tiếng Việt và chuyển về chữ thường ('Hoa Hướng Dương' -> 'hoa huong duong')."""
+    if not text:
+        return ''
+    text = text.replace('đ', 'd').replace('Đ', 'D')
+    decomposed = unicodedata.normalize('NFD', text)
+    return ''.join(ch for ch in decomposed if unicodedata.category(ch) != 'Mn').lower()
+
+def build_fts_query(search_query):
+    """Chuyển chuỗi người dùng nhập thành truy vấn FTS5 (AND các tiền tố)."""
+    tokens = re.findall(r'\w+', strip_diacritics(search_query))
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+PRODUCT_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5("
+    "name, description, tokenize='unicode61 remove_diacritics 2')"
+)
+
+# Tạo bảng FTS cùng lúc db.create_all() tạo bảng product (DB mới)
+db.event.listen(Product.__table__, 'after_create', db.DDL(PRODUCT_FTS_DDL).execute_if(dialect='sqlite'))
+
+def search_index_enabled():
+    return db.engine.dialect.name == 'sqlite'
+
+def ensure_search_index(flask_app=None):
+    """Tạo bảng FTS5 nếu chưa có và nạp lại toàn bộ nếu bị lệch với bảng product."""
+    with setup_context(flask_app):
+        if not search_index_enabled():
+            return
+        with db.engine.begin() as conn:
+            conn.execute(db.text(PRODUCT_FTS_DDL))
+            indexed = conn.execute(db.text("SELECT count(*) FROM product_fts")).scalar()
+            total = conn.execute(db.text("SELECT count(*) FROM product")).scalar()
+            if indexed != total:
+                print(f"[Setup] Xây dựng lại chỉ mục tìm kiếm ({total} sản phẩm).")
+                conn.execute(db.text("DELETE FROM product_fts"))
+                rows = conn.execute(db.text("SELECT id, name, description FROM product")).all()
+                if rows:
+                    conn.execute(
+                        db.text("INSERT INTO product_fts(rowid, name, description) VALUES (:id, :name, :description)"),
+                        [{"id": r.id, "name": strip_diacritics(r.name), "description": strip_diacritics(r.description)}
+                         for r in rows]
+                    )
+
+def search_product_ids(search_query, limit=SEARCH_RESULT_LIMIT):
+    """Trả về danh sách Product.id khớp truy vấn, xếp hạng theo bm25 (tên nặng hơn mô tả)."""
+    match = build_fts_query(search_query)
+    if not match:
+        return []
+    rows = db.session.execute(db.text(
+        "SELECT rowid FROM product_fts WHERE product_fts MATCH :match "
+        "ORDER BY bm25(product_fts, 10.0, 1.0) LIMIT :limit"
+    ), {"match": match, "limit": limit}).all()
+    return [row[0] for row in rows]
+
+def _index_product(connection, target):
+    connection.execute(
+        db.text("INSERT OR REPLACE INTO product_fts(rowid, name, description) VALUES (:id, :name, :description)"),
+        {"id": target.id, "name": strip_diacritics(target.name), "description": strip_diacritics(target.description)}
+    )
+
+def index_products_bulk(rows):
+    """Ghi chỉ mục cho các sản phẩm thêm bằng INSERT hàng loạt (không qua sự kiện mapper).
+    rows: các dict có id, name, description; chạy trong transaction hiện tại của session."""
+    if not rows or not search_index_enabled():
+        return
+    db.session.execute(
+        db.text("INSERT OR REPLACE INTO product_fts(rowid, name, description) VALUES (:id, :name, :description)"),
+        [{"id": r['id'], "name": strip_diacritics(r['name']), "description": strip_diacritics(r.get('description'))}
+         for r in rows]
+    )
+
+@db.event.listens_for(Product, 'after_insert')
+def product_after_insert(mapper, connection, target):
+    if connection.dialect.name == 'sqlite':
+        _index_product(connection, target)
+
+@db.event.listens_for(Product, 'after_update')
+def product_after_update(mapper, connection, target):
+    if connection.dialect.name != 'sqlite':
+        return
+    state = db.inspect(target)
+    # Chỉ ghi lại chỉ mục khi tên/mô tả đổi (đổi giá, tồn kho thì bỏ qua)
+    if state.attrs.name.history.has_changes() or state.attrs.description.history.has_changes():
+        _index_product(connection, target)
+
+@db.event.listens_for(Product, 'after_delete')
+def product_after_delete(mapper, connection, target):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(db.text("DELETE FROM product_fts WHERE rowid = :id"), {"id": target.id})
+
+
+# --- TỔNG HỢP DOANH SỐ (SALES ROLLUP) ---
+def apply_sales_rollup(day, status, product_totals, sign=1):
+    """Cộng (sign=1) hoặc trừ (sign=-1) doanh số vào bảng sales_rollup.
+    product_totals: {product_id: (quantity, revenue)}. Chạy trong transaction hiện tại,
+    người gọi chịu trách nhiệm commit."""
+    upsert_sales_rollup([
+        {"day": day, "product_id": product_id, "status": status,
+         "quantity": sign * quantity, "revenue": sign * revenue}
+        for product_id, (quantity, revenue) in product_totals.items()
+    ])
+
+def upsert_sales_rollup(rows):
+    """Cộng các dòng chênh lệch {day, product_id, status, quantity, revenue} vào sales_rollup
+    bằng một câu lệnh (dùng cho cả thao tác hàng loạt nhiều ngày/trạng thái)."""
+    if not rows:
+        return
+    stmt = sqlite_insert(SalesRollup).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['day', 'product_id', 'status'],
+        set_={
+            "quantity": SalesRollup.quantity + stmt.excluded.quantity,
+            "revenue": SalesRollup.revenue + stmt.excluded.revenue,
+        }
+    )
+    db.session.execute(stmt)
+
+def order_product_totals(order_id):
+    """Tổng số lượng và doanh thu theo sản phẩm của một đơn hàng (tính bằng SQL)."""
+    rows = db.session.query(
+        OrderItem.product_id,
+        db.func.sum(OrderItem.quantity),
+        db.func.sum(OrderItem.quantity * OrderItem.price_at_purchase)
+    ).filter(OrderItem.order_id == order_id).group_by(OrderItem.product_id).all()
+    return {product_id: (quantity, revenue) for product_id, quantity, revenue in rows}
+
+def rebuild_sales_rollup():
+    """Xóa và tính lại toàn bộ bảng sales_rollup từ Order/OrderItem (dùng để backfill)."""
+    db.session.query(SalesRollup).delete()
+    day = db.func.date(Order.created_at)
+    select_stmt = db.select(
+        day,
+        OrderItem.product_id,
+        Order.status,
+        db.func.sum(OrderItem.quantity),
+        db.func.sum(OrderItem.quantity * OrderItem.price_at_purchase)
+    ).join(Order, OrderItem.order_id == Order.id).group_by(day, OrderItem.product_id, Order.status)
+    db.session.execute(db.insert(SalesRollup).from_select(
+        ['day', 'product_id', 'status', 'quantity', 'revenue'], select_stmt
+    ))
+    db.session.commit()
+    return db.session.query(SalesRollup).count()
+
+@core_bp.cli.command('rebuild-sales-rollup')
+def rebuild_sales_rollup_command():
+    """Tính lại bảng sales_rollup từ lịch sử đơn hàng."""
+    db.create_all()
+    row_count = rebuild_sales_rollup()
+    print(f"[Rollup] Đã tính lại {row_count} dòng tổng hợp doanh số.")
+
+
+# --- BỘ ĐẾM KPI CHO TRANG CHÍNH ADMIN ---
+# Khóa toàn cục: 'orders_pending', 'unread_messages', 'low_stock_products', 'low_stock_threshold'
+# Khóa theo ngày đặt hàng: 'orders:<ngày>', 'orders_pending:<ngày>', 'revenue:<ngày>'
+def bump_dashboard_counters(deltas):
+    """Cộng dồn {key: delta} vào dashboard_counter trong transaction hiện tại (người gọi commit)."""
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    stmt = sqlite_insert(DashboardCounter).values([
+        {"key": key, "value": delta} for key, delta in deltas.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['key'],
+        set_={"value": DashboardCounter.value + stmt.excluded.value}
+    )
+    db.session.execute(stmt)
+
+def low_stock_delta(old_quantity, new_quantity):
+    """Thay đổi của bộ đếm sắp hết hàng khi tồn kho đổi (None = sản phẩm chưa có / đã xóa)."""
+    threshold = current_app.config['LOW_STOCK_THRESHOLD']
+    was_low = old_quantity is not None and old_quantity <= threshold
+    is_low = new_quantity is not None and new_quantity <= threshold
+    return int(is_low) - int(was_low)
+
+def order_counter_deltas(day, status, total_price, sign=1):
+    """Phần đóng góp của một đơn vào các bộ đếm. Đổi trạng thái = trừ phần của trạng thái
+    cũ (sign=-1) rồi cộng phần của trạng thái mới; số đơn trong ngày tự triệt tiêu."""
+    pending = sign if status == 'pending' else 0
+    return {
+        f'orders:{day.isoformat()}': sign,
+        f'orders_pending:{day.isoformat()}': pending,
+        'orders_pending': pending,
+        f'revenue:{day.isoformat()}': sign * total_price if status in REVENUE_STATUSES else 0,
+    }
+
+def rebuild_dashboard_counters():
+    """Xóa và tính lại mọi bộ đếm từ Order/Message/Product (quét bảng, chỉ dùng để backfill)."""
+    db.session.query(DashboardCounter).delete()
+    threshold = current_app.config['LOW_STOCK_THRESHOLD']
+    counters = {
+        'low_stock_threshold': threshold,
+        'unread_messages': db.session.query(db.func.count(Message.id)).filter(Message.is_read == False).scalar(),
+        'low_stock_products': db.session.query(db.func.count(Product.id))
+                                        .filter(Product.stock_quantity <= threshold).scalar(),
+        'orders_pending': 0,
+    }
+    day = db.func.date(Order.created_at)
+    rows = db.session.query(
+        day,
+        db.func.count(Order.id),
+        db.func.sum(db.case((Order.status == 'pending', 1), else_=0)),
+        db.func.sum(db.case((Order.status.in_(REVENUE_STATUSES), Order.total_price), else_=0)),
+    ).group_by(day)
+    for order_day, orders, pending, revenue in rows:
+        counters[f'orders:{order_day}'] = orders
+        counters[f'orders_pending:{order_day}'] = pending
+        counters[f'revenue:{order_day}'] = revenue
+        counters['orders_pending'] += pending
+    db.session.execute(db.insert(DashboardCounter),
+                       [{"key": key, "value": value} for key, value in counters.items()])
+    db.session.commit()
+    return len(counters)
+
+@core_bp.cli.command('rebuild-dashboard-counters')
+def rebuild_dashboard_counters_command():
+    """Tính lại bộ đếm KPI trang chính từ dữ liệu hiện có."""
+    db.create_all()
+    row_count = rebuild_dashboard_counters()
+    print(f"[Dashboard] Đã tính lại {row_count} bộ đếm.")
+
+def dashboard_kpis():
+    """KPI của trang chính: một truy vấn theo khóa chính trên dashboard_counter."""
+    today = datetime.datetime.utcnow().date().isoformat()
+    keys = {
+        'orders_today': f'orders:{today}',
+        'orders_pending_today': f'orders_pending:{today}',
+        'revenue_today': f'revenue:{today}',
+        'orders_pending': 'orders_pending',
+        'unread_messages': 'unread_messages',
+        'low_stock_products': 'low_stock_products',
+    }
+    values = dict(db.session.query(DashboardCounter.key, DashboardCounter.value)
+                  .filter(DashboardCounter.key.in_(list(keys.values()))))
+    kpis = {name: int(round(values.get(key, 0))) for name, key in keys.items()}
+    kpis['revenue_today'] = values.get(keys['revenue_today'], 0)
+    kpis['day'] = today
+    kpis['low_stock_threshold'] = current_app.config['LOW_STOCK_THRESHOLD']
+    return kpis
+
+
+# --- MIGRATION SCHEMA (CHỈ MỤC) VÀ KIỂM TRA KẾ HOẠCH TRUY VẤN ---
+@core_bp.cli.command('migrate-db')
+def migrate_db_command():
+    """Áp dụng các migration còn thiếu (chạy được khi server đang hoạt động)."""
+    db.create_all()
+    if not run_migrations(db.engine):
+        print("[Migration] Schema đã ở phiên bản mới nhất.")
+
+def hot_queries():
+    """Các truy vấn nóng, dựng bằng đúng các hàm mà route sử dụng."""
+    return [
+        ('transaction_page', orders_page_query({})),
+        ('transaction_page (lọc trạng thái)', orders_page_query({'status': 'pending'})),
+        ('transaction_page (selectinload items)',
+         db.session.query(OrderItem).filter(OrderItem.order_id.in_([1, 2, 3]))),
+        ('order_history_page', customer_orders_query(1)),
+        ('messages_page', messages_query()),
+        ('tin nhắn chưa đọc', db.session.query(Message).filter(Message.is_read == False)
+                                                       .order_by(Message.created_at.desc())),
+        ('doanh số theo sản phẩm', db.session.query(db.func.sum(OrderItem.quantity))
+                                             .filter(OrderItem.product_id == 1)),
+    ]
+
+@core_bp.cli.command('explain-hot-queries')
+def explain_hot_queries_command():
+    """In EXPLAIN QUERY PLAN của các truy vấn nóng; cảnh báo khi phải quét toàn bảng."""
+    if not search_index_enabled():
+        print("Chỉ hỗ trợ SQLite.")
+        return
+    pending = pending_migrations(db.engine)
+    if pending:
+        print(f"Lưu ý: còn {len(pending)} migration chưa chạy (flask migrate-db).")
+    full_scans = 0
+    for name, query in hot_queries():
+        sql = str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+        plan = db.session.execute(db.text("EXPLAIN QUERY PLAN " + sql)).all()
+        print(f"\n== {name}")
+        for row in plan:
+            detail = row[-1]
+            # 'SCAN <bảng>' không kèm 'USING ... INDEX' nghĩa là đọc toàn bộ bảng
+            is_full_scan = detail.startswith('SCAN') and 'INDEX' not in detail
+            full_scans += is_full_scan
+            print(f"   {detail}{'   <-- QUÉT TOÀN BẢNG' if is_full_scan else ''}")
+    print(f"\n{full_scans} bước quét toàn bảng.")
+
+
+# --- CACHE CATALOG (SẢN PHẨM, THƯ VIỆN ẢNH, THÔNG TIN LIÊN HỆ/THANH TOÁN) ---
+catalog_cache = app_service('catalog_cache')
+
+def get_catalog_version():
+    """Đọc phiên bản catalog từ DB (một lần cho mỗi request)."""
+    if 'catalog_version' not in g:
+        g.catalog_version = db.session.query(CatalogVersion.version).filter_by(id=1).scalar() or 0
+    return g.catalog_version
+
+def bump_catalog_version():
+    """Tăng phiên bản catalog trong transaction hiện tại (người gọi commit)."""
+    stmt = sqlite_insert(CatalogVersion).values(id=1, version=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['id'],
+        set_={"version": CatalogVersion.version + 1}
+    )
+    db.session.execute(stmt)
+    g.pop('catalog_version', None)
+
+def cached_catalog(key, loader):
+    return catalog_cache.get_or_load(key, get_catalog_version(), loader)
+
+
+# --- HÀNG ĐỢI VIỆC NỀN (BỀN VỮNG, LƯU TRONG SQLITE) ---
+# Request chỉ xếp việc (job_queue.enqueue) rồi trả về; worker chạy sau khi commit.
+job_queue = app_service('job_queue')
+# Hàm xử lý theo loại việc, dùng chung cho hàng đợi của mọi app
+JOB_HANDLERS = {}
+
+def job_handler(kind):
+    """Đăng ký hàm xử lý cho một loại việc (xem JobQueue.handler)."""
+    def decorator(f):
+        JOB_HANDLERS[kind] = f
+        return f
+    return decorator
+
+@db.event.listens_for(db.session, 'after_commit')
+def notify_job_workers(session):
+    if session.info.pop('job_enqueued', False):
+        job_queue.notify()
+
+@db.event.listens_for(db.session, 'after_rollback')
+def discard_job_flag(session):
+    session.info.pop('job_enqueued', None)
+
+@core_bp.before_app_request
+def start_job_workers():
+    # Khởi động lười ở request đầu tiên của mỗi tiến trình (kể cả worker gunicorn sau fork)
+    job_queue.start()
+
+@core_bp.cli.command('run-jobs')
+def run_jobs_command():
+    """Chạy worker hàng đợi việc nền trong tiến trình riêng (dùng với JOB_WORKERS=0 ở web)."""
+    workers = max(current_app.config['JOB_WORKERS'], 1)
+    threads = job_queue.start(workers)
+    print(f"[Jobs] {len(threads)} luồng worker đang chạy (Ctrl+C để dừng).")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        job_queue.stop()
+
+
+# --- XỬ LÝ ẢNH NỀN (BIẾN THỂ THUMBNAIL / WEBP) ---
+image_pool = None
+
+def get_image_pool():
+    """Tạo process pool khi cần lần đầu (dùng 'spawn' để không fork cả app/DB)."""
+    global image_pool
+    if image_pool is None:
+        from concurrent.futures import ProcessPoolExecutor
+        image_pool = ProcessPoolExecutor(
+            max_workers=current_app.config['IMAGE_WORKERS'],
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return image_pool
+
+def schedule_image_variants(folder_key, filename):
+    """Xếp việc tạo biến thể ảnh vào hàng đợi, commit cùng transaction của người gọi.
+    folder_key là khóa cấu hình (vd 'PRODUCT_UPLOAD_FOLDER'), không lưu đường dẫn tuyệt đối."""
+    if pillow_available():
+        job_queue.enqueue('image-variants', {'folder': folder_key, 'filename': filename})
+
+@job_handler('image-variants')
+def image_variants_job(payload):
+    folder = current_app.config[payload['folder']]
+    if not os.path.exists(os.path.join(folder, payload['filename'])):
+        return  # ảnh đã bị xóa trước khi tới lượt
+    # Phần nặng CPU chạy trong process pool, luồng worker chỉ chờ kết quả
+    get_image_pool().submit(generate_variants, folder, payload['filename']).result()
+
+# --- LƯU TRỮ UPLOAD THEO HASH NỘI DUNG ---
+# Tên tệp = <sha256 rút gọn>.<đuôi>, biến thể = <sha256 rút gọn>__<size>.<fmt>.
+# Nội dung đổi thì URL đổi, nên URL có thể cache 'immutable' 1 năm.
+HASHED_UPLOAD_RE = re.compile(r'^([0-9a-f]{%d})(?:__[a-z]+)?\.[a-z0-9]+$' % CONTENT_HASH_LENGTH)
+
+def is_content_addressed(filename):
+    return bool(HASHED_UPLOAD_RE.match(filename))
+
+def content_addressed_name(digest, original_filename):
+    ext = original_filename.rsplit('.', 1)[1].lower()
+    return f"{digest[:CONTENT_HASH_LENGTH]}.{ext}"
+
+def save_upload(file_storage, folder):
+    """Lưu tệp upload vào folder dưới tên theo hash nội dung, trả về tên tệp.
+    Tệp trùng nội dung sẽ dùng chung một tên (tự khử trùng lặp)."""
+    tmp_path = os.path.join(folder, f".upload-{uuid.uuid4().hex}.tmp")
+    digest = hashlib.sha256()
+    with open(tmp_path, 'wb') as out:
+        for chunk in iter(lambda: file_storage.stream.read(64 * 1024), b''):
+            digest.update(chunk)
+            out.write(chunk)
+    filename = content_addressed_name(digest.hexdigest(), secure_filename(file_storage.filename))
+    os.replace(tmp_path, os.path.join(folder, filename))
+    return filename
+
+# Cột tham chiếu tệp trong từng thư mục upload
+UPLOAD_COLUMNS = {
+    'PRODUCT_UPLOAD_FOLDER': Product.image_filename,
+    'GALLERY_UPLOAD_FOLDER': GalleryImage.filename,
+    'PAYMENT_UPLOAD_FOLDER': PaymentInfo.qr_code_filename,
+    'PROOF_UPLOAD_FOLDER': Order.payment_proof_filename,
+}
+
+def upload_in_use(column, filename, exclude_id=None):
+    """Kiểm tra còn dòng nào khác tham chiếu tới tệp (do tệp trùng nội dung dùng chung)."""
+    query = db.session.query(column.class_.id).filter(column == filename)
+    if exclude_id is not None:
+        query = query.filter(column.class_.id != exclude_id)
+    return query.first() is not None
+
+def remove_upload(folder, filename):
+    path = os.path.join(folder, filename)
+    if os.path.exists(path):
+        os.remove(path)
+    remove_variants(folder, filename)
+
+def schedule_upload_removal(folder_key, filename):
+    """Xếp việc xóa tệp upload và biến thể. Lúc chạy (sau commit) tệp chỉ bị xóa nếu
+    không còn dòng nào dùng, vì tệp trùng nội dung được dùng chung."""
+    job_queue.enqueue('remove-upload', {'folder': folder_key, 'filename': filename})
+
+@job_handler('remove-upload')
+def remove_upload_job(payload):
+    if not upload_in_use(UPLOAD_COLUMNS[payload['folder']], payload['filename']):
+        remove_upload(current_app.config[payload['folder']], payload['filename'])
+
+def send_upload_file(directory, name, immutable, private=False):
+    """Gửi tệp với ETag/If-None-Match và Range (send_file conditional).
+    Tệp theo hash nội dung được đánh dấu Cache-Control: max-age=1 năm, immutable
+    (public, hoặc private với ảnh chỉ người dùng được xem như ảnh chuyển khoản)."""
+    if immutable and is_content_addressed(name):
+        response = send_precompressed(directory, name, max_age=UPLOAD_IMMUTABLE_MAX_AGE, etag=name)
+        response.cache_control.immutable = True
+        if private:
+            response.cache_control.public = False
+            response.cache_control.private = True
+        return response
+    # Tên cũ (không theo hash) hoặc ảnh gốc thay cho biến thể chưa tạo xong: luôn kiểm tra lại
+    return send_precompressed(directory, name)
+
+def send_upload(folder, filename):
+    """Phục vụ ảnh upload. Với ?size=thumb|card|full sẽ trả biến thể WebP (nếu trình
+    duyệt hỗ trợ) hoặc JPEG; nếu biến thể chưa được tạo thì trả ảnh gốc."""
+    size = request.args.get('size')
+    if size in VARIANT_WIDTHS:
+        fmt = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpg'
+        variant_dir = os.path.join(folder, VARIANT_DIRNAME)
+        name = variant_filename(filename, size, fmt)
+        if os.path.exists(os.path.join(variant_dir, name)):
+            response = send_upload_file(variant_dir, name, immutable=True)
+            response.vary.add('Accept')
+            return response
+        # Không cache lâu ảnh gốc dưới URL của biến thể
+        return send_upload_file(folder, filename, immutable=False)
+    return send_upload_file(folder, filename, immutable=True)
+
+@core_bp.app_template_global()
+def upload_srcset(endpoint, filename):
+    """Chuỗi srcset cho ảnh upload, ví dụ: '/...?size=thumb 320w, /...?size=card 640w, ...'"""
+    return ', '.join(
+        f"{url_for(endpoint, filename=filename, size=size)} {width}w"
+        for size, width in VARIANT_WIDTHS.items()
+    )
+
+@core_bp.cli.command('generate-image-variants')
+def generate_image_variants_command():
+    """Tạo biến thể cho toàn bộ ảnh sẵn có trong các thư mục upload (backfill)."""
+    if not pillow_available():
+        print("[Images] Chưa cài Pillow (pip install Pillow), bỏ qua.")
+        return
+    jobs = []
+    for key in ('PRODUCT_UPLOAD_FOLDER', 'GALLERY_UPLOAD_FOLDER', 'PAYMENT_UPLOAD_FOLDER'):
+        folder = current_app.config[key]
+        if not os.path.isdir(folder):
+            continue
+        for filename in os.listdir(folder):
+            if os.path.isfile(os.path.join(folder, filename)) and allowed_file(filename):
+                jobs.append(get_image_pool().submit(generate_variants, folder, filename))
+    for job in jobs:
+        try:
+            job.result()
+        except Exception as e:
+            print(f"Lỗi khi tạo biến thể ảnh: {e}")
+    print(f"[Images] Đã xử lý {len(jobs)} ảnh.")
+
+
+@core_bp.cli.command('hash-uploads')
+def hash_uploads_command():
+    """Đổi tên các tệp upload cũ sang tên theo hash nội dung và cập nhật DB."""
+    renamed = 0
+    for folder_key, column in UPLOAD_COLUMNS.items():
+        folder = current_app.config[folder_key]
+        filenames = [row[0] for row in db.session.query(column).filter(column.isnot(None)).distinct()]
+        for filename in filenames:
+            path = os.path.join(folder, filename)
+            if is_content_addressed(filename) or not os.path.exists(path) or not allowed_file(filename):
+                continue
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(64 * 1024), b''):
+                    digest.update(chunk)
+            new_name = content_addressed_name(digest.hexdigest(), filename)
+            os.replace(path, os.path.join(folder, new_name))
+            remove_variants(folder, filename)
+            db.session.query(column.class_).filter(column == filename).update(
+                {column: new_name}, synchronize_session=False)
+            if folder_key != 'PROOF_UPLOAD_FOLDER':
+                schedule_image_variants(folder_key, new_name)
+            renamed += 1
+    bump_catalog_version()
+    db.session.commit()
+    print(f"[Uploads] Đã đổi tên {renamed} tệp sang tên theo hash nội dung "
+          "(biến thể ảnh được tạo bởi worker hàng đợi việc nền).")
+
+
+# --- BĂM MẬT KHẨU TRONG PROCESS POOL ---
+password_hasher = app_service('password_hasher')
+
+@core_bp.cli.command('hash-benchmark')
+def hash_benchmark_command():
+    """Đo thời gian băm của method hiện tại và vài mức cost khác để chọn cấu hình."""
+    candidates = [current_app.config['PASSWORD_HASH_METHOD'],
+                  'scrypt:16384:8:1', 'scrypt:32768:8:1', 'scrypt:65536:8:1',
+                  'pbkdf2:sha256:260000', 'pbkdf2:sha256:600000', 'pbkdf2:sha256:1000000']
+    for method in dict.fromkeys(candidates):
+        print(f"{method:<26} {benchmark_method(method):8.1f} ms/lần")
+
+
+# --- NÉN RESPONSE (GZIP/BROTLI) VÀ TỆP TĨNH NÉN SẴN ---
+# Đăng ký trước các hook đo hiệu năng để chạy SAU CÙNG (Flask gọi after_request theo
+# thứ tự ngược): thời gian nén được tính vào độ trễ của route.
+@core_bp.after_app_request
+def compress_response(response):
+    """Nén HTML/JSON động theo Accept-Encoding khi response đủ lớn."""
+    if not is_compressible(response.mimetype):
+        return response
+    # Cache trung gian phải tách bản nén và không nén, kể cả với 304 và response nhỏ
+    response.vary.add('Accept-Encoding')
+    if (response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.status_code < 200 or response.status_code in (204, 206, 304)):
+        return response
+    encoding = choose_encoding(request.accept_encodings, supported_encodings())
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < current_app.config['COMPRESSION_MIN_SIZE']:
+        return response
+    level = current_app.config['COMPRESSION_BROTLI_QUALITY'] if encoding == 'br' else current_app.config['COMPRESSION_GZIP_LEVEL']
+    response.set_data(compress_bytes(data, encoding, level))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(encoded_etag(etag, encoding), weak)
+    return response
+
+def send_precompressed(directory, filename, **kwargs):
+    """Như send_from_directory, nhưng gửi bản .br/.gz tạo bởi 'flask precompress-static'
+    (nếu còn mới) cho trình duyệt chấp nhận, kèm Content-Encoding và Vary."""
+    mimetype = mimetypes.guess_type(filename)[0]
+    if not is_compressible(mimetype):
+        return send_from_directory(directory, filename, **kwargs)
+    path = safe_join(directory, filename)
+    # Phục vụ bản nén sẵn không cần module brotli, chỉ cần tệp .br đã được build
+    available = [encoding for encoding in ENCODING_SUFFIXES
+                 if path and fresh_precompressed(path, encoding)]
+    encoding = choose_encoding(request.accept_encodings, available)
+    if encoding is None:
+        response = send_from_directory(directory, filename, **kwargs)
+    else:
+        if isinstance(kwargs.get('etag'), str):
+            kwargs['etag'] = encoded_etag(kwargs['etag'], encoding)
+        response = send_from_directory(directory, filename + ENCODING_SUFFIXES[encoding],
+                                       mimetype=mimetype, **kwargs)
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+def serve_static(filename):
+    # Thay view 'static' mặc định của Flask (gán trong create_app)
+    return send_precompressed(current_app.static_folder, filename,
+                              max_age=current_app.get_send_file_max_age(filename))
+
+@core_bp.cli.command('precompress-static')
+def precompress_static_command():
+    """Bước build: ghi bản .gz/.br cạnh các tệp văn bản (CSS/JS/SVG...) trong static/."""
+    if not brotli_available():
+        print("[Compression] Chưa cài brotli (pip install brotli), chỉ tạo bản .gz.")
+    checked, written = precompress_tree(current_app.static_folder, current_app.config['COMPRESSION_MIN_SIZE'])
+    for path in written:
+        print(f"  {os.path.relpath(path, current_app.static_folder)}")
+    print(f"[Compression] Đã xét {checked} tệp, ghi {len(written)} bản nén.")
+
+
+# --- ĐO HIỆU NĂNG: THỜI GIAN REQUEST VÀ SQL THEO ENDPOINT ---
+metrics_registry = app_service('metrics_registry')
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+@db.event.listens_for(Engine, 'before_cursor_execute')
+def metrics_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.metrics_started = time.perf_counter()
+
+@db.event.listens_for(Engine, 'after_cursor_execute')
+def metrics_after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is None or not has_request_context() or 'metrics_started' not in g:
+        return
+    g.sql_statements += 1
+    g.sql_seconds += time.perf_counter() - context.metrics_started
+    if 'query_shapes' in g:
+        g.query_shapes[statement_shape(statement)] += 1
+
+@core_bp.before_app_request
+def start_request_metrics():
+    g.metrics_started = time.perf_counter()
+    g.sql_statements = 0
+    g.sql_seconds = 0.0
+    if current_app.debug or current_app.config['QUERY_GUARD'] or current_app.config['QUERY_GUARD_STRICT']:
+        g.query_shapes = Counter()
+
+@core_bp.after_app_request
+def record_request_metrics(response):
+    # Chạy cả với lỗi 500 (Flask gọi after_request cho response lỗi)
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        metrics_registry.observe(request.endpoint or 'unmatched', response.status_code,
+                                 time.perf_counter() - started, g.sql_statements, g.sql_seconds)
+    return response
+
+@core_bp.after_app_request
+def check_query_budget(response):
+    """So số truy vấn của request với @query_budget của route và tìm truy vấn lặp."""
+    shapes = g.pop('query_shapes', None)
+    if shapes is None:
+        return response
+    view = current_app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', None)
+    repeat_threshold = None if getattr(view, 'query_allow_repeats', False) \
+        else current_app.config['QUERY_GUARD_REPEAT_THRESHOLD']
+    response.headers['X-Query-Count'] = str(sum(shapes.values()))
+    problems = find_problems(shapes, budget, repeat_threshold)
+    if problems:
+        message = f"[Query Guard] {request.method} {request.path} ({request.endpoint}): " + "; ".join(problems)
+        if current_app.config['QUERY_GUARD_STRICT']:
+            raise QueryBudgetExceeded(message)
+        print(message)
+    return response
+
+
+# --- SỰ KIỆN THỜI GIAN THỰC CHO ADMIN (SSE) ---
+# Đánh thức các luồng SSE của tiến trình này ngay khi có sự kiện mới được commit
+admin_event_signal = threading.Condition()
+_last_admin_event_prune = [0.0]
+
+def record_admin_event(kind, payload):
+    """Ghi sự kiện vào transaction hiện tại (người gọi commit)."""
+    db.session.add(AdminEvent(kind=kind, payload=json.dumps(payload, ensure_ascii=False)))
+    mark_admin_events_pending()
+
+def record_admin_events(kind, payloads):
+    """Như record_admin_event cho nhiều sự kiện cùng loại, bằng một lệnh INSERT hàng loạt."""
+    if not payloads:
+        return
+    db.session.execute(db.insert(AdminEvent), [
+        {"kind": kind, "payload": json.dumps(payload, ensure_ascii=False)} for payload in payloads
+    ])
+    mark_admin_events_pending()
+
+def mark_admin_events_pending():
+    """Báo các luồng SSE sau khi commit; mỗi giờ dọn sự kiện cũ một lần."""
+    db.session.info['admin_event_pending'] = True
+    if time.monotonic() - _last_admin_event_prune[0] > 3600:
+        _last_admin_event_prune[0] = time.monotonic()
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(hours=current_app.config['ADMIN_EVENT_RETENTION_HOURS'])
+        db.session.query(AdminEvent).filter(AdminEvent.created_at < cutoff).delete(synchronize_session=False)
+
+@db.event.listens_for(db.session, 'after_commit')
+def notify_admin_event_streams(session):
+    if session.info.pop('admin_event_pending', False):
+        with admin_event_signal:
+            admin_event_signal.notify_all()
+
+@db.event.listens_for(db.session, 'after_rollback')
+def discard_admin_event_flag(session):
+    session.info.pop('admin_event_pending', None)
+
+def format_sse(event_id, kind, data):
+    return f"id: {event_id}\nevent: {kind}\ndata: {data}\n\n"
+
 
 ADMIN_ACCOUNTS = {
     "000000001": "admin_hoahuongduong_1",
@@ -111,14 +1105,14 @@ ADMIN_ACCOUNTS = {
     "000000003": "admin_hoacanxa_3"
 }
 
-def initialize_data():
-    with app.app_context():
+def initialize_data(flask_app=None):
+    with setup_context(flask_app):
         try:
             for phone, password in ADMIN_ACCOUNTS.items():
                 admin_user = db.session.query(User).filter_by(phone=phone).first()
                 if not admin_user:
                     print(f"[Admin Setup] Tạo tài khoản admin: {phone}")
-                    hashed_password = generate_password_hash(password)
+                    hashed_password = generate_password_hash(password, method=current_app.config['PASSWORD_HASH_METHOD'])
                     new_admin = User(phone=phone, password_hash=hashed_password)
                     db.session.add(new_admin)
             
@@ -140,7 +1134,23 @@ def initialize_data():
                 default_payment = PaymentInfo(id=1)
                 db.session.add(default_payment)
 
+            if not db.session.get(CatalogVersion, 1):
+                db.session.add(CatalogVersion(id=1, version=0))
+
             db.session.commit()
+
+            # DB cũ chưa có bộ đếm KPI, hoặc ngưỡng sắp hết hàng vừa đổi -> tính lại một lần
+            stored_threshold = db.session.get(DashboardCounter, 'low_stock_threshold')
+            if stored_threshold is None or stored_threshold.value != current_app.config['LOW_STOCK_THRESHOLD']:
+                print("[Setup] Tính lại bộ đếm KPI trang chính.")
+                rebuild_dashboard_counters()
+
+            # DB cũ đã có đơn nhưng chưa có bảng tổng hợp doanh số -> backfill một lần, nếu không
+            # trang thống kê trống và đổi trạng thái đơn cũ sẽ ghi số âm vào sales_rollup
+            has_rollup = db.session.query(db.select(SalesRollup.day).exists()).scalar()
+            if not has_rollup and db.session.query(db.select(OrderItem.id).exists()).scalar():
+                print("[Setup] Tính lại bảng tổng hợp doanh số.")
+                rebuild_sales_rollup()
         except Exception as e:
             db.session.rollback()
             print(f"Lỗi khi khởi tạo dữ liệu: {e}")
@@ -196,6 +1206,10 @@ def customer_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+@quanly_bp.errorhandler(HashingBusy)
+def handle_hashing_busy(e):
+    return jsonify({"message": "Hệ thống đang bận, vui lòng thử lại sau giây lát."}), 503
+
 # --- TUYẾN ĐƯỜNG ADMIN: Đăng nhập / Đăng xuất ---
 @quanly_bp.route('/')
 def show_login_page():
@@ -220,7 +1234,7 @@ def register_api():
     if existing_user:
         return jsonify({"message": "Số điện thoại đã tồn tại"}), 400
         
-    hashed_password = generate_password_hash(password)
+    hashed_password = password_hasher.hash(password)
     new_user = User(phone=phone, password_hash=hashed_password)
     db.session.add(new_user)
     db.session.commit()
@@ -232,8 +1246,14 @@ def login_api():
     phone = data.get('phone')
     password = data.get('password')
     user = db.session.query(User).filter_by(phone=phone).first()
-    if not user or not check_password_hash(user.password_hash, password):
+    if not user or not password or not password_hasher.verify(user.password_hash, password):
         return jsonify({"message": "Sai số điện thoại hoặc mật khẩu"}), 401
+
+    # Hash tạo với tham số cũ -> băm lại theo cấu hình hiện tại (người dùng không nhận ra)
+    if password_hasher.needs_rehash(user.password_hash):
+        user.password_hash = password_hasher.hash(password)
+        db.session.commit()
+        password_hasher.mark_upgraded()
     
     is_admin = phone in ADMIN_ACCOUNTS
     
@@ -242,7 +1262,9 @@ def login_api():
     session['is_admin'] = is_admin
     
     if is_admin:
-        session.pop('cart', None) 
+        cart_id = session.pop('cart_id', None)
+        if cart_id:
+            cart_store.delete(cart_id)
 
     return jsonify({"message": "Đăng nhập thành công!", "is_admin": is_admin }), 200
 
@@ -278,51 +1300,327 @@ def reset_password_api():
     if not validate_password(new_password):
         return jsonify({"message": "Mật khẩu mới phải ít nhất 8 ký tự, chứa cả chữ và số."}), 400
         
-    if check_password_hash(user.password_hash, new_password):
+    # Kiểm tra trùng mật khẩu cũ và băm mật khẩu mới chạy song song trong pool
+    same_as_old, new_hash = password_hasher.verify_and_hash(user.password_hash, new_password, new_password)
+    if same_as_old:
         return jsonify({"message": "Mật khẩu mới không được trùng với mật khẩu cũ."}), 400
     
-    user.password_hash = generate_password_hash(new_password)
+    user.password_hash = new_hash
     db.session.commit()
     return jsonify({"message": "Đã cập nhật mật khẩu thành công!"}), 200
 
 
 # --- TUYẾN ĐƯỜNG ADMIN: Các trang được bảo vệ ---
 @quanly_bp.route('/main-page')
+@query_budget(2)
 @admin_required
 def main_page():
-    return render_template('main.html')
+    return render_template('main.html', kpis=dashboard_kpis())
+
+@quanly_bp.route('/api/dashboard')
+@query_budget(1)
+@admin_required
+def dashboard_api():
+    """KPI trang chính (JSON) để trang tự làm mới khi có sự kiện mới."""
+    return jsonify(dashboard_kpis())
+
+# --- PHÂN TRANG ĐƠN HÀNG (KEYSET THEO created_at, id) ---
+def encode_order_cursor(order):
+    """Tạo cursor dạng 'created_at_iso|id' từ đơn hàng cuối cùng của trang."""
+    return f"{order.created_at.isoformat()}|{order.id}"
+
+def decode_order_cursor(cursor):
+    """Giải mã cursor, trả về (created_at, id). Ném ValueError nếu sai định dạng."""
+    created_at_str, order_id_str = cursor.rsplit('|', 1)
+    return datetime.datetime.fromisoformat(created_at_str), int(order_id_str)
+
+def parse_order_filters(args):
+    """Đọc bộ lọc (status, phone, date_from, date_to) từ query string.
+    Ném ValueError nếu giá trị không hợp lệ."""
+    filters = {
+        'status': args.get('status', '').strip(),
+        'phone': args.get('phone', '').strip(),
+        'date_from': args.get('date_from', '').strip(),
+        'date_to': args.get('date_to', '').strip(),
+    }
+    if filters['status'] and filters['status'] not in ORDER_STATUSES:
+        raise ValueError("Trạng thái không hợp lệ")
+    for key in ('date_from', 'date_to'):
+        if filters[key]:
+            try:
+                datetime.datetime.strptime(filters[key], '%Y-%m-%d')
+            except ValueError:
+                raise ValueError("Ngày phải có định dạng YYYY-MM-DD")
+    # Bỏ các bộ lọc rỗng để URL phân trang gọn gàng
+    return {key: value for key, value in filters.items() if value}
+
+def apply_order_filters(query, filters):
+    """Áp dụng bộ lọc lên truy vấn Order. date_to được tính trọn ngày."""
+    if filters.get('status'):
+        query = query.filter(Order.status == filters['status'])
+    if filters.get('phone'):
+        query = query.filter(Order.customer_phone.startswith(filters['phone'], autoescape=True))
+    if filters.get('date_from'):
+        date_from = datetime.datetime.strptime(filters['date_from'], '%Y-%m-%d')
+        query = query.filter(Order.created_at >= date_from)
+    if filters.get('date_to'):
+        date_to = datetime.datetime.strptime(filters['date_to'], '%Y-%m-%d') + datetime.timedelta(days=1)
+        query = query.filter(Order.created_at < date_to)
+    return query
+
+def orders_page_query(filters, cursor=None, per_page=ORDERS_PER_PAGE):
+    """Truy vấn một trang đơn hàng (mới nhất trước) sau vị trí cursor, lấy dư 1 dòng."""
+    query = apply_order_filters(db.session.query(Order), filters)
+
+    if cursor:
+        cursor_created_at, cursor_id = decode_order_cursor(cursor)
+        query = query.filter(db.or_(
+            Order.created_at < cursor_created_at,
+            db.and_(Order.created_at == cursor_created_at, Order.id < cursor_id)
+        ))
+
+    # Lấy dư 1 dòng để biết còn trang sau hay không.
+    # Dùng selectinload thay vì joinedload để LIMIT áp dụng đúng lên Order.
+    return query.options(
+        db.selectinload(Order.items).selectinload(OrderItem.product)
+    ).order_by(Order.created_at.desc(), Order.id.desc()).limit(per_page + 1)
+
+def query_orders_page(filters, cursor=None, per_page=ORDERS_PER_PAGE):
+    """Lấy một trang đơn hàng (mới nhất trước) sau vị trí cursor.
+    Trả về (orders, next_cursor). next_cursor là None nếu đã hết."""
+    orders = orders_page_query(filters, cursor, per_page).all()
+
+    next_cursor = None
+    if len(orders) > per_page:
+        orders = orders[:per_page]
+        next_cursor = encode_order_cursor(orders[-1])
+    return orders, next_cursor
+
+def serialize_order(order):
+    return {
+        "id": order.id,
+        "customer_id": order.customer_id,
+        "customer_name": order.customer_name,
+        "customer_phone": order.customer_phone,
+        "customer_address": order.customer_address,
+        "total_price": order.total_price,
+        "payment_method": order.payment_method,
+        "status": order.status,
+        "created_at": order.created_at.isoformat(),
+        "payment_proof_url": url_for('quanlybanhang.serve_proof_upload', filename=order.payment_proof_filename)
+                             if order.payment_proof_filename else None,
+        "items": [{
+            "product_id": item.product_id,
+            "product_name": item.product.name if item.product else None,
+            "quantity": item.quantity,
+            "price_at_purchase": item.price_at_purchase,
+        } for item in order.items]
+    }
 
 @quanly_bp.route('/transaction')
+@query_budget(4)
 @admin_required
 def transaction_page():
+    cursor = request.args.get('cursor', '')
     try:
-        orders = db.session.query(Order).options(
-            db.joinedload(Order.items).joinedload(OrderItem.product)
-        ).order_by(Order.created_at.desc()).all()
+        filters = parse_order_filters(request.args)
+    except ValueError as e:
+        flash(str(e), "error")
+        filters = {}
+    try:
+        orders, next_cursor = query_orders_page(filters, cursor or None)
+    except ValueError:
+        flash("Cursor phân trang không hợp lệ, đã quay về trang đầu.", "error")
+        orders, next_cursor = query_orders_page(filters)
+        cursor = ''
     except Exception as e:
         print(f"Lỗi truy vấn đơn hàng: {e}")
-        orders = []
-    return render_template('transaction.html', orders=orders)
+        orders, next_cursor = [], None
+    return render_template('transaction.html',
+                           orders=orders,
+                           filters=filters,
+                           statuses=ORDER_STATUSES,
+                           is_first_page=not cursor,
+                           next_cursor=next_cursor)
+
+@quanly_bp.route('/api/orders', methods=['GET'])
+@query_budget(4)
+@admin_required
+def list_orders_api():
+    try:
+        filters = parse_order_filters(request.args)
+        per_page = min(max(int(request.args.get('limit', ORDERS_PER_PAGE)), 1), 200)
+        orders, next_cursor = query_orders_page(filters, request.args.get('cursor') or None, per_page)
+    except ValueError as e:
+        return jsonify({"message": f"Tham số không hợp lệ: {e}"}), 400
+    return jsonify({
+        "orders": [serialize_order(o) for o in orders],
+        "next_cursor": next_cursor
+    }), 200
+
+# --- XUẤT ĐƠN HÀNG CHO KẾ TOÁN ---
+ORDER_EXPORT_FORMATS = ('csv', 'ndjson')
+ORDER_EXPORT_COLUMNS = [
+    'order_id', 'created_at', 'status', 'customer_id', 'customer_name', 'customer_phone',
+    'customer_address', 'payment_method', 'order_total',
+    'item_id', 'product_id', 'product_name', 'quantity', 'price_at_purchase', 'line_total',
+]
+
+def order_export_query(filters):
+    """Một dòng cho mỗi OrderItem (đơn không có món vẫn ra một dòng), sắp theo đơn
+    cũ nhất trước để các món của cùng một đơn luôn liền nhau."""
+    query = (
+        db.select(
+            Order.id.label('order_id'), Order.created_at, Order.status, Order.customer_id,
+            Order.customer_name, Order.customer_phone, Order.customer_address,
+            Order.payment_method, Order.total_price.label('order_total'),
+            OrderItem.id.label('item_id'), OrderItem.product_id, Product.name.label('product_name'),
+            OrderItem.quantity, OrderItem.price_at_purchase,
+        )
+        .select_from(Order)
+        .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+        .outerjoin(Product, Product.id == OrderItem.product_id)
+    )
+    return apply_order_filters(query, filters).order_by(Order.created_at, Order.id, OrderItem.id)
+
+def iter_order_export_rows(engine, filters, batch_size):
+    """Đọc kết quả xuất theo lô yield_per trên kết nối riêng (không giữ gì trong session)."""
+    with engine.connect() as conn:
+        result = conn.execution_options(yield_per=batch_size).execute(order_export_query(filters))
+        for row in result:
+            yield row
+
+def generate_order_csv(rows, batch_size):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM để Excel nhận đúng UTF-8 (tên khách, địa chỉ tiếng Việt)
+    buffer.write('\ufeff')
+    writer.writerow(ORDER_EXPORT_COLUMNS)
+    pending = 0
+    for row in rows:
+        line_total = row.quantity * row.price_at_purchase if row.item_id is not None else None
+        writer.writerow([
+            row.order_id, row.created_at.isoformat(sep=' '), row.status, row.customer_id,
+            row.customer_name, row.customer_phone, row.customer_address, row.payment_method,
+            row.order_total, row.item_id, row.product_id, row.product_name, row.quantity,
+            row.price_at_purchase, line_total,
+        ])
+        pending += 1
+        # Gửi theo lô thay vì từng dòng để không tạo hàng triệu chunk nhỏ
+        if pending >= batch_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
+
+def generate_order_ndjson(rows, batch_size):
+    """Mỗi dòng một đơn kèm danh sách món. Các món của một đơn liền nhau trong kết quả
+    nên chỉ cần giữ đơn đang dựng, không gom cả tập kết quả."""
+    chunk, pending, current = [], 0, None
+    for row in rows:
+        if current is None or current['id'] != row.order_id:
+            if current is not None:
+                chunk.append(json.dumps(current, ensure_ascii=False) + '\n')
+                pending += 1
+            current = {
+                'id': row.order_id,
+                'created_at': row.created_at.isoformat(),
+                'status': row.status,
+                'customer_id': row.customer_id,
+                'customer_name': row.customer_name,
+                'customer_phone': row.customer_phone,
+                'customer_address': row.customer_address,
+                'payment_method': row.payment_method,
+                'total_price': row.order_total,
+                'items': [],
+            }
+        if row.item_id is not None:
+            current['items'].append({
+                'id': row.item_id,
+                'product_id': row.product_id,
+                'product_name': row.product_name,
+                'quantity': row.quantity,
+                'price_at_purchase': row.price_at_purchase,
+            })
+        if pending >= batch_size:
+            yield ''.join(chunk)
+            chunk, pending = [], 0
+    if current is not None:
+        chunk.append(json.dumps(current, ensure_ascii=False) + '\n')
+    yield ''.join(chunk)
+
+@quanly_bp.route('/api/orders/export', methods=['GET'])
+@query_budget(1)
+@admin_required
+def export_orders_api():
+    """Xuất đơn hàng + chi tiết đơn dạng luồng (format=csv|ndjson), cùng bộ lọc với
+    trang giao dịch (status, phone, date_from, date_to).
+
+    Response là generator: dữ liệu đọc theo lô yield_per và gửi dần, nên bộ nhớ không
+    phụ thuộc số đơn. Trong lúc xuất giữ một transaction đọc trên SQLite (chế độ WAL
+    không chặn ghi).
+    """
+    export_format = request.args.get('format', 'csv').strip().lower()
+    if export_format not in ORDER_EXPORT_FORMATS:
+        return jsonify({"message": "Định dạng xuất phải là csv hoặc ndjson"}), 400
+    try:
+        filters = parse_order_filters(request.args)
+    except ValueError as e:
+        return jsonify({"message": f"Tham số không hợp lệ: {e}"}), 400
+    # Luồng tự mượn kết nối khi được đọc; không giữ kết nối của session suốt lúc tải
+    db.session.close()
+
+    engine = db.engine
+    batch_size = current_app.config['ORDER_EXPORT_BATCH']
+    rows = iter_order_export_rows(engine, filters, batch_size)
+    if export_format == 'csv':
+        body, mimetype = generate_order_csv(rows, batch_size), 'text/csv'
+    else:
+        body, mimetype = generate_order_ndjson(rows, batch_size), 'application/x-ndjson'
+
+    filename = 'don-hang-' + '_'.join(
+        [filters.get('date_from', 'dau'), filters.get('date_to', datetime.date.today().isoformat())]
+        + ([filters['status']] if filters.get('status') else [])
+    ) + '.' + export_format
+    response = Response(body, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 # *** START: THÊM ROUTE THỐNG KÊ MỚI ***
 @quanly_bp.route('/statistics')
+@query_budget(2)
 @admin_required
 def statistics_page():
+    date_from = request.args.get('date_from', '').strip()
+    date_to = request.args.get('date_to', '').strip()
     try:
-        # Truy vấn để thống kê doanh thu theo sản phẩm
+        # Đọc doanh thu từ bảng tổng hợp sales_rollup thay vì quét toàn bộ lịch sử đơn hàng.
         # Chỉ tính các đơn hàng đã 'confirmed' (xác nhận), 'shipped' (đang giao), 'delivered' (đã giao)
         stats_query = db.session.query(
             Product.name,
-            db.func.sum(OrderItem.quantity).label('total_quantity_sold'),
-            db.func.sum(OrderItem.quantity * OrderItem.price_at_purchase).label('total_revenue')
+            db.func.sum(SalesRollup.quantity).label('total_quantity_sold'),
+            db.func.sum(SalesRollup.revenue).label('total_revenue')
         ).join(
-            OrderItem, OrderItem.product_id == Product.id
-        ).join(
-            Order, OrderItem.order_id == Order.id
+            SalesRollup, SalesRollup.product_id == Product.id
         ).filter(
-            Order.status.in_(['confirmed', 'shipped', 'delivered'])
-        ).group_by(
+            SalesRollup.status.in_(REVENUE_STATUSES)
+        )
+
+        # Lọc theo khoảng ngày đặt hàng (tính trọn ngày date_to)
+        if date_from:
+            stats_query = stats_query.filter(
+                SalesRollup.day >= datetime.datetime.strptime(date_from, '%Y-%m-%d').date())
+        if date_to:
+            stats_query = stats_query.filter(
+                SalesRollup.day <= datetime.datetime.strptime(date_to, '%Y-%m-%d').date())
+
+        stats_query = stats_query.group_by(
             Product.name
+        ).having(
+            db.func.sum(SalesRollup.quantity) > 0
         ).order_by(
             db.desc('total_revenue') # Sắp xếp theo doanh thu giảm dần
         ).all()
@@ -335,22 +1633,27 @@ def statistics_page():
             'statistic.html', 
             stats_data=stats_query,
             total_revenue_all=total_revenue_all,
-            total_items_all=total_items_all
+            total_items_all=total_items_all,
+            date_from=date_from,
+            date_to=date_to
         )
 
     except Exception as e:
         print(f"Lỗi khi truy vấn thống kê: {e}")
         flash(f"Không thể tải thống kê: {str(e)}", "error")
-        return render_template('statistic.html', stats_data=[], total_revenue_all=0, total_items_all=0)
+        return render_template('statistic.html', stats_data=[], total_revenue_all=0, total_items_all=0,
+                               date_from=date_from, date_to=date_to)
 # *** END: THÊM ROUTE THỐNG KÊ MỚI ***
 
 @quanly_bp.route('/products')
+@query_budget(2)
 @admin_required
 def products_page():
     products = Product.query.all()
     return render_template('products.html', products=products)
 
 @quanly_bp.route('/settings', methods=['GET', 'POST'])
+@query_budget(6)
 @admin_required
 def settings_page():
     info = db.session.get(ContactInfo, 1) 
@@ -374,18 +1677,16 @@ def settings_page():
                 if 'qr_image' in request.files:
                     file = request.files['qr_image']
                     if file and file.filename != '' and allowed_file(file.filename):
-                        if payment_info.qr_code_filename:
-                            old_path = os.path.join(app.config['PAYMENT_UPLOAD_FOLDER'], payment_info.qr_code_filename)
-                            if os.path.exists(old_path):
-                                os.remove(old_path)
-                                
-                        filename = secure_filename(file.filename)
-                        save_path = os.path.join(app.config['PAYMENT_UPLOAD_FOLDER'], filename)
-                        file.save(save_path)
+                        filename = save_upload(file, current_app.config['PAYMENT_UPLOAD_FOLDER'])
+                        old_filename = payment_info.qr_code_filename
+                        if old_filename and old_filename != filename:
+                            schedule_upload_removal('PAYMENT_UPLOAD_FOLDER', old_filename)
                         payment_info.qr_code_filename = filename
+                        schedule_image_variants('PAYMENT_UPLOAD_FOLDER', filename)
                         
                 flash("Cập nhật thông tin thanh toán thành công!", "success")
 
+            bump_catalog_version()
             db.session.commit()
         except Exception as e:
             db.session.rollback()
@@ -395,6 +1696,7 @@ def settings_page():
     return render_template('settings.html', info=info, payment_info=payment_info)
 
 @quanly_bp.route('/gallery', methods=['GET'])
+@query_budget(2)
 @admin_required
 def gallery_page():
     images = GalleryImage.query.all()
@@ -404,16 +1706,42 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def messages_query():
+    return db.session.query(Message).order_by(Message.created_at.desc())
+
 @quanly_bp.route('/messages')
+@query_budget(2)
 @admin_required
 def messages_page():
     try:
-        messages = db.session.query(Message).order_by(Message.created_at.desc()).all()
+        messages = messages_query().all()
     except Exception as e:
         print(f"Lỗi truy vấn tin nhắn: {e}")
         messages = []
     return render_template('messages.html', messages=messages)
 
+@quanly_bp.route('/jobs')
+@query_budget(2)
+@admin_required
+def jobs_page():
+    """Tình trạng hàng đợi việc nền: số việc theo trạng thái và các việc gần nhất."""
+    status = request.args.get('status')
+    query = db.session.query(BackgroundJob)
+    if status in JOB_STATUSES:
+        query = query.filter(BackgroundJob.status == status)
+    jobs = query.order_by(BackgroundJob.id.desc()).limit(100).all()
+    return render_template('jobs.html', jobs=jobs, counts=job_queue.status_counts(),
+                           current_status=status if status in JOB_STATUSES else None)
+
+@quanly_bp.route('/jobs/retry/<int:job_id>', methods=['POST'])
+@admin_required
+def retry_job(job_id):
+    if job_queue.retry(job_id):
+        flash(f"Đã đưa việc #{job_id} về hàng đợi.", "success")
+    else:
+        flash(f"Việc #{job_id} không ở trạng thái thất bại.", "error")
+    return redirect(url_for('quanlybanhang.jobs_page', status=request.args.get('status')))
+
 # --- TUYẾN ĐƯỜNG ADMIN: API ---
 
 # *** ĐÃ SỬA LỖI ***
@@ -437,22 +1765,13 @@ def add_gallery_image_api():
         return jsonify({"message": "Chưa chọn tệp nào"}), 400
 
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        save_path = os.path.join(app.config['GALLERY_UPLOAD_FOLDER'], filename)
-        
-        # Chống ghi đè file
-        count = 1
-        original_filename = filename
-        while os.path.exists(save_path):
-            name, ext = os.path.splitext(original_filename)
-            filename = f"{name}_{count}{ext}"
-            save_path = os.path.join(app.config['GALLERY_UPLOAD_FOLDER'], filename)
-            count += 1
-            
-        file.save(save_path)
+        # Lưu theo hash nội dung (không cần chống ghi đè: cùng tên = cùng nội dung)
+        filename = save_upload(file, current_app.config['GALLERY_UPLOAD_FOLDER'])
         
         new_image = GalleryImage(filename=filename, description=description)
         db.session.add(new_image)
+        schedule_image_variants('GALLERY_UPLOAD_FOLDER', filename)
+        bump_catalog_version()
         db.session.commit()
         
         # Trả về JSON chứa thông tin ảnh mới để JS render
@@ -476,11 +1795,10 @@ def delete_gallery_image_api(image_id):
     if not image:
         return jsonify({"message": "Không tìm thấy ảnh"}), 404
     try:
-        image_path = os.path.join(app.config['GALLERY_UPLOAD_FOLDER'], image.filename)
-        if os.path.exists(image_path):
-            os.remove(image_path)
-            
+        # Tệp được xóa sau commit bởi worker (nếu không còn ảnh nào khác dùng chung)
+        schedule_upload_removal('GALLERY_UPLOAD_FOLDER', image.filename)
         db.session.delete(image)
+        bump_catalog_version()
         db.session.commit()
         return jsonify({"message": "Xóa ảnh thành công"}), 200
     except Exception as e:
@@ -507,19 +1825,8 @@ def add_product_api():
         return jsonify({"message": "Không có file ảnh nào được chọn"}), 400
 
     if image_file and allowed_file(image_file.filename):
-        filename = secure_filename(image_file.filename)
-        
-        # Chống ghi đè file (giống gallery)
-        save_path = os.path.join(app.config['PRODUCT_UPLOAD_FOLDER'], filename)
-        count = 1
-        original_filename = filename
-        while os.path.exists(save_path):
-            name_part, ext = os.path.splitext(original_filename)
-            filename = f"{name_part}_{count}{ext}"
-            save_path = os.path.join(app.config['PRODUCT_UPLOAD_FOLDER'], filename)
-            count += 1
-            
-        image_file.save(save_path)
+        # Lưu theo hash nội dung (giống gallery)
+        filename = save_upload(image_file, current_app.config['PRODUCT_UPLOAD_FOLDER'])
 
         new_product = Product(
             name=name, 
@@ -529,6 +1836,9 @@ def add_product_api():
             stock_quantity=int(stock_quantity)
         )
         db.session.add(new_product)
+        bump_dashboard_counters({'low_stock_products': low_stock_delta(None, new_product.stock_quantity)})
+        schedule_image_variants('PRODUCT_UPLOAD_FOLDER', filename)
+        bump_catalog_version()
         db.session.commit()
         
         # Trả về JSON chứa thông tin sản phẩm mới
@@ -558,6 +1868,7 @@ def update_product_price_api():
         return jsonify({"message": "Không tìm thấy sản phẩm"}), 404
     try:
         product.price = float(new_price)
+        bump_catalog_version()
         db.session.commit()
         return jsonify({"message": "Cập nhật giá thành công"}), 200
     except Exception as e:
@@ -574,13 +1885,271 @@ def update_product_stock_api():
     if not product:
         return jsonify({"message": "Không tìm thấy sản phẩm"}), 404
     try:
+        old_stock = product.stock_quantity
         product.stock_quantity = int(new_stock)
+        bump_dashboard_counters({'low_stock_products': low_stock_delta(old_stock, product.stock_quantity)})
+        bump_catalog_version()
         db.session.commit()
         return jsonify({"message": "Cập nhật số lượng thành công"}), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": f"Lỗi: {e}"}), 500
 
+# --- CẬP NHẬT GIÁ / TỒN KHO HÀNG LOẠT ---
+def parse_product_patch(item):
+    """Đọc một thay đổi {product_id, new_price?, new_stock?}, trả về (product_id, values).
+    Ném ValueError nếu dữ liệu không hợp lệ."""
+    if not isinstance(item, dict):
+        raise ValueError("Mỗi phần tử phải là object")
+    try:
+        product_id = int(item.get('product_id'))
+    except (TypeError, ValueError):
+        raise ValueError("product_id không hợp lệ")
+    values = {}
+    if item.get('new_price') is not None:
+        try:
+            price = float(item['new_price'])
+        except (TypeError, ValueError):
+            raise ValueError("Giá không hợp lệ")
+        if not math.isfinite(price) or price < 0:
+            raise ValueError("Giá phải là số không âm")
+        values['price'] = price
+    if item.get('new_stock') is not None:
+        try:
+            stock = int(item['new_stock'])
+        except (TypeError, ValueError):
+            raise ValueError("Số lượng tồn kho không hợp lệ")
+        if stock < 0:
+            raise ValueError("Số lượng tồn kho phải không âm")
+        values['stock_quantity'] = stock
+    if not values:
+        raise ValueError("Cần ít nhất new_price hoặc new_stock")
+    return product_id, values
+
+@quanly_bp.route('/api/products/batch-update', methods=['POST'])
+@query_budget(6)
+@admin_required
+def batch_update_products_api():
+    """Áp dụng nhiều thay đổi giá/tồn kho trong một transaction, một lần commit.
+
+    Body: {"updates": [{"product_id": 1, "new_price": 120000, "new_stock": 30}, ...]}.
+    Tất cả hoặc không: chỉ cần một phần tử sai hoặc không tìm thấy sản phẩm thì không
+    thay đổi gì, lỗi từng phần tử trả về trong "errors".
+    """
+    data = request.get_json(silent=True) or {}
+    updates = data.get('updates')
+    if not isinstance(updates, list) or not updates:
+        return jsonify({"message": "Thiếu danh sách updates"}), 400
+    max_items = current_app.config['PRODUCT_BATCH_MAX_ITEMS']
+    if len(updates) > max_items:
+        return jsonify({"message": f"Tối đa {max_items} thay đổi mỗi lần"}), 400
+
+    patches, errors = {}, []
+    for index, item in enumerate(updates):
+        try:
+            product_id, values = parse_product_patch(item)
+            if product_id in patches:
+                raise ValueError("Sản phẩm bị lặp trong danh sách")
+            patches[product_id] = values
+        except ValueError as e:
+            errors.append({"index": index, "product_id": item.get('product_id') if isinstance(item, dict) else None,
+                           "message": str(e)})
+    if errors:
+        return jsonify({"message": "Dữ liệu không hợp lệ, chưa cập nhật sản phẩm nào", "errors": errors}), 400
+
+    # Một truy vấn lấy tồn kho hiện tại: kiểm tra sản phẩm tồn tại và tính bộ đếm sắp hết hàng
+    current_stock = dict(db.session.execute(
+        db.select(Product.id, Product.stock_quantity).where(Product.id.in_(patches))
+    ).all())
+    missing = [product_id for product_id in patches if product_id not in current_stock]
+    if missing:
+        return jsonify({"message": "Không tìm thấy sản phẩm, chưa cập nhật sản phẩm nào",
+                        "errors": [{"product_id": product_id, "message": "Không tìm thấy sản phẩm"}
+                                   for product_id in missing]}), 404
+    try:
+        # UPDATE theo khóa chính dạng executemany: mỗi tổ hợp cột (giá / kho / cả hai)
+        # một câu lệnh cho cả lô, không phụ thuộc số sản phẩm
+        db.session.execute(db.update(Product), [
+            {"id": product_id, **values} for product_id, values in patches.items()
+        ])
+        bump_dashboard_counters({'low_stock_products': sum(
+            low_stock_delta(current_stock[product_id], values['stock_quantity'])
+            for product_id, values in patches.items() if 'stock_quantity' in values
+        )})
+        bump_catalog_version()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"message": f"Lỗi: {e}"}), 500
+    return jsonify({"message": f"Đã cập nhật {len(patches)} sản phẩm", "updated": len(patches)}), 200
+
+# --- NHẬP SẢN PHẨM HÀNG LOẠT TỪ CSV / ZIP ---
+# Cột bắt buộc của CSV; 'description', 'stock_quantity' là tùy chọn. Ảnh bắt buộc như
+# add_product_api: các template dựng URL ảnh sản phẩm mà không kiểm tra None.
+PRODUCT_IMPORT_REQUIRED_COLUMNS = {'name', 'price', 'image'}
+
+def parse_import_row(row):
+    """Chuyển một dòng CSV thành giá trị Product. Ném ValueError nếu không hợp lệ."""
+    name = (row.get('name') or '').strip()
+    if not name:
+        raise ValueError("Thiếu tên sản phẩm")
+    if len(name) > Product.name.type.length:
+        raise ValueError(f"Tên dài quá {Product.name.type.length} ký tự")
+    try:
+        price = float((row.get('price') or '').strip())
+    except ValueError:
+        raise ValueError("Giá không hợp lệ")
+    if not math.isfinite(price) or price < 0:
+        raise ValueError("Giá phải là số không âm")
+    try:
+        stock = int((row.get('stock_quantity') or '0').strip())
+    except ValueError:
+        raise ValueError("Số lượng tồn kho không hợp lệ")
+    if stock < 0:
+        raise ValueError("Số lượng tồn kho phải không âm")
+    return {
+        "name": name,
+        "price": price,
+        "description": (row.get('description') or '').strip() or None,
+        "stock_quantity": stock,
+        "image_filename": None,
+    }
+
+def resolve_import_image(name, archive, saved):
+    """Trả về tên tệp ảnh (trong thư mục upload sản phẩm) cho cột 'image'.
+
+    Với ZIP: ảnh nằm trong tệp nén, được lưu theo hash nội dung (mỗi ảnh một lần dù
+    nhiều dòng dùng chung). Với CSV: phải là tên tệp đã có sẵn trong thư mục upload.
+    """
+    if name in saved:
+        return saved[name]
+    if not allowed_file(name):
+        raise ValueError(f"Ảnh '{name}' không đúng định dạng")
+    folder = current_app.config['PRODUCT_UPLOAD_FOLDER']
+    if archive is None:
+        path = safe_join(folder, name)
+        if path is None or not os.path.isfile(path):
+            raise ValueError(f"Không tìm thấy ảnh '{name}' trên máy chủ")
+        saved[name] = name
+        return name
+    try:
+        info = archive.getinfo(name)
+    except KeyError:
+        raise ValueError(f"Không có ảnh '{name}' trong tệp ZIP")
+    if info.file_size > current_app.config['PRODUCT_IMPORT_MAX_IMAGE_SIZE']:
+        raise ValueError(f"Ảnh '{name}' quá lớn")
+    with archive.open(info) as image_stream:
+        saved[name] = save_upload(FileStorage(stream=image_stream, filename=os.path.basename(name)), folder)
+    return saved[name]
+
+def insert_product_batch(rows):
+    """INSERT hàng loạt một lô sản phẩm (một câu lệnh) và ghi chỉ mục tìm kiếm cho lô đó."""
+    ids = db.session.scalars(
+        db.insert(Product).returning(Product.id, sort_by_parameter_order=True), rows
+    ).all()
+    index_products_bulk([dict(row, id=product_id) for row, product_id in zip(rows, ids)])
+    return len(ids)
+
+def import_products(text_stream, archive=None):
+    """Đọc CSV theo từng dòng, thêm sản phẩm hợp lệ theo lô trong transaction hiện tại
+    (người gọi commit). Trả về (số sản phẩm đã thêm, số dòng lỗi, chi tiết lỗi)."""
+    reader = csv.DictReader(text_stream)
+    columns = {(column or '').strip() for column in reader.fieldnames or []}
+    missing = PRODUCT_IMPORT_REQUIRED_COLUMNS - columns
+    if missing:
+        raise ValueError(f"Thiếu cột: {', '.join(sorted(missing))}")
+    reader.fieldnames = [(column or '').strip() for column in reader.fieldnames]
+
+    batch_size = current_app.config['PRODUCT_IMPORT_BATCH']
+    created, error_count, errors = 0, 0, []
+    batch, saved_images, low_stock = [], {}, 0
+    for row in reader:
+        try:
+            values = parse_import_row(row)
+            image = (row.get('image') or '').strip()
+            if not image:
+                raise ValueError("Thiếu ảnh sản phẩm")
+            values['image_filename'] = resolve_import_image(image, archive, saved_images)
+        except ValueError as e:
+            error_count += 1
+            if len(errors) < PRODUCT_IMPORT_MAX_ERRORS:
+                errors.append({"line": reader.line_num, "name": row.get('name'), "message": str(e)})
+            continue
+        low_stock += low_stock_delta(None, values['stock_quantity'])
+        batch.append(values)
+        if len(batch) >= batch_size:
+            created += insert_product_batch(batch)
+            batch = []
+    if batch:
+        created += insert_product_batch(batch)
+
+    if created:
+        bump_dashboard_counters({'low_stock_products': low_stock})
+        bump_catalog_version()
+    if archive is not None:
+        for filename in set(saved_images.values()):
+            schedule_image_variants('PRODUCT_UPLOAD_FOLDER', filename)
+    return created, error_count, errors
+
+def find_import_csv(archive):
+    """Tệp CSV trong ZIP: ưu tiên products.csv ở gốc, không thì tệp .csv đầu tiên."""
+    names = [name for name in archive.namelist() if name.lower().endswith('.csv')]
+    if 'products.csv' in names:
+        return 'products.csv'
+    if not names:
+        raise ValueError("Tệp ZIP không có tệp CSV nào")
+    return names[0]
+
+@quanly_bp.route('/api/products/import', methods=['POST'])
+@admin_required
+def import_products_api():
+    """Nhập sản phẩm từ CSV (cột bắt buộc name, price, image; tùy chọn stock_quantity,
+    description) hoặc ZIP chứa products.csv kèm các ảnh mà cột 'image' trỏ tới.
+
+    Tệp được đọc tuần tự từng dòng và ghi theo lô trong một transaction; dòng lỗi bị
+    bỏ qua và được liệt kê trong báo cáo (kèm số dòng trong CSV).
+    """
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({"message": "Chưa chọn tệp CSV hoặc ZIP"}), 400
+    extension = upload.filename.rsplit('.', 1)[-1].lower()
+    if extension not in ('csv', 'zip'):
+        return jsonify({"message": "Chỉ nhận tệp .csv hoặc .zip"}), 400
+
+    archive = None
+    try:
+        if extension == 'zip':
+            archive = zipfile.ZipFile(upload.stream)
+            raw = archive.open(find_import_csv(archive))
+        else:
+            raw = upload.stream
+        # utf-8-sig: bỏ BOM do Excel thêm vào khi lưu CSV UTF-8
+        text_stream = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+        created, error_count, errors = import_products(text_stream, archive)
+        db.session.commit()
+    except zipfile.BadZipFile:
+        db.session.rollback()
+        return jsonify({"message": "Tệp ZIP không hợp lệ"}), 400
+    except UnicodeDecodeError:
+        db.session.rollback()
+        return jsonify({"message": "Tệp CSV phải được lưu với mã hóa UTF-8, chưa nhập sản phẩm nào"}), 400
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"message": f"Lỗi: {e}"}), 500
+    finally:
+        if archive is not None:
+            archive.close()
+
+    return jsonify({
+        "message": f"Đã thêm {created} sản phẩm, {error_count} dòng lỗi",
+        "created": created,
+        "error_count": error_count,
+        "errors": errors,
+    }), 200
+
 @quanly_bp.route('/api/products/delete/<int:product_id>', methods=['POST'])
 @admin_required
 def delete_product_api(product_id):
@@ -589,10 +2158,10 @@ def delete_product_api(product_id):
         return jsonify({"message": "Không tìm thấy sản phẩm"}), 404
     try:
         if product.image_filename:
-            image_path = os.path.join(app.config['PRODUCT_UPLOAD_FOLDER'], product.image_filename)
-            if os.path.exists(image_path):
-                os.remove(image_path)
+            schedule_upload_removal('PRODUCT_UPLOAD_FOLDER', product.image_filename)
+        bump_dashboard_counters({'low_stock_products': low_stock_delta(product.stock_quantity, None)})
         db.session.delete(product)
+        bump_catalog_version()
         db.session.commit()
         return jsonify({"message": "Xóa sản phẩm thành công"}), 200
     except Exception as e:
@@ -609,13 +2178,14 @@ def update_order_status_api(order_id):
     data = request.json
     new_status = data.get('status')
     
-    if new_status not in ['pending', 'confirmed', 'shipped', 'delivered', 'rejected']:
+    if new_status not in ORDER_STATUSES:
         return jsonify({"message": "Trạng thái không hợp lệ"}), 400
         
     try:
         # --- START SỬA LỖI: LOGIC HOÀN KHO ---
         
         old_status = order.status
+        counter_deltas = Counter()
         
         # Chỉ hoàn kho NẾU:
         # 1. Trạng thái MỚI là 'rejected' (Hủy)
@@ -629,17 +2199,58 @@ def update_order_status_api(order_id):
                 product = item.product 
                 if product:
                     # Cộng trả số lượng
+                    old_stock = product.stock_quantity
                     product.stock_quantity += item.quantity
+                    counter_deltas['low_stock_products'] += low_stock_delta(old_stock, product.stock_quantity)
                     db.session.add(product) # Đánh dấu sản phẩm để cập nhật
                 else:
                     # Ghi log nếu sản phẩm không còn tồn tại
                     print(f"Cảnh báo: Không tìm thấy Product ID {item.product_id} để hoàn kho.")
+
+            # Tồn kho thay đổi -> làm mới cache catalog
+            bump_catalog_version()
+
+        # Mở lại đơn đã hủy: lấy lại số hàng đã hoàn kho. Cùng điều kiện với checkout
+        # (stock_quantity >= số lượng) để không bán âm kho; theo thứ tự id như checkout.
+        elif old_status == 'rejected' and new_status != 'rejected':
+            for product_id, (quantity, _) in sorted(order_product_totals(order.id).items()):
+                remaining = db.session.execute(
+                    db.update(Product)
+                    .where(Product.id == product_id, Product.stock_quantity >= quantity)
+                    .values(stock_quantity=Product.stock_quantity - quantity)
+                    .returning(Product.stock_quantity)
+                    .execution_options(synchronize_session=False)
+                ).scalar()
+                if remaining is None:
+                    product = db.session.query(Product.name, Product.stock_quantity).filter_by(id=product_id).first()
+                    if product is None:
+                        # Sản phẩm đã bị xóa (lúc hủy cũng không hoàn kho được)
+                        print(f"Cảnh báo: Không tìm thấy Product ID {product_id} để trừ kho lại.")
+                        continue
+                    db.session.rollback()
+                    return jsonify({"message": f"Không thể mở lại đơn #{order_id}: sản phẩm '{product.name}' "
+                                               f"không đủ số lượng (cần {quantity}, chỉ còn {product.stock_quantity})."}), 409
+                counter_deltas['low_stock_products'] += low_stock_delta(remaining + quantity, remaining)
+            bump_catalog_version()
         
         # --- END SỬA LỖI ---
         
+        # Chuyển doanh số của đơn từ nhóm trạng thái cũ sang nhóm trạng thái mới
+        if new_status != old_status:
+            product_totals = order_product_totals(order.id)
+            order_day = order.created_at.date()
+            apply_sales_rollup(order_day, old_status, product_totals, sign=-1)
+            apply_sales_rollup(order_day, new_status, product_totals)
+            counter_deltas.update(order_counter_deltas(order_day, old_status, order.total_price, sign=-1))
+            counter_deltas.update(order_counter_deltas(order_day, new_status, order.total_price))
+        bump_dashboard_counters(counter_deltas)
+
         # Cập nhật trạng thái của đơn hàng
         order.status = new_status
         db.session.add(order)
+        if new_status != old_status:
+            record_admin_event('order-status-changed',
+                               {'id': order.id, 'status': new_status, 'old_status': old_status})
         
         # Commit tất cả thay đổi (cả hoàn kho và trạng thái đơn hàng)
         db.session.commit()
@@ -650,6 +2261,182 @@ def update_order_status_api(order_id):
         return jsonify({"message": f"Lỗi: {e}"}), 500
 
 
+def move_orders_to_status(orders, new_status):
+    """Đổi trạng thái nhiều đơn bằng các câu lệnh theo tập hợp, trong transaction hiện tại
+    (người gọi commit). orders: các dòng (id, status, created_at, total_price) đã được
+    kiểm tra là chuyển hợp lệ. Số câu lệnh không phụ thuộc số đơn hay số món."""
+    order_ids = [order.id for order in orders]
+    order_by_id = {order.id: order for order in orders}
+
+    # Số lượng/doanh thu theo (đơn, sản phẩm) của cả lô trong một truy vấn
+    item_totals = db.session.execute(
+        db.select(
+            OrderItem.order_id, OrderItem.product_id,
+            db.func.sum(OrderItem.quantity),
+            db.func.sum(OrderItem.quantity * OrderItem.price_at_purchase)
+        ).where(OrderItem.order_id.in_(order_ids)).group_by(OrderItem.order_id, OrderItem.product_id)
+    ).all()
+
+    rollup_quantity, rollup_revenue, restock = Counter(), Counter(), Counter()
+    for order_id, product_id, quantity, revenue in item_totals:
+        order = order_by_id[order_id]
+        day = order.created_at.date()
+        for status, sign in ((order.status, -1), (new_status, 1)):
+            rollup_quantity[(day, product_id, status)] += sign * quantity
+            rollup_revenue[(day, product_id, status)] += sign * revenue
+        if new_status == 'rejected':
+            restock[product_id] += quantity
+
+    db.session.execute(
+        db.update(Order).where(Order.id.in_(order_ids)).values(status=new_status)
+        .execution_options(synchronize_session=False)
+    )
+    upsert_sales_rollup([
+        {"day": day, "product_id": product_id, "status": status,
+         "quantity": quantity, "revenue": rollup_revenue[(day, product_id, status)]}
+        for (day, product_id, status), quantity in rollup_quantity.items()
+    ])
+
+    counter_deltas = Counter()
+    if new_status == 'rejected':
+        # Hoàn kho: mỗi sản phẩm được cộng một lần tổng số lượng của mọi đơn bị hủy,
+        # gộp trong một câu UPDATE ... CASE
+        restocked = []
+        if restock:
+            restocked = db.session.execute(
+                db.update(Product).where(Product.id.in_(restock))
+                .values(stock_quantity=Product.stock_quantity + db.case(restock, value=Product.id))
+                .returning(Product.id, Product.stock_quantity)
+                .execution_options(synchronize_session=False)
+            ).all()
+        for product_id, new_stock in restocked:
+            counter_deltas['low_stock_products'] += low_stock_delta(new_stock - restock[product_id], new_stock)
+        for product_id in restock.keys() - {product_id for product_id, _ in restocked}:
+            print(f"Cảnh báo: Không tìm thấy Product ID {product_id} để hoàn kho.")
+        bump_catalog_version()
+
+    for order in orders:
+        day = order.created_at.date()
+        counter_deltas.update(order_counter_deltas(day, order.status, order.total_price, sign=-1))
+        counter_deltas.update(order_counter_deltas(day, new_status, order.total_price))
+    bump_dashboard_counters(counter_deltas)
+    record_admin_events('order-status-changed', [
+        {'id': order.id, 'status': new_status, 'old_status': order.status} for order in orders
+    ])
+
+@quanly_bp.route('/api/orders/bulk-status', methods=['POST'])
+@query_budget(9)
+@admin_required
+def bulk_update_order_status_api():
+    """Đổi trạng thái nhiều đơn trong một transaction: {"order_ids": [...], "status": "..."}.
+
+    Đơn không tồn tại, đã ở trạng thái đích hoặc không được chuyển sang trạng thái đích
+    (xem ORDER_STATUS_TRANSITIONS) bị bỏ qua và liệt kê trong "skipped"; các đơn còn lại
+    được cập nhật cùng lúc.
+    """
+    data = request.get_json(silent=True) or {}
+    new_status = data.get('status')
+    if new_status not in ORDER_STATUSES:
+        return jsonify({"message": "Trạng thái không hợp lệ"}), 400
+    raw_ids = data.get('order_ids')
+    if not isinstance(raw_ids, list) or not raw_ids:
+        return jsonify({"message": "Thiếu danh sách order_ids"}), 400
+    try:
+        order_ids = {int(order_id) for order_id in raw_ids}
+    except (TypeError, ValueError):
+        return jsonify({"message": "order_ids phải là danh sách mã đơn hàng"}), 400
+    max_items = current_app.config['ORDER_BULK_MAX_ITEMS']
+    if len(order_ids) > max_items:
+        return jsonify({"message": f"Tối đa {max_items} đơn hàng mỗi lần"}), 400
+
+    try:
+        orders = db.session.execute(
+            db.select(Order.id, Order.status, Order.created_at, Order.total_price)
+            .where(Order.id.in_(order_ids)).order_by(Order.id)
+        ).all()
+        found = {order.id for order in orders}
+        skipped = [{"id": order_id, "message": "Không tìm thấy đơn hàng"}
+                   for order_id in sorted(order_ids - found)]
+        moving = []
+        for order in orders:
+            if order.status == new_status:
+                skipped.append({"id": order.id, "message": "Đơn đã ở trạng thái này"})
+            elif new_status not in ORDER_STATUS_TRANSITIONS[order.status]:
+                skipped.append({"id": order.id,
+                                "message": f"Không thể chuyển từ '{order.status}' sang '{new_status}'"})
+            else:
+                moving.append(order)
+        if moving:
+            move_orders_to_status(moving, new_status)
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"message": f"Lỗi: {e}"}), 500
+
+    return jsonify({
+        "message": f"Đã cập nhật {len(moving)} đơn hàng thành {new_status}, bỏ qua {len(skipped)} đơn",
+        "updated": [order.id for order in moving],
+        "skipped": skipped,
+    }), 200
+
+@quanly_bp.route('/api/password-hashing/stats', methods=['GET'])
+@admin_required
+def password_hashing_stats_api():
+    return jsonify(password_hasher.stats()), 200
+
+@quanly_bp.route('/api/events/stream', methods=['GET'])
+@admin_required
+def admin_events_stream():
+    """Luồng Server-Sent Events: order-created, order-status-changed, message-received.
+
+    Kết nối lại kèm Last-Event-ID sẽ nhận tiếp các sự kiện đã bỏ lỡ. Mỗi luồng giữ
+    một thread trong lúc mở, nên khi chạy gunicorn hãy dùng worker gthread/gevent.
+    """
+    try:
+        last_id = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    except (TypeError, ValueError):
+        # Kết nối mới: chỉ nhận sự kiện từ thời điểm này (trang vừa tải đã có dữ liệu cũ)
+        last_id = db.session.query(db.func.max(AdminEvent.id)).scalar() or 0
+    # Trả kết nối về pool; luồng chỉ mượn kết nối trong từng lần đọc
+    db.session.close()
+
+    engine = db.engine
+    poll_interval = current_app.config['SSE_POLL_INTERVAL']
+    heartbeat = current_app.config['SSE_HEARTBEAT']
+    deadline = time.monotonic() + current_app.config['SSE_MAX_DURATION']
+
+    def generate(last_id):
+        yield "retry: 3000\n\n"
+        last_sent = time.monotonic()
+        while time.monotonic() < deadline:
+            with engine.connect() as conn:
+                rows = conn.execute(
+                    db.select(AdminEvent.id, AdminEvent.kind, AdminEvent.payload)
+                    .where(AdminEvent.id > last_id).order_by(AdminEvent.id).limit(100)
+                ).all()
+            for row in rows:
+                last_id = row.id
+                yield format_sse(row.id, row.kind, row.payload)
+            if rows:
+                last_sent = time.monotonic()
+                continue
+            if time.monotonic() - last_sent >= heartbeat:
+                last_sent = time.monotonic()
+                yield ": ping\n\n"
+            with admin_event_signal:
+                admin_event_signal.wait(timeout=poll_interval)
+
+    response = Response(generate(last_id), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx: không gom buffer luồng SSE
+    return response
+
+@quanly_bp.route('/api/metrics', methods=['GET'])
+@admin_required
+def metrics_api():
+    """Số liệu theo định dạng Prometheus, cộng từ mọi worker."""
+    return Response(render_prometheus(metrics_registry.collect()), content_type=PROMETHEUS_CONTENT_TYPE)
+
 @quanly_bp.route('/api/messages/read/<int:message_id>', methods=['POST'])
 @admin_required
 def mark_message_read_api(message_id):
@@ -657,6 +2444,8 @@ def mark_message_read_api(message_id):
     if not msg:
         abort(404)
     try:
+        if not msg.is_read:
+            bump_dashboard_counters({'unread_messages': -1})
         msg.is_read = True
         db.session.commit()
         return jsonify({"message": "Đã đánh dấu đã đọc"}), 200
@@ -671,6 +2460,8 @@ def delete_message_api(message_id):
     if not msg:
         abort(404)
     try:
+        if not msg.is_read:
+            bump_dashboard_counters({'unread_messages': -1})
         db.session.delete(msg)
         db.session.commit()
         return jsonify({"message": "Đã xóa tin nhắn"}), 200
@@ -682,63 +2473,212 @@ def delete_message_api(message_id):
 # Route phục vụ file ảnh (Dùng chung)
 @quanly_bp.route('/uploads/products/<path:filename>')
 def serve_product_upload(filename):
-    return send_from_directory(app.config['PRODUCT_UPLOAD_FOLDER'], filename)
+    return send_upload(current_app.config['PRODUCT_UPLOAD_FOLDER'], filename)
 
 @quanly_bp.route('/uploads/gallery/<path:filename>')
 def serve_gallery_upload(filename):
-    return send_from_directory(app.config['GALLERY_UPLOAD_FOLDER'], filename)
+    return send_upload(current_app.config['GALLERY_UPLOAD_FOLDER'], filename)
 
 @quanly_bp.route('/uploads/payment/<path:filename>')
 def serve_payment_upload(filename):
-    return send_from_directory(app.config['PAYMENT_UPLOAD_FOLDER'], filename)
+    return send_upload(current_app.config['PAYMENT_UPLOAD_FOLDER'], filename)
 @quanly_bp.route('/uploads/proofs/<path:filename>')
 def serve_proof_upload(filename): 
-    return send_from_directory(app.config['PROOF_UPLOAD_FOLDER'], filename)
+    return send_upload_file(current_app.config['PROOF_UPLOAD_FOLDER'], filename, immutable=True, private=True)
 
 # ====================================================================
 # --- BLUEPRINT MỚI CHO CỬA HÀNG (CUSTOMER) ---
 # ====================================================================
 shop_bp = Blueprint('shop', __name__, template_folder='templates')
 
+# --- GIỎ HÀNG PHÍA SERVER ---
+cart_store = app_service('cart_store')
+
+def load_cart():
+    """Đọc bản ghi giỏ hàng của người dùng hiện tại (một lần cho mỗi request)."""
+    if 'cart' not in g:
+        cart_id = session.get('cart_id')
+        g.cart = cart_store.load(cart_id) if cart_id else empty_cart()
+    return g.cart
+
+def save_cart(cart):
+    """Lưu giỏ hàng; tạo cart_id (cookie) ở lần lưu đầu tiên."""
+    cart_id = session.get('cart_id')
+    if not cart_id:
+        cart_id = session['cart_id'] = secrets.token_urlsafe(16)
+    cart_store.save(cart_id, cart)
+    cart['count'] = sum(int(q) for q in cart['items'].values())
+    g.cart = cart
+
 @shop_bp.context_processor
 def inject_cart_info():
-    cart = session.get('cart', {})
-    cart_total_items = sum(int(q) for q in cart.values())
-    return dict(cart_total_items=cart_total_items)
+    if 'cart' in g:
+        return dict(cart_total_items=g.cart['count'])
+    if 'cart_total_items' not in g:
+        cart_id = session.get('cart_id')
+        # Đọc tổng số lượng đã tính sẵn, không cộng lại từng dòng
+        g.cart_total_items = cart_store.item_count(cart_id) if cart_id else 0
+    return dict(cart_total_items=g.cart_total_items)
+
+# --- CACHE FRAGMENT HTML VÀ ETAG CHO TRANG CÔNG KHAI ---
+# Lưới sản phẩm/ảnh không phụ thuộc người dùng: render một lần cho mỗi phiên bản catalog.
+# Phần riêng của từng người (số lượng giỏ hàng, trạng thái đăng nhập, flash) vẫn
+# render mỗi request trong shop_base.html.
+_template_build_id = []
+
+def cached_fragment(key, template, load_context):
+    """HTML của template đã render, cache theo phiên bản catalog (key gồm cả từ khóa tìm kiếm)."""
+    return cached_catalog(('fragment',) + key,
+                          lambda: Markup(render_template(template, **load_context())))
+
+def template_build_id():
+    """Hash nội dung thư mục templates: đổi giao diện khi triển khai thì ETag cũng đổi."""
+    if not _template_build_id:
+        digest = hashlib.sha256()
+        template_dir = os.path.join(current_app.root_path, current_app.template_folder)
+        for name in sorted(os.listdir(template_dir)):
+            with open(os.path.join(template_dir, name), 'rb') as f:
+                digest.update(name.encode() + b'\0' + f.read())
+        _template_build_id.append(digest.hexdigest()[:16])
+    return _template_build_id[0]
+
+def public_page_etag():
+    """ETag mạnh tính TRƯỚC khi render từ mọi thứ làm thay đổi nội dung trang.
+    Trả về None khi không nên dùng 304 (có thông báo flash đang chờ, chế độ debug).
+
+    Kho hàng (số lượng còn lại, nút thêm vào giỏ) nằm trong phiên bản catalog: mọi chỗ đổi
+    Product.stock_quantity, kể cả checkout, phải gọi bump_catalog_version() trong cùng
+    transaction (kiểm tra: scripts/check_page_etag.py)."""
+    if current_app.debug or session.get('_flashes'):
+        return None
+    parts = [
+        template_build_id(),
+        str(get_catalog_version()),
+        request.full_path,
+        '1' if session.get('user_id') else '0',
+        '1' if session.get('is_admin') else '0',
+        str(inject_cart_info()['cart_total_items']),
+    ]
+    return hashlib.sha256('|'.join(parts).encode()).hexdigest()[:32]
+
+def conditional_page(f):
+    """Trả 304 Not Modified (không render) khi trình duyệt đã có đúng phiên bản trang."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        etag = public_page_etag() if request.method == 'GET' else None
+        if etag is None:
+            return f(*args, **kwargs)
+        # Bản nén gửi ETag có hậu tố mã hóa (xem compress_response); trả lại đúng ETag trình duyệt có
+        matched = next((candidate for candidate in [etag] + [encoded_etag(etag, e) for e in ENCODING_SUFFIXES]
+                        if request.if_none_match.contains(candidate)), None)
+        if matched:
+            response = current_app.response_class(status=304)
+            etag = matched
+        else:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        # Trang có phần riêng của người dùng: chỉ trình duyệt được cache và phải hỏi lại mỗi lần
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+        return response
+    return decorated_function
 
 @shop_bp.route('/')
+@query_budget(4)
+@conditional_page
 def show_shop_page():
     search_query = request.args.get('search', '')
+
+    def load_products():
+        if search_query and search_index_enabled():
+            # Tìm qua chỉ mục FTS5, giữ nguyên thứ tự xếp hạng
+            product_ids = search_product_ids(search_query)
+            products_dict = {p.id: p for p in db.session.query(Product).filter(Product.id.in_(product_ids)).all()}
+            products = [products_dict[pid] for pid in product_ids if pid in products_dict]
+        else:
+            query = db.session.query(Product)
+
+            if search_query:
+                query = query.filter(Product.name.ilike(f'%{search_query}%'))
+
+            products = query.order_by(Product.name).all()
+        return [snapshot(p) for p in products]
     
     try:
-        query = db.session.query(Product)
-        
-        if search_query:
-            query = query.filter(Product.name.ilike(f'%{search_query}%'))
-            
-        products = query.order_by(Product.name).all()
-        
+        product_grid = cached_fragment(('product_grid', search_query), 'shop_product_grid.html',
+                                       lambda: {'products': cached_catalog(('products', search_query), load_products)})
     except Exception as e:
         print(f"Lỗi khi truy vấn sản phẩm: {e}")
-        products = []
+        product_grid = render_template('shop_product_grid.html', products=[])
         
     return render_template('shop_main.html', 
-                           products=products, 
+                           product_grid=product_grid, 
                            search_query=search_query) 
 
 @shop_bp.route('/product/<int:product_id>')
+@query_budget(3)
+@conditional_page
 def show_product_detail(product_id):
-    product = db.session.get(Product, product_id)
+    product = cached_catalog(('product', product_id),
+                             lambda: snapshot(db.session.get(Product, product_id)))
     if not product:
         return "Không tìm thấy sản phẩm", 404
     return render_template('shop_product_detail.html', product=product)
 
+def gallery_page_query(cursor=None, per_page=GALLERY_PER_PAGE):
+    """Một trang ảnh thư viện (theo thứ tự thêm vào) sau ảnh có id = cursor.
+    Trả về (danh sách snapshot, next_cursor); cache theo phiên bản catalog."""
+    def load():
+        query = GalleryImage.query.order_by(GalleryImage.id)
+        if cursor is not None:
+            query = query.filter(GalleryImage.id > cursor)
+        # Lấy dư 1 dòng để biết còn trang sau hay không.
+        images = [snapshot(image) for image in query.limit(per_page + 1)]
+        next_cursor = str(images[per_page - 1].id) if len(images) > per_page else None
+        return images[:per_page], next_cursor
+    return cached_catalog(('gallery', cursor, per_page), load)
+
+def serialize_gallery_image(image):
+    return {
+        "id": image.id,
+        "description": image.description,
+        "full_url": url_for('quanlybanhang.serve_gallery_upload', filename=image.filename, size='full'),
+        "src": url_for('quanlybanhang.serve_gallery_upload', filename=image.filename, size='card'),
+        "srcset": upload_srcset('quanlybanhang.serve_gallery_upload', image.filename),
+    }
+
 @shop_bp.route('/pages')
+@query_budget(3)
+@conditional_page
 def pages_page():
-    images = GalleryImage.query.all()
-    return render_template('shop_pages.html', images=images)
+    # Chỉ trang đầu nằm trong HTML; phần còn lại tải dần qua gallery_api khi cuộn
+    gallery_grid = cached_fragment(('gallery_grid',), 'shop_gallery_grid.html', lambda: dict(
+        zip(('images', 'next_cursor'), gallery_page_query())
+    ))
+    return render_template('shop_pages.html', gallery_grid=gallery_grid, gallery_per_page=GALLERY_PER_PAGE)
+
+@shop_bp.route('/api/gallery', methods=['GET'])
+@query_budget(3)
+@conditional_page
+def gallery_api():
+    """Ảnh thư viện phân trang theo cursor: ?cursor=<next_cursor của trang trước>&limit=N."""
+    try:
+        cursor = int(request.args['cursor']) if request.args.get('cursor') else None
+        per_page = min(max(int(request.args.get('limit', GALLERY_PER_PAGE)), 1), 48)
+    except ValueError:
+        return jsonify({"message": "Tham số không hợp lệ"}), 400
+    images, next_cursor = gallery_page_query(cursor, per_page)
+    return jsonify({
+        "images": [serialize_gallery_image(image) for image in images],
+        "next_cursor": next_cursor
+    }), 200
 
 @shop_bp.route('/contact', methods=['GET', 'POST'])
+@query_budget(4)
+@conditional_page
 def contact_page():
     if request.method == 'POST':
         try:
@@ -759,6 +2699,17 @@ def contact_page():
                     content=content
                 )
                 db.session.add(new_message)
+                db.session.flush()
+                bump_dashboard_counters({'unread_messages': 1})
+                record_admin_event('message-received', {
+                    'id': new_message.id,
+                    'name': name,
+                    'phone': phone,
+                    'email': email,
+                    'subject': subject,
+                    'content': content,
+                    'created_at': new_message.created_at.strftime('%d-%m-%Y %H:%M'),
+                })
                 db.session.commit()
                 flash("Gửi tin nhắn thành công! Chúng tôi sẽ liên hệ lại với bạn sớm.", "success")
                 return redirect(url_for('shop.contact_page')) 
@@ -767,12 +2718,14 @@ def contact_page():
             db.session.rollback()
             flash(f"Lỗi khi gửi tin nhắn: {e}", "error")
 
-    info = db.session.get(ContactInfo, 1) 
+    info = cached_catalog(('contact_info',), lambda: snapshot(db.session.get(ContactInfo, 1)))
     return render_template('shop_contact.html', info=info)
 
 @shop_bp.route('/cart')
+@query_budget(3)
 def show_cart_page():
-    cart = session.get('cart', {})
+    cart_record = load_cart()
+    cart = cart_record['items']
     if not cart:
         return render_template('cart.html', items=[], total=0)
     
@@ -783,6 +2736,7 @@ def show_cart_page():
     total_price = 0
     
     products_dict = {p.id: p for p in products}
+    cart_changed = False
     
     for product_id_str, quantity_in_cart in cart.items():
         product_id = int(product_id_str)
@@ -793,6 +2747,7 @@ def show_cart_page():
             if quantity > product.stock_quantity:
                 quantity = product.stock_quantity 
                 cart[product_id_str] = quantity 
+                cart_changed = True
             
             subtotal = product.price * quantity
             total_price += subtotal
@@ -806,10 +2761,12 @@ def show_cart_page():
                 'stock': product.stock_quantity 
             })
             
-    session['cart'] = cart 
+    if cart_changed:
+        save_cart(cart_record)
     return render_template('cart.html', items=cart_items, total=total_price)
 
 @shop_bp.route('/checkout', methods=['GET', 'POST'])
+@query_budget(6)
 def show_checkout_page():
     if request.method == 'GET':
         flash("Vui lòng chọn sản phẩm từ giỏ hàng để thanh toán.", "error")
@@ -820,7 +2777,8 @@ def show_checkout_page():
         flash("Bạn chưa chọn sản phẩm nào để thanh toán.", "error")
         return redirect(url_for('shop.show_cart_page'))
 
-    cart = session.get('cart', {})
+    cart_record = load_cart()
+    cart = cart_record['items']
     
     items_to_checkout = []
     total_price = 0
@@ -850,29 +2808,33 @@ def show_checkout_page():
             })
             order_details_for_session[product_id_str] = quantity
 
-    session['checkout_order'] = order_details_for_session
+    cart_record['checkout'] = order_details_for_session
+    save_cart(cart_record)
             
-    payment_info = db.session.get(PaymentInfo, 1)
+    payment_info = cached_catalog(('payment_info',), lambda: snapshot(db.session.get(PaymentInfo, 1)))
             
     return render_template('checkout.html', 
                            items=items_to_checkout, 
                            total=total_price, 
                            payment_info=payment_info)
 
+def customer_orders_query(customer_id):
+    return db.session.query(Order).options(
+        db.joinedload(Order.items).joinedload(OrderItem.product)
+    ).filter_by(customer_id=customer_id).order_by(Order.created_at.desc())
+
 @shop_bp.route('/order-history')
+@query_budget(2)
 @customer_required 
 def order_history_page():
-    customer_id = session.get('user_id')
-    
-    orders = db.session.query(Order).options(
-        db.joinedload(Order.items).joinedload(OrderItem.product)
-    ).filter_by(customer_id=customer_id).order_by(Order.created_at.desc()).all()
+    orders = customer_orders_query(session.get('user_id')).all()
     
     return render_template('order_history.html', orders=orders)
 
 
 # --- API GIỎ HÀNG (CẬP NHẬT) ---
 @shop_bp.route('/api/cart/add', methods=['POST'])
+@query_budget(4)
 def add_to_cart_api():
     data = request.json
     product_id_str = str(data.get('product_id'))
@@ -891,8 +2853,14 @@ def add_to_cart_api():
     if product.stock_quantity <= 0:
         return jsonify({"message": "Sản phẩm này đã hết hàng"}), 400
 
-    cart = session.get('cart', {}) 
+    cart_record = load_cart()
+    cart = cart_record['items']
     current_in_cart = int(cart.get(product_id_str, 0))
+
+    if product_id_str not in cart and len(cart) >= CART_MAX_LINES:
+        return jsonify({
+            "message": f"Giỏ hàng chỉ chứa tối đa {CART_MAX_LINES} sản phẩm khác nhau. Vui lòng đặt hàng trước rồi mua tiếp."
+        }), 400
     
     if (current_in_cart + quantity) > product.stock_quantity:
         return jsonify({
@@ -900,9 +2868,9 @@ def add_to_cart_api():
         }), 400
     
     cart[product_id_str] = current_in_cart + quantity
-    session['cart'] = cart
+    save_cart(cart_record)
     
-    cart_total_items = sum(int(q) for q in cart.values())
+    cart_total_items = cart_record['count']
 
     return jsonify({
         "message": f"Đã thêm {quantity} sản phẩm vào giỏ!",
@@ -910,12 +2878,14 @@ def add_to_cart_api():
     }), 200
 
 @shop_bp.route('/api/cart/update', methods=['POST'])
+@query_budget(4)
 def update_cart_quantity_api():
     data = request.json
     product_id_str = str(data.get('product_id'))
     new_quantity = int(data.get('quantity', 1))
     
-    cart = session.get('cart', {})
+    cart_record = load_cart()
+    cart = cart_record['items']
     if product_id_str not in cart:
         return jsonify({"message": "Sản phẩm không có trong giỏ hàng"}), 404
         
@@ -932,10 +2902,10 @@ def update_cart_quantity_api():
         message = "Cập nhật số lượng thành công."
 
     cart[product_id_str] = new_quantity
-    session['cart'] = cart
+    save_cart(cart_record)
     
     subtotal = product.price * new_quantity
-    cart_total_items = sum(int(q) for q in cart.values())
+    cart_total_items = cart_record['count']
 
     return jsonify({
         "message": message,
@@ -945,17 +2915,18 @@ def update_cart_quantity_api():
     }), 200
 
 @shop_bp.route('/api/cart/remove', methods=['POST'])
+@query_budget(4)
 def remove_from_cart_api():
     data = request.json
     product_id_str = str(data.get('product_id'))
     
-    cart = session.get('cart', {})
+    cart_record = load_cart()
+    cart = cart_record['items']
     if product_id_str in cart:
         cart.pop(product_id_str) 
+        save_cart(cart_record)
     
-    session['cart'] = cart
-    
-    cart_total_items = sum(int(q) for q in cart.values())
+    cart_total_items = cart_record['count']
     
     product_ids = [int(pid) for pid in cart.keys()]
     products = db.session.query(Product).filter(Product.id.in_(product_ids)).all()
@@ -973,10 +2944,16 @@ def remove_from_cart_api():
     }), 200
 
 @shop_bp.route('/api/checkout/process', methods=['POST'])
+# Lệnh cố định + 1 UPDATE kho cho mỗi sản phẩm trong đơn (lặp có chủ đích, tối đa CART_MAX_LINES)
+@query_budget(CHECKOUT_FIXED_QUERIES + CART_MAX_LINES, allow_repeats=True)
 def process_checkout_api():
-    order_details = session.get('checkout_order', {})
+    cart_record = load_cart()
+    order_details = cart_record['checkout']
     if not order_details:
         return jsonify({"message": "Không có đơn hàng nào để xử lý."}), 400
+    # Giỏ tạo trước khi có giới hạn dòng vẫn có thể vượt: không đặt quá ngân sách truy vấn
+    if len(order_details) > CART_MAX_LINES:
+        return jsonify({"message": f"Mỗi đơn chỉ gồm tối đa {CART_MAX_LINES} sản phẩm khác nhau."}), 400
         
     customer_name = request.form.get('name')
     customer_phone = request.form.get('phone')
@@ -987,25 +2964,35 @@ def process_checkout_api():
         return jsonify({"message": "Thiếu thông tin khách hàng hoặc phương thức thanh toán."}), 400
 
     try:
-        products_to_update = [] 
-        items_for_order = [] 
-        total_price = 0
-
-        for pid_str, qty in order_details.items():
-            product_id = int(pid_str)
-            quantity_needed = int(qty)
-            
-            product = db.session.get(Product, product_id)
-            
-            if not product:
+        quantities = {int(pid_str): int(qty) for pid_str, qty in order_details.items()}
+
+        # 1 truy vấn lấy giá/tên của mọi sản phẩm trong đơn (thay vì get() từng dòng)
+        product_rows = {
+            row.id: row for row in db.session.query(Product.id, Product.name, Product.price)
+                                             .filter(Product.id.in_(quantities.keys()))
+        }
+
+        # Trừ kho bằng UPDATE có điều kiện: kiểm tra và trừ diễn ra nguyên tử trong DB,
+        # nên nhiều người mua cùng lúc không thể làm kho âm (không bán vượt).
+        # Sắp xếp theo id để các transaction luôn khóa theo cùng thứ tự.
+        counter_deltas = Counter()
+        for product_id in sorted(quantities):
+            quantity_needed = quantities[product_id]
+            if product_id not in product_rows:
                 raise Exception(f"Sản phẩm ID {product_id} không tồn tại.")
-                
-            if product.stock_quantity < quantity_needed:
-                raise Exception(f"Sản phẩm '{product.name}' không đủ số lượng (cần {quantity_needed}, chỉ còn {product.stock_quantity}).")
-                
-            products_to_update.append((product, quantity_needed))
-            items_for_order.append((product, quantity_needed))
-            total_price += product.price * quantity_needed
+            remaining = db.session.execute(
+                db.update(Product)
+                .where(Product.id == product_id, Product.stock_quantity >= quantity_needed)
+                .values(stock_quantity=Product.stock_quantity - quantity_needed)
+                .returning(Product.stock_quantity)
+                .execution_options(synchronize_session=False)
+            ).scalar()
+            if remaining is None:
+                in_stock = db.session.query(Product.stock_quantity).filter_by(id=product_id).scalar()
+                raise Exception(f"Sản phẩm '{product_rows[product_id].name}' không đủ số lượng (cần {quantity_needed}, chỉ còn {in_stock}).")
+            counter_deltas['low_stock_products'] += low_stock_delta(remaining + quantity_needed, remaining)
+
+        total_price = sum(product_rows[pid].price * qty for pid, qty in quantities.items())
         
         new_order = Order(
             customer_id=session.get('user_id') if not session.get('is_admin') else None, 
@@ -1022,36 +3009,55 @@ def process_checkout_api():
         if payment_method == 'bank_transfer' and 'payment_proof' in request.files:
             file = request.files['payment_proof']
             if file and file.filename != '' and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                # Đổi tên tệp để đảm bảo tính duy nhất
-                save_filename = f"proof_{new_order.id}_{filename}"
-                save_path = os.path.join(app.config['PROOF_UPLOAD_FOLDER'], save_filename)
-                file.save(save_path)
-                new_order.payment_proof_filename = save_filename
-
-        for product, quantity_needed in items_for_order:
-            product.stock_quantity -= quantity_needed
-            
-            order_item = OrderItem(
-                order_id=new_order.id,
-                product_id=product.id,
-                quantity=quantity_needed,
-                price_at_purchase=product.price 
-            )
-            db.session.add(order_item)
+                new_order.payment_proof_filename = save_upload(file, current_app.config['PROOF_UPLOAD_FOLDER'])
+
+        # Thêm tất cả OrderItem bằng một lệnh INSERT hàng loạt
+        db.session.execute(db.insert(OrderItem), [
+            {
+                "order_id": new_order.id,
+                "product_id": product_id,
+                "quantity": quantity_needed,
+                "price_at_purchase": product_rows[product_id].price,
+            }
+            for product_id, quantity_needed in quantities.items()
+        ])
+
+        # Ghi doanh số của đơn mới vào bảng tổng hợp (cùng transaction)
+        product_totals = {
+            product_id: (quantity_needed, product_rows[product_id].price * quantity_needed)
+            for product_id, quantity_needed in quantities.items()
+        }
+        apply_sales_rollup(new_order.created_at.date(), new_order.status, product_totals)
+        counter_deltas.update(order_counter_deltas(new_order.created_at.date(), new_order.status, total_price))
+        bump_dashboard_counters(counter_deltas)
+        # Kho đã đổi: cache catalog, fragment và ETag trang công khai phải render lại
+        bump_catalog_version()
+
+        record_admin_event('order-created', {
+            'id': new_order.id,
+            'customer_name': customer_name,
+            'customer_phone': customer_phone,
+            'customer_address': customer_address,
+            'total_price': total_price,
+            'payment_method': payment_method,
+            'proof_url': url_for('quanlybanhang.serve_proof_upload', filename=new_order.payment_proof_filename)
+                         if new_order.payment_proof_filename else None,
+            'status': new_order.status,
+            'created_at': new_order.created_at.strftime('%d-%m-%Y %H:%M'),
+            'items': [{'name': product_rows[pid].name, 'quantity': qty} for pid, qty in quantities.items()],
+        })
         
         db.session.commit()
         
-        cart = session.get('cart', {})
+        cart = cart_record['items']
         for pid_str in order_details.keys():
             cart.pop(pid_str, None) 
-        session['cart'] = cart
-        
-        session.pop('checkout_order', None)
+        cart_record['checkout'] = {}
+        save_cart(cart_record)
         
         flash("Đặt hàng thành công! Cảm ơn bạn đã mua hàng.", "success")
         
-        cart_total_items = sum(int(q) for q in cart.values())
+        cart_total_items = cart_record['count']
         return jsonify({
             "message": "Đặt hàng thành công!",
             "cart_total_items": cart_total_items
@@ -1061,21 +3067,130 @@ def process_checkout_api():
         db.session.rollback() 
         return jsonify({"message": f"Lỗi khi đặt hàng: {str(e)}"}), 400
 
-# --- ĐĂNG KÝ BLUEPRINTS VỚI APP CHÍNH ---
-app.register_blueprint(quanly_bp, url_prefix='/quanlybanhang')
-app.register_blueprint(shop_bp, url_prefix='/') 
+def serve_admin_static(filename):
+    # Thư mục static của blueprint admin cũng trả bản nén sẵn như /static (gán trong create_app)
+    return send_precompressed(quanly_bp.static_folder, filename,
+                              max_age=current_app.get_send_file_max_age(filename))
 
-@app.route('/')
+@core_bp.route('/')
 def index_redirect():
     return redirect(url_for('shop.show_shop_page'))
 
+# --- KHỞI ĐỘNG: THIẾT LẬP MỘT LẦN MỖI TRIỂN KHAI VÀ APPLICATION FACTORY ---
+# Production: gunicorn -c gunicorn.conf.py wsgi:app (xem gunicorn.conf.py).
+def setup_deployment(flask_app=None):
+    """Việc chạy MỘT LẦN cho mỗi lần triển khai, không phải mỗi worker: thư mục upload,
+    bảng mới, migration, dữ liệu mặc định, chỉ mục tìm kiếm. Chạy lại an toàn."""
+    started = time.perf_counter()
+    with setup_context(flask_app):
+        for key in UPLOAD_COLUMNS:
+            os.makedirs(current_app.config[key], exist_ok=True)
+        db.create_all()
+        run_migrations(db.engine)
+        initialize_data()
+        ensure_search_index()
+        # Không để kết nối SQLite mở sẵn cho các worker sẽ fork từ tiến trình này
+        db.engine.dispose()
+    print(f"[Startup] Thiết lập triển khai xong sau {(time.perf_counter() - started) * 1000:.0f} ms")
+
+@core_bp.cli.command('setup-deployment')
+def setup_deployment_command():
+    """Chạy phần thiết lập một lần của bản triển khai (trước khi khởi động các worker)."""
+    setup_deployment()
+
+def warm_templates():
+    """Biên dịch trước mọi template. Gọi trong master với preload_app thì các worker
+    fork ra dùng chung bản đã biên dịch, request đầu tiên của worker mới không phải chờ."""
+    for name in current_app.jinja_env.list_templates():
+        current_app.jinja_env.get_template(name)
+    template_build_id()
+
+def init_services(app):
+    """Tạo các dịch vụ của app theo cấu hình của nó (truy cập qua app_service)."""
+    if app.config['CART_STORE'] == 'memory':
+        cart = MemoryCartStore(ttl=app.config['CART_TTL'])
+    else:
+        cart = SQLCartStore(db, CartSession, ttl=app.config['CART_TTL'])
+    app.extensions['services'] = {
+        'cart_store': cart,
+        'catalog_cache': CatalogCache(ttl=app.config['CATALOG_CACHE_TTL'],
+                                      max_entries=app.config['CATALOG_CACHE_MAX_ENTRIES']),
+        'job_queue': JobQueue(
+            db, BackgroundJob, app,
+            workers=app.config['JOB_WORKERS'],
+            poll_interval=app.config['JOB_POLL_INTERVAL'],
+            lease=app.config['JOB_LEASE_SECONDS'],
+            max_attempts=app.config['JOB_MAX_ATTEMPTS'],
+            retention_days=app.config['JOB_RETENTION_DAYS'],
+            handlers=JOB_HANDLERS,
+        ),
+        'password_hasher': PasswordHasher(
+            method=app.config['PASSWORD_HASH_METHOD'],
+            workers=app.config['PASSWORD_HASH_WORKERS'],
+            max_pending=app.config['PASSWORD_HASH_MAX_PENDING']
+        ),
+        'metrics_registry': MetricsRegistry(app.config['METRICS_DIR'],
+                                            flush_interval=app.config['METRICS_FLUSH_INTERVAL']),
+    }
+
+_app_count = []
+
+def create_app(config=None):
+    """Application factory: app mới với cấu hình đọc từ biến môi trường lúc gọi, ghi đè
+    bằng config, ví dụ trong test: create_app({'SQLALCHEMY_DATABASE_URI': ..., 'JOB_WORKERS': 0}).
+    Mỗi app có engine DB, cache catalog, giỏ hàng, hàng đợi việc nền và số liệu riêng.
+
+    Không đụng tới DB (an toàn khi gọi trong master trước khi fork); tạo bảng, migration,
+    dữ liệu mặc định là việc của setup_deployment(). `app` của module là create_app()."""
+    # App đầu tiên của tiến trình: tính cả thời gian import module
+    started = time.perf_counter() if _app_count else _IMPORT_STARTED
+    app = Flask(__name__)
+    configure_app(app, config)
+    cors.init_app(app)
+    db.init_app(app)
+    with app.app_context():
+        db.event.listen(db.engine, 'connect',
+                        lambda dbapi_connection, connection_record: apply_sqlite_pragmas(app, dbapi_connection))
+    init_services(app)
+    app.register_blueprint(quanly_bp, url_prefix='/quanlybanhang')
+    app.register_blueprint(shop_bp, url_prefix='/')
+    app.register_blueprint(core_bp)
+    # Tệp tĩnh của app và của blueprint admin trả bản nén sẵn (.br/.gz) nếu có
+    app.view_functions['static'] = serve_static
+    app.view_functions['quanlybanhang.static'] = serve_admin_static
+    with app.app_context():
+        warm_templates()
+    _app_count.append(True)
+    print(f"[Startup] App sẵn sàng sau {(time.perf_counter() - started) * 1000:.0f} ms "
+          f"(pid {os.getpid()})")
+    return app
+
+def reset_after_fork(flask_app=None):
+    """Gọi trong worker ngay sau fork: tài nguyên của tiến trình cha không dùng chung được."""
+    global image_pool
+    with setup_context(flask_app):
+        # close=False: không đóng kết nối (nếu có) mà tiến trình cha vẫn đang dùng
+        db.engine.dispose(close=False)
+        password_hasher.reset_after_fork()
+    image_pool = None
+
+def flush_worker_metrics(flask_app=None):
+    """Gọi trong worker khi thoát: ghi nốt số liệu chưa kịp flush định kỳ."""
+    with setup_context(flask_app):
+        metrics_registry.flush()
+
+def retire_worker_metrics(pid=None, flask_app=None):
+    """Gọi trong master gunicorn: worker pid đã dừng (None = mọi snapshot còn sót lại
+    của lần chạy trước), gộp số liệu của nó vào tổng các worker đã dừng."""
+    with setup_context(flask_app):
+        retired = metrics_registry.retire(pid)
+    if retired and pid is None:
+        print(f"[Metrics] Đã gộp {retired} snapshot của tiến trình cũ")
+
+# App mặc định (cấu hình từ biến môi trường) cho wsgi:app, 'flask --app app' và các script
+app = create_app()
+
 # --- Chạy ứng dụng ---
 if __name__ == '__main__':
-    os.makedirs(app.config['PRODUCT_UPLOAD_FOLDER'], exist_ok=True)
-    os.makedirs(app.config['GALLERY_UPLOAD_FOLDER'], exist_ok=True)
-    os.makedirs(app.config['PAYMENT_UPLOAD_FOLDER'], exist_ok=True) 
-    os.makedirs(app.config['PROOF_UPLOAD_FOLDER'], exist_ok=True)
-    with app.app_context():
-        db.create_all()
-    initialize_data() 
+    setup_deployment()
     app.run(host='0.0.0.0', debug=True, port=9754)
@@ -0,0 +1,140 @@
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+
+def empty_cart():
+    """Bản ghi giỏ hàng: items/checkout là {product_id_str: quantity}, count = tổng số lượng."""
+    return {'items': {}, 'checkout': {}, 'count': 0}
+
+
+def count_items(items):
+    return sum(int(q) for q in items.values())
+
+
+class CartStore(ABC):
+    """Giao diện lưu giỏ hàng phía server. Cookie chỉ giữ cart_id.
+    Backend thiếu phương thức nào sẽ lỗi ngay khi tạo (TypeError), không phải giữa request."""
+
+    @abstractmethod
+    def load(self, cart_id):
+        """Trả về bản ghi giỏ (dict như empty_cart()); giỏ không tồn tại/hết hạn -> giỏ rỗng."""
+
+    @abstractmethod
+    def save(self, cart_id, cart):
+        """Lưu bản ghi giỏ; tự tính lại count từ items."""
+
+    @abstractmethod
+    def item_count(self, cart_id):
+        """Tổng số lượng trong giỏ (đọc giá trị đã lưu sẵn, không cộng lại)."""
+
+    @abstractmethod
+    def delete(self, cart_id):
+        """Xóa giỏ khỏi kho lưu (không lỗi nếu giỏ không tồn tại)."""
+
+
+class MemoryCartStore(CartStore):
+    """Lưu trong bộ nhớ tiến trình, hết hạn sau ttl giây không dùng.
+    Chỉ phù hợp khi chạy 1 worker (dev/test)."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._carts = {}
+        self._lock = threading.Lock()
+
+    def _get_live(self, cart_id, now):
+        entry = self._carts.get(cart_id)
+        if entry is None:
+            return None
+        expires_at, cart = entry
+        if expires_at < now:
+            del self._carts[cart_id]
+            return None
+        return cart
+
+    def load(self, cart_id):
+        with self._lock:
+            cart = self._get_live(cart_id, time.monotonic())
+            if cart is None:
+                return empty_cart()
+            return {'items': dict(cart['items']), 'checkout': dict(cart['checkout']), 'count': cart['count']}
+
+    def save(self, cart_id, cart):
+        record = {'items': dict(cart['items']), 'checkout': dict(cart['checkout']),
+                  'count': count_items(cart['items'])}
+        now = time.monotonic()
+        with self._lock:
+            self._carts[cart_id] = (now + self.ttl, record)
+            # Dọn các giỏ hết hạn khi kho phình to
+            if len(self._carts) > 10000:
+                for key in [k for k, (expires_at, _) in self._carts.items() if expires_at < now]:
+                    del self._carts[key]
+
+    def item_count(self, cart_id):
+        with self._lock:
+            cart = self._get_live(cart_id, time.monotonic())
+            return cart['count'] if cart else 0
+
+    def delete(self, cart_id):
+        with self._lock:
+            self._carts.pop(cart_id, None)
+
+
+class SQLCartStore(CartStore):
+    """Lưu trong bảng cart_session của DB chính (SQLite), dùng chung giữa các worker.
+
+    Dùng kết nối/transaction riêng (engine.begin()) để không commit lẫn các thay
+    đổi đang chờ trong db.session của request.
+    """
+
+    def __init__(self, db, model, ttl, purge_interval=3600):
+        self.db = db
+        self.table = model.__table__
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._last_purge = 0
+
+    def load(self, cart_id):
+        with self.db.engine.connect() as conn:
+            row = conn.execute(
+                self.db.select(self.table.c['items'], self.table.c.checkout, self.table.c.item_count)
+                .where(self.table.c.cart_id == cart_id, self.table.c.expires_at >= time.time())
+            ).first()
+        if row is None:
+            return empty_cart()
+        return {'items': json.loads(row.items), 'checkout': json.loads(row.checkout), 'count': row.item_count}
+
+    def save(self, cart_id, cart):
+        now = time.time()
+        values = {
+            'cart_id': cart_id,
+            'items': json.dumps(cart['items']),
+            'checkout': json.dumps(cart['checkout']),
+            'item_count': count_items(cart['items']),
+            'expires_at': now + self.ttl,
+        }
+        stmt = sqlite_insert(self.table).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['cart_id'],
+            set_={key: stmt.excluded[key] for key in values if key != 'cart_id'}
+        )
+        with self.db.engine.begin() as conn:
+            conn.execute(stmt)
+            if now - self._last_purge > self.purge_interval:
+                self._last_purge = now
+                conn.execute(self.table.delete().where(self.table.c.expires_at < now))
+
+    def item_count(self, cart_id):
+        with self.db.engine.connect() as conn:
+            count = conn.execute(
+                self.db.select(self.table.c.item_count)
+                .where(self.table.c.cart_id == cart_id, self.table.c.expires_at >= time.time())
+            ).scalar()
+        return count or 0
+
+    def delete(self, cart_id):
+        with self.db.engine.begin() as conn:
+            conn.execute(self.table.delete().where(self.table.c.cart_id == cart_id))
@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+# Giá trị đánh dấu "không có trong cache" (phân biệt với việc cache giá trị None)
+MISSING = object()
+
+
+def snapshot(model_obj):
+    """Chụp các cột của một đối tượng ORM thành SimpleNamespace (an toàn để dùng
+    lại giữa các request/thread, không lazy-load, không gắn với session)."""
+    if model_obj is None:
+        return None
+    return SimpleNamespace(**{
+        column.key: getattr(model_obj, column.key)
+        for column in model_obj.__table__.columns
+    })
+
+
+class CatalogCache:
+    """Cache đọc-xuyên (read-through) trong tiến trình, có TTL và giới hạn LRU.
+
+    Mỗi lần đọc truyền vào phiên bản catalog hiện tại (lấy từ DB). Khi phiên bản
+    thay đổi, toàn bộ cache bị xóa, nhờ vậy nhiều worker gunicorn đều thấy thay
+    đổi của admin ngay ở request kế tiếp mà không cần giao tiếp trực tiếp.
+    """
+
+    def __init__(self, ttl=60, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+                return MISSING
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, version, value):
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, key, version, loader):
+        """Trả về giá trị trong cache, hoặc gọi loader() rồi lưu lại kết quả."""
+        value = self.get(key, version)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = loader()
+        self.set(key, version, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._version = None
@@ -0,0 +1,105 @@
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:  # brotli là phụ thuộc tùy chọn: thiếu thì chỉ dùng gzip
+    brotli = None
+
+# Kiểu nội dung đáng nén (ảnh JPEG/PNG/WebP đã nén sẵn, nén lại chỉ tốn CPU)
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/javascript', 'application/json', 'application/x-ndjson',
+    'application/xml', 'image/svg+xml',
+}
+# Phần mở rộng của tệp tĩnh được nén trước bởi lệnh precompress-static
+PRECOMPRESS_EXTENSIONS = {'.css', '.js', '.mjs', '.json', '.svg', '.txt', '.html', '.xml', '.map'}
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def brotli_available():
+    return brotli is not None
+
+
+def supported_encodings():
+    # Thứ tự ưu tiên khi trình duyệt chấp nhận nhiều kiểu với cùng q
+    return ['br', 'gzip'] if brotli_available() else ['gzip']
+
+
+def is_compressible(mimetype):
+    return mimetype in COMPRESSIBLE_MIMETYPES or (mimetype or '').startswith('text/')
+
+
+def choose_encoding(accept_encodings, available):
+    """Chọn mã hóa tốt nhất trong available theo header Accept-Encoding đã parse
+    (request.accept_encodings). Trả về None nếu nên gửi bản không nén."""
+    best, best_quality = None, 0
+    for encoding in available:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress_bytes(data, encoding, level):
+    """level: 1-9 cho gzip, 0-11 cho brotli."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    # mtime=0 để cùng nội dung cho ra cùng bytes (ETag/so sánh ổn định)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def encoded_etag(etag, encoding):
+    """ETag riêng cho bản nén: cùng URL nhưng bytes khác nhau thì ETag phải khác."""
+    return f"{etag}-{encoding}"
+
+
+def precompressed_path(path, encoding):
+    return path + ENCODING_SUFFIXES[encoding]
+
+
+def fresh_precompressed(path, encoding):
+    """Bản nén sẵn còn dùng được: tồn tại và không cũ hơn tệp gốc."""
+    candidate = precompressed_path(path, encoding)
+    try:
+        return os.stat(candidate).st_mtime >= os.stat(path).st_mtime
+    except OSError:
+        return False
+
+
+def precompress_file(path, min_size, gzip_level=9, brotli_quality=11):
+    """Ghi các tệp anh em .gz/.br cạnh tệp gốc. Bỏ qua tệp nhỏ, bản nén không nhỏ
+    hơn bản gốc (xóa bản cũ nếu có) và bản nén còn mới. Trả về danh sách tệp đã ghi."""
+    written = []
+    if os.path.getsize(path) < min_size:
+        return written
+    with open(path, 'rb') as f:
+        data = f.read()
+    levels = {'gzip': gzip_level, 'br': brotli_quality}
+    for encoding in supported_encodings():
+        target = precompressed_path(path, encoding)
+        if fresh_precompressed(path, encoding):
+            continue
+        compressed = compress_bytes(data, encoding, levels[encoding])
+        if len(compressed) >= len(data):
+            if os.path.exists(target):
+                os.remove(target)
+            continue
+        tmp_path = target + '.tmp'
+        with open(tmp_path, 'wb') as out:
+            out.write(compressed)
+        os.replace(tmp_path, target)
+        written.append(target)
+    return written
+
+
+def precompress_tree(root, min_size, extensions=PRECOMPRESS_EXTENSIONS):
+    """Nén sẵn mọi tệp văn bản dưới root. Trả về (số tệp đã xét, danh sách tệp đã ghi)."""
+    checked, written = 0, []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if os.path.splitext(name)[1].lower() not in extensions:
+                continue
+            checked += 1
+            written.extend(precompress_file(os.path.join(dirpath, name), min_size))
+    return checked, written
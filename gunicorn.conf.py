@@ -0,0 +1,59 @@
+"""Cấu hình gunicorn cho production: gunicorn -c gunicorn.conf.py wsgi:app
+
+preload_app: master import app một lần (kể cả biên dịch template) rồi fork worker,
+nên tạo mới/thay worker (max_requests) gần như tức thời và dùng chung bộ nhớ
+copy-on-write. Phần thiết lập một lần (migration, dữ liệu mặc định...) chạy trong
+master ở on_starting, không lặp lại ở từng worker.
+"""
+import os
+import time
+
+bind = os.environ.get('BIND', '0.0.0.0:9754')
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+# gthread: luồng SSE của admin giữ một thread, không chặn cả worker
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+preload_app = True
+# Thay worker định kỳ (jitter để các worker không khởi động lại cùng lúc)
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = max_requests // 10
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
+
+# Bỏ qua setup khi nhiều instance cùng triển khai và setup đã được chạy riêng
+# ('flask --app app setup-deployment' trong bước deploy)
+SKIP_SETUP = os.environ.get('SKIP_DEPLOYMENT_SETUP') == '1'
+
+
+def on_starting(server):
+    if not SKIP_SETUP:
+        from app import setup_deployment
+        setup_deployment()
+    # Snapshot số liệu của worker lần chạy trước (master bị kill, không kịp child_exit)
+    from app import retire_worker_metrics
+    retire_worker_metrics()
+
+
+def post_fork(server, worker):
+    worker.boot_started = time.perf_counter()
+    from app import reset_after_fork
+    reset_after_fork()
+
+
+def post_worker_init(worker):
+    elapsed = (time.perf_counter() - worker.boot_started) * 1000
+    worker.log.info("[Startup] Worker %s sẵn sàng sau %.0f ms", worker.pid, elapsed)
+
+
+def worker_exit(server, worker):
+    from app import flush_worker_metrics
+    flush_worker_metrics()
+
+
+def child_exit(server, worker):
+    # Worker đã dừng (recycle, crash, tắt): gộp snapshot của nó để pid dùng lại không
+    # ghi đè và thư mục số liệu không phình theo số worker đã từng chạy
+    from app import retire_worker_metrics
+    retire_worker_metrics(worker.pid)
@@ -0,0 +1,78 @@
+import functools
+import importlib.util
+import os
+import uuid
+
+# Các kích thước biến thể (chiều rộng tối đa, px). Ảnh nhỏ hơn không bị phóng to.
+VARIANT_WIDTHS = {
+    'thumb': 320,
+    'card': 640,
+    'full': 1600,
+}
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+# Thư mục con (trong mỗi thư mục upload) chứa các biến thể
+VARIANT_DIRNAME = '_variants'
+
+
+@functools.lru_cache(maxsize=None)
+def pillow_available():
+    # Pillow là phụ thuộc tùy chọn: thiếu thì chỉ phục vụ ảnh gốc.
+    # Chỉ kiểm tra có cài hay không; PIL được import trong process tạo ảnh,
+    # worker web không phải nạp nó khi khởi động.
+    return importlib.util.find_spec('PIL') is not None
+
+
+def variant_filename(filename, size, fmt):
+    """'IMG_1.jpeg', 'card', 'webp' -> 'IMG_1__card.webp'"""
+    stem = os.path.splitext(filename)[0]
+    return f"{stem}__{size}.{fmt}"
+
+
+def variant_path(folder, filename, size, fmt):
+    return os.path.join(folder, VARIANT_DIRNAME, variant_filename(filename, size, fmt))
+
+
+def generate_variants(folder, filename):
+    """Tạo các biến thể (thumb/card/full x webp/jpg) cho một ảnh đã upload.
+
+    Chạy trong process pool nên chỉ nhận/trả kiểu dữ liệu đơn giản. Ảnh được xoay
+    theo EXIF rồi lưu lại không kèm EXIF/metadata. Trả về danh sách tên tệp đã tạo.
+    """
+    if not pillow_available():
+        return []
+    from PIL import Image, ImageOps
+
+    src_path = os.path.join(folder, filename)
+    out_dir = os.path.join(folder, VARIANT_DIRNAME)
+    os.makedirs(out_dir, exist_ok=True)
+
+    created = []
+    with Image.open(src_path) as original:
+        image = ImageOps.exif_transpose(original)
+        # Ảnh GIF/PNG có kênh alpha hoặc palette -> chuyển RGB cho JPEG
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        for size, max_width in VARIANT_WIDTHS.items():
+            resized = image.copy()
+            resized.thumbnail((max_width, max_width * 4), Image.LANCZOS)
+            for fmt, (pil_format, save_options) in VARIANT_FORMATS.items():
+                out_name = variant_filename(filename, size, fmt)
+                tmp_path = os.path.join(out_dir, f".{out_name}.{uuid.uuid4().hex}.tmp")
+                # Không truyền exif=... nên metadata gốc bị loại bỏ
+                resized.save(tmp_path, pil_format, **save_options)
+                # Ghi qua tệp tạm rồi đổi tên để request không đọc phải tệp dở dang
+                os.replace(tmp_path, os.path.join(out_dir, out_name))
+                created.append(out_name)
+    return created
+
+
+def remove_variants(folder, filename):
+    """Xóa mọi biến thể của một ảnh (khi ảnh gốc bị xóa/thay thế)."""
+    for size in VARIANT_WIDTHS:
+        for fmt in VARIANT_FORMATS:
+            path = variant_path(folder, filename, size, fmt)
+            if os.path.exists(path):
+                os.remove(path)
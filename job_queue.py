@@ -0,0 +1,215 @@
+import datetime
+import json
+import os
+import random
+import socket
+import threading
+import traceback
+
+from sqlalchemy.exc import OperationalError
+
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+
+
+class JobQueue:
+    """Hàng đợi việc nền bền vững, lưu trong bảng background_job của DB chính.
+
+    enqueue() chỉ thêm dòng vào db.session của request: việc được commit cùng thay
+    đổi dữ liệu (rollback thì việc cũng mất) và vẫn còn sau khi khởi động lại.
+    Worker là các luồng trong tiến trình web hoặc tiến trình riêng ('flask run-jobs').
+    Mỗi việc được nhận bằng một lệnh UPDATE ... RETURNING nên nhiều luồng/tiến trình
+    không nhận trùng; vòng poll khi hàng đợi rỗng chỉ chạy một SELECT, không ghi. Việc đang chạy mà tiến trình chết sẽ được trả lại hàng đợi
+    sau lease giây. Việc lỗi được thử lại theo backoff lũy thừa, quá max_attempts
+    lần thì chuyển sang 'failed' để admin xem và chạy lại.
+    """
+
+    def __init__(self, db, model, app, workers=2, poll_interval=1.0, lease=600,
+                 max_attempts=5, backoff_base=5, backoff_max=3600, retention_days=7, handlers=None):
+        self.db = db
+        self.model = model
+        self.table = model.__table__
+        self.app = app
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retention_days = retention_days
+        # Có thể truyền registry dùng chung (dict kind -> hàm) cho nhiều hàng đợi
+        self.handlers = handlers if handlers is not None else {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._started_pid = None
+        self._last_maintenance = datetime.datetime.min
+
+    @property
+    def engine(self):
+        # Luồng worker không có app context sẵn như request
+        with self.app.app_context():
+            return self.db.engine
+
+    def handler(self, kind):
+        """Đăng ký hàm xử lý cho một loại việc; hàm nhận payload (dict) và chạy trong app context."""
+        def decorator(f):
+            self.handlers[kind] = f
+            return f
+        return decorator
+
+    def enqueue(self, kind, payload, delay=0, max_attempts=None):
+        """Thêm việc vào transaction hiện tại của db.session (người gọi commit)."""
+        if kind not in self.handlers:
+            raise ValueError(f"Chưa đăng ký handler cho loại việc '{kind}'")
+        self.db.session.add(self.model(
+            kind=kind,
+            payload=json.dumps(payload, ensure_ascii=False),
+            max_attempts=max_attempts or self.max_attempts,
+            run_at=datetime.datetime.utcnow() + datetime.timedelta(seconds=delay),
+        ))
+        self.db.session.info['job_enqueued'] = True
+
+    def notify(self):
+        """Đánh thức worker của tiến trình này (gọi sau commit có việc mới)."""
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    # --- Nhận và chạy việc ---
+    def claim(self, worker_id):
+        """Nhận một việc đến hạn; trả về dòng (id, kind, payload, attempts, max_attempts) hoặc None."""
+        now = datetime.datetime.utcnow()
+        t = self.table
+        next_job = (self.db.select(t.c.id)
+                    .where(t.c.status == 'queued', t.c.run_at <= now)
+                    .order_by(t.c.run_at, t.c.id).limit(1))
+        stmt = (t.update()
+                .where(t.c.id == next_job.scalar_subquery(), t.c.status == 'queued')
+                .values(status='running', locked_by=worker_id, started_at=now, attempts=t.c.attempts + 1)
+                .returning(t.c.id, t.c.kind, t.c.payload, t.c.attempts, t.c.max_attempts))
+        try:
+            if now - self._last_maintenance > datetime.timedelta(seconds=60):
+                self._last_maintenance = now
+                with self.engine.begin() as conn:
+                    self._maintenance(conn, now)
+            # Hàng đợi rỗng thì chỉ đọc (theo chỉ mục status, run_at): không giữ khóa ghi của
+            # SQLite mỗi vòng poll, tranh chỗ với checkout và thao tác của admin
+            with self.engine.connect() as conn:
+                if conn.execute(next_job).first() is None:
+                    return None
+            with self.engine.begin() as conn:
+                return conn.execute(stmt).first()
+        except OperationalError as e:
+            # DB đang bị khóa ghi lâu hơn busy_timeout: thử lại ở vòng sau
+            print(f"[Jobs] Không nhận được việc: {e}")
+            return None
+
+    def _maintenance(self, conn, now):
+        t = self.table
+        # Việc 'running' quá lease: tiến trình đã chết giữa chừng -> trả lại hàng đợi
+        requeued = conn.execute(
+            t.update()
+            .where(t.c.status == 'running', t.c.started_at < now - datetime.timedelta(seconds=self.lease))
+            .values(status='queued', run_at=now, locked_by=None)
+        ).rowcount
+        if requeued:
+            print(f"[Jobs] Trả lại hàng đợi {requeued} việc quá hạn lease.")
+        conn.execute(t.delete().where(
+            t.c.status == 'done', t.c.finished_at < now - datetime.timedelta(days=self.retention_days)))
+
+    def backoff(self, attempts):
+        """Số giây chờ trước lần thử thứ attempts + 1 (lũy thừa 2, có jitter)."""
+        delay = min(self.backoff_base * 2 ** (attempts - 1), self.backoff_max)
+        return delay * random.uniform(0.75, 1.25)
+
+    def run_job(self, job, worker_id):
+        t = self.table
+        try:
+            handler = self.handlers.get(job.kind)
+            if handler is None:
+                raise LookupError(f"Không có handler cho loại việc '{job.kind}'")
+            with self.app.app_context():
+                handler(json.loads(job.payload))
+        except Exception as e:
+            now = datetime.datetime.utcnow()
+            error = f"{type(e).__name__}: {e}\n{traceback.format_exc(limit=5)}"[:4000]
+            if job.attempts >= job.max_attempts:
+                values = {'status': 'failed', 'finished_at': now}
+                print(f"[Jobs] Việc #{job.id} ({job.kind}) thất bại sau {job.attempts} lần: {e}")
+            else:
+                values = {'status': 'queued',
+                          'run_at': now + datetime.timedelta(seconds=self.backoff(job.attempts))}
+                print(f"[Jobs] Việc #{job.id} ({job.kind}) lỗi lần {job.attempts}, sẽ thử lại: {e}")
+            values.update(last_error=error, locked_by=None)
+        else:
+            values = {'status': 'done', 'finished_at': datetime.datetime.utcnow(), 'locked_by': None}
+        # Chỉ cập nhật nếu việc vẫn thuộc worker này (lease chưa bị trả lại cho worker khác)
+        with self.engine.begin() as conn:
+            conn.execute(t.update().where(t.c.id == job.id, t.c.locked_by == worker_id).values(**values))
+
+    def run_pending(self, worker_id='inline'):
+        """Chạy hết các việc đang đến hạn ngay trong luồng hiện tại. Trả về số việc đã chạy."""
+        count = 0
+        while True:
+            job = self.claim(worker_id)
+            if job is None:
+                return count
+            self.run_job(job, worker_id)
+            count += 1
+
+    # --- Luồng worker ---
+    def _worker_loop(self, worker_id):
+        while not self._stopping.is_set():
+            try:
+                job = self.claim(worker_id)
+                if job is not None:
+                    self.run_job(job, worker_id)
+                    continue
+            except Exception as e:
+                # Không để luồng worker chết vì lỗi DB tạm thời; việc dở sẽ được trả lại theo lease
+                print(f"[Jobs] Lỗi worker {worker_id}: {e}")
+            with self._wakeup:
+                self._wakeup.wait(self.poll_interval)
+
+    def start(self, workers=None):
+        """Khởi động luồng worker (một lần mỗi tiến trình; tiến trình con sau fork tự khởi động lại)."""
+        workers = self.workers if workers is None else workers
+        if workers <= 0 or self._started_pid == os.getpid():
+            return []
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return []
+            self._started_pid = os.getpid()
+            self._stopping = threading.Event()
+            threads = []
+            for index in range(workers):
+                worker_id = f"{socket.gethostname()}:{os.getpid()}:{index}"
+                thread = threading.Thread(target=self._worker_loop, args=(worker_id,),
+                                          name=f"job-worker-{index}", daemon=True)
+                thread.start()
+                threads.append(thread)
+            return threads
+
+    def stop(self):
+        self._stopping.set()
+        self.notify()
+
+    # --- Cho trang quản trị ---
+    def status_counts(self):
+        t = self.table
+        with self.engine.connect() as conn:
+            rows = conn.execute(self.db.select(t.c.status, self.db.func.count()).group_by(t.c.status)).all()
+        counts = dict.fromkeys(JOB_STATUSES, 0)
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    def retry(self, job_id):
+        """Đưa việc 'failed' về hàng đợi, chạy ngay, đếm lại số lần thử. Trả về True nếu đổi được."""
+        t = self.table
+        with self.engine.begin() as conn:
+            updated = conn.execute(
+                t.update().where(t.c.id == job_id, t.c.status == 'failed')
+                .values(status='queued', attempts=0, run_at=datetime.datetime.utcnow(), finished_at=None)
+            ).rowcount
+        if updated:
+            self.notify()
+        return bool(updated)
@@ -0,0 +1,224 @@
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows (chỉ chạy dev 1 tiến trình): không cần khóa thư mục
+    fcntl = None
+
+# Ngưỡng histogram độ trễ (giây), giống mặc định của client Prometheus
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Tổng số liệu của các tiến trình đã dừng (xem fold_snapshots)
+RETIRED_SNAPSHOT = 'metrics-retired.json'
+
+
+def _new_series():
+    return {
+        'requests': {},                               # {status_code: count}
+        'latency_buckets': [0] * len(LATENCY_BUCKETS),
+        'latency_count': 0,
+        'latency_sum': 0.0,
+        'sql_statements': 0,
+        'sql_seconds': 0.0,
+    }
+
+
+def _merge_series(merged, snapshot):
+    for endpoint, series in snapshot.items():
+        target = merged.setdefault(endpoint, _new_series())
+        for status, count in series['requests'].items():
+            target['requests'][status] = target['requests'].get(status, 0) + count
+        for i, count in enumerate(series['latency_buckets']):
+            target['latency_buckets'][i] += count
+        for key in ('latency_count', 'latency_sum', 'sql_statements', 'sql_seconds'):
+            target[key] += series[key]
+    return merged
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_snapshot(path, payload):
+    # Tệp tạm riêng cho từng luồng: hai luồng flush cùng lúc không giành nhau một tệp tạm
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def _directory_lock(directory, exclusive):
+    """Khóa giữa collect() (đọc, dùng chung) và fold_snapshots() (gộp + xóa, độc quyền):
+    không bao giờ đọc được trạng thái giữa chừng, khi số liệu nằm ở cả hai tệp hoặc không tệp nào."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, '.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _snapshot_pid(path):
+    try:
+        return int(os.path.basename(path).split('-')[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _pid_alive(pid):
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def fold_snapshots(directory, pid=None):
+    """Cộng snapshot của tiến trình đã dừng (pid; None = mọi tiến trình không còn chạy) vào
+    RETIRED_SNAPSHOT rồi xóa tệp của nó: bộ đếm không tụt, thư mục không phình theo số
+    worker đã từng chạy.
+    Chỉ gọi khi các tiến trình đó đã dừng hẳn (gunicorn: child_exit / on_starting)."""
+    pattern = f"metrics-{pid}-*.json" if pid is not None else 'metrics-*-*.json'
+    with _directory_lock(directory, exclusive=True):
+        paths = glob.glob(os.path.join(directory, pattern))
+        if pid is None:
+            paths = [path for path in paths if not _pid_alive(_snapshot_pid(path))]
+        if not paths:
+            return 0
+        retired_path = os.path.join(directory, RETIRED_SNAPSHOT)
+        merged = _read_snapshot(retired_path) or {}
+        for path in paths:
+            _merge_series(merged, _read_snapshot(path) or {})
+        _write_snapshot(retired_path, json.dumps(merged))
+        for path in paths:
+            os.remove(path)
+        return len(paths)
+
+
+class MetricsRegistry:
+    """Thu thập số liệu theo endpoint trong một tiến trình.
+
+    An toàn với nhiều worker: mỗi tiến trình định kỳ ghi snapshot của mình ra
+    <directory>/metrics-<pid>-<thời điểm bắt đầu>.json (ghi tệp tạm rồi đổi tên), nên
+    tiến trình mới trùng pid không ghi đè số liệu của tiến trình cũ. Worker đã dừng được
+    gộp vào RETIRED_SNAPSHOT (fold_snapshots, gọi từ master gunicorn). Khi xuất số liệu,
+    mọi snapshot được cộng lại nên bộ đếm không bị tụt khi gunicorn recycle worker.
+    """
+
+    def __init__(self, directory, flush_interval=5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._series = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+        self._pid = None
+        self._started = None
+
+    def observe(self, endpoint, status, duration, sql_statements, sql_seconds):
+        with self._lock:
+            series = self._series.setdefault(endpoint, _new_series())
+            status = str(status)
+            series['requests'][status] = series['requests'].get(status, 0) + 1
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    series['latency_buckets'][i] += 1
+                    break
+            series['latency_count'] += 1
+            series['latency_sum'] += duration
+            series['sql_statements'] += sql_statements
+            series['sql_seconds'] += sql_seconds
+        if time.monotonic() - self._last_flush > self.flush_interval:
+            self.flush()
+
+    def _snapshot_path(self):
+        return os.path.join(self.directory, f"metrics-{self._pid}-{self._started}.json")
+
+    def flush(self):
+        """Ghi snapshot của tiến trình hiện tại ra đĩa."""
+        # Tiến trình con (fork) không được mang theo số liệu của cha
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid is not None:
+                    self._series = {}
+                self._pid = os.getpid()
+                self._started = int(time.time() * 1000)
+        self._last_flush = time.monotonic()
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            payload = json.dumps(self._series)
+        _write_snapshot(self._snapshot_path(), payload)
+
+    def retire(self, pid=None):
+        """Gộp snapshot của tiến trình đã dừng (xem fold_snapshots)."""
+        return fold_snapshots(self.directory, pid)
+
+    def collect(self):
+        """Cộng số liệu của mọi worker (đọc các snapshot trên đĩa)."""
+        self.flush()
+        merged = {}
+        with _directory_lock(self.directory, exclusive=False):
+            for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+                _merge_series(merged, _read_snapshot(path) or {})
+        return merged
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(merged):
+    """Xuất số liệu theo định dạng văn bản của Prometheus (text format 0.0.4)."""
+    lines = [
+        '# HELP http_requests_total Số request theo endpoint và mã trạng thái.',
+        '# TYPE http_requests_total counter',
+    ]
+    for endpoint in sorted(merged):
+        for status, count in sorted(merged[endpoint]['requests'].items()):
+            lines.append(f'http_requests_total{{endpoint="{_label(endpoint)}",status="{status}"}} {count}')
+
+    lines += [
+        '# HELP http_request_duration_seconds Độ trễ request theo endpoint.',
+        '# TYPE http_request_duration_seconds histogram',
+    ]
+    for endpoint in sorted(merged):
+        series = merged[endpoint]
+        label = _label(endpoint)
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, series['latency_buckets']):
+            cumulative += count
+            lines.append(f'http_request_duration_seconds_bucket{{endpoint="{label}",le="{bound}"}} {cumulative}')
+        lines.append(f'http_request_duration_seconds_bucket{{endpoint="{label}",le="+Inf"}} {series["latency_count"]}')
+        lines.append(f'http_request_duration_seconds_sum{{endpoint="{label}"}} {series["latency_sum"]:.6f}')
+        lines.append(f'http_request_duration_seconds_count{{endpoint="{label}"}} {series["latency_count"]}')
+
+    lines += [
+        '# HELP sql_statements_total Số câu lệnh SQL thực thi theo endpoint.',
+        '# TYPE sql_statements_total counter',
+    ]
+    for endpoint in sorted(merged):
+        lines.append(f'sql_statements_total{{endpoint="{_label(endpoint)}"}} {merged[endpoint]["sql_statements"]}')
+
+    lines += [
+        '# HELP sql_duration_seconds_total Tổng thời gian chạy SQL theo endpoint.',
+        '# TYPE sql_duration_seconds_total counter',
+    ]
+    for endpoint in sorted(merged):
+        lines.append(f'sql_duration_seconds_total{{endpoint="{_label(endpoint)}"}} {merged[endpoint]["sql_seconds"]:.6f}')
+    return '\n'.join(lines) + '\n'
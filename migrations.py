@@ -0,0 +1,75 @@
+import datetime
+
+from sqlalchemy import text
+
+# Danh sách migration theo phiên bản, chỉ được THÊM vào cuối, không sửa bản đã phát hành.
+# db.create_all() không đổi bảng đã tồn tại, nên mọi thay đổi schema cho DB đang chạy
+# (users.db) phải đi qua đây. Model trong app.py khai báo cùng tên chỉ mục để DB mới
+# tạo bằng create_all đã có sẵn, khi đó các lệnh IF NOT EXISTS bên dưới không làm gì.
+#
+# Mỗi migration chạy trong MỘT transaction (engine.begin() trong run_migrations): các lệnh
+# DDL và dòng ghi vào schema_migration được commit cùng lúc, lỗi giữa chừng thì rollback
+# toàn bộ. Với SQLite, engine.begin() một mình KHÔNG đủ (sqlite3 không tự BEGIN trước DDL
+# nên từng lệnh sẽ tự commit), vì vậy run_migrations mở BEGIN IMMEDIATE tường minh.
+# Nhờ vậy migration là nguyên tử, không cần tách nhỏ hay tự dọn dẹp khi lỗi.
+# Các lệnh vẫn nên viết dạng IF NOT EXISTS vì DB mới tạo bằng create_all đã có sẵn chỉ mục.
+MIGRATIONS = [
+    (1, 'Chỉ mục cho các truy vấn nóng (giao dịch, lịch sử đơn, thống kê, tin nhắn)', [
+        'CREATE INDEX IF NOT EXISTS ix_order_created_at ON "order" (created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_order_status_created_at ON "order" (status, created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_order_customer_id_created_at ON "order" (customer_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_order_item_order_id ON order_item (order_id)',
+        'CREATE INDEX IF NOT EXISTS ix_order_item_product_id ON order_item (product_id)',
+        'CREATE INDEX IF NOT EXISTS ix_message_created_at ON message (created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_message_is_read_created_at ON message (is_read, created_at)',
+        # Cập nhật thống kê để bộ lập kế hoạch chọn đúng chỉ mục mới
+        'ANALYZE',
+    ]),
+]
+
+MIGRATION_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS schema_migration (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR(200) NOT NULL,
+    applied_at DATETIME NOT NULL
+)
+"""
+
+
+def applied_versions(conn):
+    conn.execute(text(MIGRATION_TABLE_DDL))
+    return {row[0] for row in conn.execute(text("SELECT version FROM schema_migration"))}
+
+
+def pending_migrations(engine):
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+    return [migration for migration in MIGRATIONS if migration[0] not in done]
+
+
+def run_migrations(engine, busy_timeout_ms=30000, log=print):
+    """Áp dụng các migration chưa chạy theo thứ tự phiên bản. Trả về danh sách phiên bản đã áp dụng.
+
+    Chạy được khi app đang phục vụ: mỗi migration giữ khóa ghi trong suốt transaction
+    của nó (người đọc không bị chặn nếu DB ở chế độ WAL, người ghi chờ theo
+    busy_timeout), không cần dừng server.
+    """
+    applied = []
+    for version, name, statements in pending_migrations(engine):
+        started = datetime.datetime.now()
+        with engine.begin() as conn:
+            if engine.dialect.name == 'sqlite':
+                conn.execute(text(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}"))
+                # sqlite3 chỉ tự BEGIN trước INSERT/UPDATE/DELETE, DDL sẽ tự commit từng lệnh
+                # nếu không mở transaction tường minh ở đây.
+                conn.exec_driver_sql("BEGIN IMMEDIATE")
+            for statement in statements:
+                conn.execute(text(statement))
+            conn.execute(
+                text("INSERT INTO schema_migration (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+                {"version": version, "name": name, "applied_at": datetime.datetime.utcnow()}
+            )
+        elapsed = (datetime.datetime.now() - started).total_seconds()
+        log(f"[Migration] {version}: {name} ({elapsed:.1f}s)")
+        applied.append(version)
+    return applied
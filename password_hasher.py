@@ -0,0 +1,158 @@
+import multiprocessing
+import threading
+import time
+from collections import deque
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
+
+
+class HashingBusy(Exception):
+    """Hàng đợi băm mật khẩu đã đầy (quá nhiều đăng nhập cùng lúc)."""
+
+
+def _hash_password(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify_password(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+
+def hash_method_of(pwhash):
+    """'scrypt:32768:8:1$salt$hash' -> 'scrypt:32768:8:1'"""
+    return pwhash.split('$', 1)[0]
+
+
+def normalize_hash_method(method):
+    """Đưa method về đúng dạng werkzeug ghi vào hash (điền tham số mặc định, số nguyên chuẩn):
+    'scrypt' -> 'scrypt:32768:8:1', 'pbkdf2:sha256' -> 'pbkdf2:sha256:<số vòng mặc định>'.
+    Method không hợp lệ -> ValueError (như generate_password_hash)."""
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        if not args:
+            args = [2 ** 15, 8, 1]
+        elif len(args) != 3:
+            raise ValueError("'scrypt' cần 3 tham số (n:r:p).")
+        n, r, p = map(int, args)
+        return f"scrypt:{n}:{r}:{p}"
+    if name == 'pbkdf2':
+        if len(args) > 2:
+            raise ValueError("'pbkdf2' cần tối đa 2 tham số (hash:số vòng).")
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) == 2 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{iterations}"
+    raise ValueError(f"Phương thức băm không hợp lệ: '{method}'")
+
+
+class PasswordHasher:
+    """Băm/kiểm tra mật khẩu trong process pool có giới hạn.
+
+    - method: chuỗi phương thức của werkzeug ('scrypt:32768:8:1', 'pbkdf2:sha256:600000', ...)
+    - workers: số process băm (giới hạn CPU dành cho việc băm)
+    - max_pending: số việc tối đa được chờ cùng lúc; vượt quá thì ném HashingBusy
+      ngay thay vì để mọi worker web bị kẹt chờ
+    """
+
+    def __init__(self, method, workers=2, max_pending=32, wait_timeout=5.0, sample_size=500):
+        # Chuẩn hóa một lần khi khởi động: so sánh được với method lưu trong hash, và cấu
+        # hình sai thì lỗi ngay thay vì ở lần đăng nhập đầu tiên
+        self.method = normalize_hash_method(method)
+        self.workers = workers
+        self.wait_timeout = wait_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._samples = {'hash': deque(maxlen=sample_size), 'verify': deque(maxlen=sample_size)}
+        self._counts = {'hash': 0, 'verify': 0, 'rejected': 0, 'upgraded': 0}
+        self._stats_lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                # Import khi cần: worker web chưa đăng nhập lần nào không phải nạp module này
+                from concurrent.futures import ProcessPoolExecutor
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def reset_after_fork(self):
+        """Gọi trong tiến trình con ngay sau fork: process pool của tiến trình cha không dùng được."""
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            with self._stats_lock:
+                self._counts['rejected'] += 1
+            raise HashingBusy()
+        try:
+            future = self._get_pool().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _record(self, kind, started):
+        with self._stats_lock:
+            self._counts[kind] += 1
+            self._samples[kind].append(time.perf_counter() - started)
+
+    def hash(self, password):
+        started = time.perf_counter()
+        result = self._submit(_hash_password, password, self.method).result()
+        self._record('hash', started)
+        return result
+
+    def verify(self, pwhash, password):
+        started = time.perf_counter()
+        result = self._submit(_verify_password, pwhash, password).result()
+        self._record('verify', started)
+        return result
+
+    def verify_and_hash(self, pwhash, password, new_password):
+        """Kiểm tra mật khẩu cũ và băm mật khẩu mới song song (2 process)."""
+        started = time.perf_counter()
+        verify_future = self._submit(_verify_password, pwhash, password)
+        try:
+            hash_future = self._submit(_hash_password, new_password, self.method)
+        except HashingBusy:
+            verify_future.cancel()
+            raise
+        matches, new_hash = verify_future.result(), hash_future.result()
+        self._record('verify', started)
+        self._record('hash', started)
+        return matches, new_hash
+
+    def needs_rehash(self, pwhash):
+        """Hash được tạo với thuật toán/tham số khác method hiện tại -> cần băm lại."""
+        try:
+            return normalize_hash_method(hash_method_of(pwhash)) != self.method
+        except ValueError:
+            return True
+
+    def mark_upgraded(self):
+        with self._stats_lock:
+            self._counts['upgraded'] += 1
+
+    def stats(self):
+        """Thống kê độ trễ (ms) để cân chỉnh cost theo ngân sách CPU."""
+        with self._stats_lock:
+            result = {'method': self.method, 'workers': self.workers, **self._counts}
+            for kind, samples in self._samples.items():
+                ordered = sorted(samples)
+                if ordered:
+                    result[f'{kind}_ms'] = {
+                        'p50': round(ordered[len(ordered) // 2] * 1000, 1),
+                        'p95': round(ordered[max(int(len(ordered) * 0.95) - 1, 0)] * 1000, 1),
+                        'max': round(ordered[-1] * 1000, 1),
+                    }
+            return result
+
+
+def benchmark_method(method, rounds=5):
+    """Đo thời gian băm trung bình (ms) của một method ngay trong tiến trình hiện tại."""
+    started = time.perf_counter()
+    for _ in range(rounds):
+        generate_password_hash('benchmark-password-1', method=method)
+    return (time.perf_counter() - started) / rounds * 1000
@@ -0,0 +1,105 @@
+import re
+from collections import Counter
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_PLACEHOLDER_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_NUMBER_RE = re.compile(r'\b\d+\b')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Request vượt ngân sách truy vấn hoặc có truy vấn lặp kiểu N+1."""
+
+
+def statement_shape(statement):
+    """Chuẩn hóa câu SQL để gom các truy vấn cùng dạng.
+
+    'WHERE id IN (?, ?, ?)' và 'LIMIT 50' có cùng dạng với
+    'WHERE id IN (?, ?)' và 'LIMIT 20'.
+    """
+    shape = _WHITESPACE_RE.sub(' ', statement).strip()
+    shape = _STRING_RE.sub('?', shape)
+    shape = _PLACEHOLDER_LIST_RE.sub('(?...)', shape)
+    return _NUMBER_RE.sub('?', shape)
+
+
+def query_budget(max_queries, allow_repeats=False):
+    """Khai báo số truy vấn tối đa cho một route (đặt ngay dưới @route).
+
+    allow_repeats=True cho route cố ý lặp một câu lệnh theo số dòng có giới hạn
+    (ví dụ UPDATE kho từng sản phẩm trong giỏ khi checkout).
+    """
+    def decorator(f):
+        f.query_budget = max_queries
+        f.query_allow_repeats = allow_repeats
+        return f
+    return decorator
+
+
+def find_problems(shapes, budget=None, repeat_threshold=3):
+    """Trả về danh sách mô tả vấn đề (rỗng nếu ổn).
+
+    shapes: Counter {dạng SQL: số lần chạy} của một request.
+    repeat_threshold=None bỏ qua việc kiểm tra truy vấn lặp.
+    """
+    problems = []
+    total = sum(shapes.values())
+    if budget is not None and total > budget:
+        problems.append(f"{total} truy vấn, vượt ngân sách {budget}")
+    if repeat_threshold is None:
+        return problems
+    for shape, count in shapes.most_common():
+        if count < repeat_threshold:
+            break
+        problems.append(f"lặp {count} lần (nghi N+1): {shape[:200]}")
+    return problems
+
+
+@contextmanager
+def count_queries(engine):
+    """Đếm các truy vấn chạy trên engine trong khối with.
+
+        with count_queries(db.engine) as shapes:
+            client.get('/')
+        print(sum(shapes.values()))
+    """
+    shapes = Counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        shapes[statement_shape(statement)] += 1
+
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    try:
+        yield shapes
+    finally:
+        event.remove(engine, 'after_cursor_execute', after_cursor_execute)
+
+
+def assert_query_budget(app, engine, client, path, method='GET', budget=None,
+                        repeat_threshold=3, **request_kwargs):
+    """Gọi một route qua test client và ném QueryBudgetExceeded nếu vượt ngân sách.
+
+    Ngân sách mặc định lấy từ @query_budget của view xử lý path. Trả về response
+    để test kiểm tra tiếp nội dung.
+    """
+    if budget is None:
+        endpoint, _ = app.url_map.bind('localhost').match(path.split('?', 1)[0], method=method)
+        view = app.view_functions[endpoint]
+        budget = getattr(view, 'query_budget', None)
+        if budget is None:
+            raise ValueError(f"Route {endpoint} chưa khai báo @query_budget")
+        if getattr(view, 'query_allow_repeats', False):
+            repeat_threshold = None
+
+    with count_queries(engine) as shapes:
+        response = client.open(path, method=method, **request_kwargs)
+        # Response dạng luồng chỉ chạy truy vấn khi body được đọc: đọc hết trong lúc đếm
+        response.get_data()
+
+    problems = find_problems(shapes, budget, repeat_threshold)
+    if problems:
+        raise QueryBudgetExceeded(f"{method} {path}: " + "; ".join(problems))
+    return response
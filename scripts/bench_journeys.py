@@ -0,0 +1,282 @@
+"""Benchmark đầu-cuối theo hành trình người dùng (khách mua hàng và quản trị).
+
+Hành trình khách : trang cửa hàng -> chi tiết sản phẩm -> thêm vào giỏ -> xác nhận checkout -> đặt hàng
+Hành trình admin : trang giao dịch -> thống kê -> tin nhắn
+
+Chạy trong tiến trình (Flask test client, DB tạm có dữ liệu mẫu):
+
+    python scripts/bench_journeys.py --concurrency 8 --duration 20 --output bench.json
+
+Hoặc bắn vào một server đang chạy (dữ liệu có sẵn, cần tài khoản admin):
+
+    python scripts/bench_journeys.py --base-url http://127.0.0.1:9754 --product-id-max 50
+
+Kết quả in ra thông lượng và độ trễ p50/p95/p99 theo từng route; --output lưu
+JSON (kèm commit git) để so sánh giữa các lần chạy bằng --compare.
+"""
+import argparse
+import datetime
+import http.cookiejar
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class InProcessClient:
+    """Gửi request qua Flask test client (cookie giữ theo từng client)."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, json_body=None, form=None):
+        response = self.client.open(path, method=method, json=json_body, data=form)
+        response.close()
+        return response.status_code
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPClient:
+    """Gửi request tới server thật; không tự theo redirect để đo đúng từng route."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect)
+
+    def request(self, method, path, json_body=None, form=None):
+        headers = {}
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            body = urllib.parse.urlencode(form, doseq=True).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self.opener.open(req, timeout=30) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def timed(self, route, client, method, path, expected=(200,), **kwargs):
+        started = time.perf_counter()
+        status = client.request(method, path, **kwargs)
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.samples.setdefault(route, []).append(elapsed)
+            if status not in expected:
+                self.errors[route] = self.errors.get(route, 0) + 1
+        return status
+
+
+def buyer_journey(client, recorder, rng, product_id_max):
+    product_id = rng.randint(1, product_id_max)
+    recorder.timed('shop.show_shop_page', client, 'GET', '/')
+    recorder.timed('shop.show_product_detail', client, 'GET', f'/product/{product_id}')
+    recorder.timed('shop.add_to_cart_api', client, 'POST', '/api/cart/add',
+                   json_body={'product_id': product_id, 'quantity': 1})
+    recorder.timed('shop.show_checkout_page', client, 'POST', '/checkout',
+                   form={'selected_items': [str(product_id)]})
+    recorder.timed('shop.process_checkout_api', client, 'POST', '/api/checkout/process',
+                   form={'name': 'Khách tải', 'phone': '0900000000',
+                         'address': 'Hà Nội', 'payment_method': 'cash'})
+
+
+def admin_journey(client, recorder, rng, product_id_max):
+    recorder.timed('quanlybanhang.transaction_page', client, 'GET', '/quanlybanhang/transaction')
+    recorder.timed('quanlybanhang.statistics_page', client, 'GET', '/quanlybanhang/statistics')
+    recorder.timed('quanlybanhang.messages_page', client, 'GET', '/quanlybanhang/messages')
+
+
+def percentile(ordered, pct):
+    """Percentile theo nearest-rank trên danh sách đã sắp xếp."""
+    if not ordered:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(recorder, elapsed):
+    routes = {}
+    for route, samples in sorted(recorder.samples.items()):
+        ordered = sorted(samples)
+        routes[route] = {
+            'requests': len(ordered),
+            'errors': recorder.errors.get(route, 0),
+            'throughput_rps': round(len(ordered) / elapsed, 2),
+            'p50_ms': round(percentile(ordered, 50) * 1000, 2),
+            'p95_ms': round(percentile(ordered, 95) * 1000, 2),
+            'p99_ms': round(percentile(ordered, 99) * 1000, 2),
+        }
+    return routes
+
+
+def setup_in_process(args):
+    """Tạo DB tạm với dữ liệu mẫu, trả về (hàm tạo client, product_id_max)."""
+    db_dir = tempfile.mkdtemp(prefix='bench_journeys_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(db_dir, 'bench.db')
+    os.environ.setdefault('METRICS_DIR', os.path.join(db_dir, 'metrics'))
+    sys.path.insert(0, ROOT)
+    from app import app, db, Product, Order, OrderItem, Message, initialize_data, rebuild_sales_rollup
+
+    with app.app_context():
+        db.create_all()
+        rng = random.Random(args.seed)
+        db.session.add_all([
+            Product(name=f'Hoa {i}', price=10000 + i * 100, description=f'Mô tả hoa {i}',
+                    image_filename='bench.jpg', stock_quantity=10 ** 6)
+            for i in range(args.products)
+        ])
+        db.session.flush()
+        now = datetime.datetime.utcnow()
+        statuses = ['pending', 'confirmed', 'shipped', 'delivered', 'rejected']
+        for i in range(args.orders):
+            order = Order(customer_name=f'Khách {i}', customer_phone='0900000000', customer_address='Hà Nội',
+                          total_price=20000, status=rng.choice(statuses),
+                          created_at=now - datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 90)))
+            db.session.add(order)
+            db.session.flush()
+            db.session.add(OrderItem(order_id=order.id, product_id=rng.randint(1, args.products),
+                                     quantity=2, price_at_purchase=10000))
+        db.session.add_all([
+            Message(name=f'Khách {i}', phone='0900000000', content=f'Tin nhắn {i}')
+            for i in range(args.messages)
+        ])
+        db.session.commit()
+        # Trang thống kê đọc sales_rollup: phải tính lại sau khi nạp đơn trực tiếp qua ORM
+        rebuild_sales_rollup()
+    initialize_data()
+    return (lambda: InProcessClient(app)), args.products
+
+
+def run(args):
+    if args.base_url:
+        make_client = lambda: HTTPClient(args.base_url)
+        product_id_max = args.product_id_max
+    else:
+        make_client, product_id_max = setup_in_process(args)
+
+    recorder = Recorder()
+    deadline = time.perf_counter() + args.duration
+    login_failures = []
+
+    def worker(index):
+        rng = random.Random(args.seed + index)
+        client = make_client()
+        is_admin = index < round(args.concurrency * args.admin_ratio)
+        if is_admin:
+            status = client.request('POST', '/quanlybanhang/login',
+                                    json_body={'phone': args.admin_phone, 'password': args.admin_password})
+            if status != 200:
+                login_failures.append(status)
+                return
+        journey = admin_journey if is_admin else buyer_journey
+        while time.perf_counter() < deadline:
+            journey(client, recorder, rng, product_id_max)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    if login_failures:
+        print(f"Cảnh báo: {len(login_failures)} worker admin đăng nhập thất bại (mã {login_failures[0]})")
+
+    return {
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'config': {
+            'mode': 'http' if args.base_url else 'in-process',
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'admin_ratio': args.admin_ratio,
+            'products': product_id_max,
+            'orders': None if args.base_url else args.orders,
+        },
+        'elapsed': round(elapsed, 3),
+        'total_throughput_rps': round(sum(len(s) for s in recorder.samples.values()) / elapsed, 2),
+        'routes': summarize(recorder, elapsed),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result, baseline=None):
+    print(f"Commit {result['commit']}  |  {result['config']['mode']}  |  "
+          f"{result['config']['concurrency']} luồng  |  {result['elapsed']:.1f}s  |  "
+          f"tổng {result['total_throughput_rps']:.1f} req/s")
+    print(f"{'route':<34} {'req':>6} {'lỗi':>5} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for route, stats in result['routes'].items():
+        line = (f"{route:<34} {stats['requests']:>6} {stats['errors']:>5} {stats['throughput_rps']:>8.1f} "
+                f"{stats['p50_ms']:>7.1f}ms {stats['p95_ms']:>6.1f}ms {stats['p99_ms']:>6.1f}ms")
+        base = (baseline or {}).get('routes', {}).get(route)
+        if base and base['p95_ms']:
+            line += f"  p95 {stats['p95_ms'] / base['p95_ms']:.2f}x so với {baseline['commit']}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=8, help='số người dùng ảo chạy song song')
+    parser.add_argument('--duration', type=float, default=20.0, help='thời gian chạy (giây)')
+    parser.add_argument('--admin-ratio', type=float, default=0.25, help='tỉ lệ người dùng ảo là admin')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='lưu kết quả JSON vào tệp này')
+    parser.add_argument('--compare', help='tệp JSON của lần chạy trước để so sánh p95')
+    group = parser.add_argument_group('chế độ trong tiến trình (DB tạm)')
+    group.add_argument('--products', type=int, default=200)
+    group.add_argument('--orders', type=int, default=5000)
+    group.add_argument('--messages', type=int, default=500)
+    group = parser.add_argument_group('chế độ HTTP (server đang chạy)')
+    group.add_argument('--base-url')
+    group.add_argument('--product-id-max', type=int, default=50)
+    group.add_argument('--admin-phone', default='000000001')
+    group.add_argument('--admin-password', default='admin_hoahuongduong_1')
+    args = parser.parse_args()
+
+    result = run(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"Đã lưu kết quả vào {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""So sánh thông lượng đọc/ghi lẫn lộn giữa các hồ sơ SQLite (DB_PROFILE).
+
+Mỗi hồ sơ chạy trong một tiến trình riêng với DB tạm và cache catalog tắt
+(CATALOG_CACHE_TTL=0) để mọi request đọc đều đi xuống SQLite:
+
+    python scripts/bench_sqlite_profile.py --threads 8 --duration 10 --write-ratio 0.2
+
+Người đọc gọi trang cửa hàng / chi tiết sản phẩm, người ghi gửi form liên hệ.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_worker(args):
+    sys.path.insert(0, ROOT)
+    from app import app, db, Product, initialize_data
+
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([
+            Product(name=f'Sản phẩm {i}', price=10000 + i, description=f'Mô tả {i}',
+                    image_filename='bench.jpg', stock_quantity=100)
+            for i in range(args.products)
+        ])
+        db.session.commit()
+    initialize_data()
+
+    counts = {'read': 0, 'write': 0, 'error': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def loop(seed):
+        rng = random.Random(seed)
+        client = app.test_client()
+        while time.perf_counter() < deadline:
+            if rng.random() < args.write_ratio:
+                kind = 'write'
+                response = client.post('/contact', data={
+                    'name': 'Bench', 'phone': '0900000000', 'content': 'Tin nhắn thử tải',
+                })
+                ok = response.status_code == 302
+            else:
+                kind = 'read'
+                if rng.random() < 0.5:
+                    response = client.get('/')
+                else:
+                    response = client.get(f'/product/{rng.randint(1, args.products)}')
+                ok = response.status_code == 200
+            with lock:
+                counts[kind if ok else 'error'] += 1
+
+    threads = [threading.Thread(target=loop, args=(i,)) for i in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counts['elapsed'] = time.perf_counter() - started
+    print(json.dumps(counts))
+
+
+def run_profile(profile, args):
+    db_dir = tempfile.mkdtemp(prefix=f'bench_{profile}_')
+    env = dict(os.environ,
+               DB_PROFILE=profile,
+               DATABASE_URL='sqlite:///' + os.path.join(db_dir, 'bench.db'),
+               CATALOG_CACHE_TTL='0')
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--worker',
+         '--threads', str(args.threads), '--duration', str(args.duration),
+         '--write-ratio', str(args.write_ratio), '--products', str(args.products)],
+        env=env, cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help='giây cho mỗi hồ sơ')
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--profiles', nargs='+', default=['default', 'production'])
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    results = {}
+    for profile in args.profiles:
+        result = run_profile(profile, args)
+        results[profile] = result
+        total = result['read'] + result['write']
+        print(f"{profile:<11} đọc={result['read']:>6}  ghi={result['write']:>5}  lỗi={result['error']:>4}  "
+              f"-> {total / result['elapsed']:.1f} req/s")
+
+    if 'default' in results and len(results) > 1:
+        base = results['default']
+        base_rate = (base['read'] + base['write']) / base['elapsed']
+        for profile, result in results.items():
+            if profile != 'default':
+                rate = (result['read'] + result['write']) / result['elapsed']
+                print(f"{profile} / default = {rate / base_rate:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Kiểm tra ETag/304 của trang công khai theo kho hàng trên DB tạm.
+
+ETag (public_page_etag) gồm phiên bản catalog, nên mọi thao tác đổi kho phải tăng phiên bản.
+Nếu thiếu, khách quay lại vẫn nhận 304 với số lượng "Còn lại" cũ và nút thêm vào giỏ của
+sản phẩm đã bán hết:
+
+    python scripts/check_page_etag.py      # thoát mã 1 nếu có kiểm tra sai
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    db_dir = tempfile.mkdtemp(prefix='page_etag_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(db_dir, 'etag.db')
+    os.environ['METRICS_DIR'] = os.path.join(db_dir, 'metrics')
+    os.environ['JOB_WORKERS'] = '0'
+    sys.path.insert(0, ROOT)
+    from app import app, db, Product, initialize_data
+
+    with app.app_context():
+        db.create_all()
+    initialize_data()
+    with app.app_context():
+        product = Product(name='Hoa cuối cùng', price=10000, description='x',
+                          image_filename='hoa.jpg', stock_quantity=2)
+        db.session.add(product)
+        db.session.commit()
+        product_id = product.id
+    pages = [f'/product/{product_id}', '/']
+
+    failures = []
+
+    def check(label, ok, detail=''):
+        print(f"{'OK ' if ok else 'LỖI'}  {label}{'' if ok else f' ({detail})'}")
+        if not ok:
+            failures.append(label)
+
+    # Khách quay lại: đã có trang (và ETag) từ trước khi sản phẩm bán hết
+    visitor = app.test_client()
+    etags = {}
+    for path in pages:
+        response = visitor.get(path)
+        etags[path] = response.get_etag()[0]
+        check(f"{path} có ETag", response.status_code == 200 and etags[path], response.status_code)
+    check("trang sản phẩm hiện số lượng còn lại",
+          '(Còn lại: 2 sản phẩm)' in visitor.get(pages[0]).get_data(as_text=True))
+    check("trình duyệt có bản đúng thì nhận 304",
+          visitor.get(pages[0], headers={'If-None-Match': etags[pages[0]]}).status_code == 304)
+
+    buyer = app.test_client()
+    buyer.post('/api/cart/add', json={'product_id': product_id, 'quantity': 2})
+    buyer.post('/checkout', data={'selected_items': [str(product_id)]})
+    response = buyer.post('/api/checkout/process', data={
+        'name': 'Khách', 'phone': '0900000000', 'address': 'Hà Nội', 'payment_method': 'cash'})
+    check("checkout mua hết hàng", response.status_code == 200, response.get_json())
+
+    for path in pages:
+        response = visitor.get(path, headers={'If-None-Match': etags[path]})
+        check(f"{path} không còn trả 304 sau checkout",
+              response.status_code == 200 and response.get_etag()[0] != etags[path], response.status_code)
+    page = visitor.get(pages[0]).get_data(as_text=True)
+    check("trang sản phẩm không còn số lượng cũ", '(Còn lại: 2 sản phẩm)' not in page)
+
+    total = 4 + 2 * len(pages)
+    print(f"{total - len(failures)}/{total} kiểm tra đạt")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
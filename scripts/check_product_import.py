@@ -0,0 +1,74 @@
+"""Kiểm tra nhập sản phẩm hàng loạt (/quanlybanhang/api/products/import) trên DB tạm.
+
+Sản phẩm không có ảnh làm hỏng mọi trang dựng URL ảnh sản phẩm (lưới cửa hàng trống),
+nên CSV thiếu cột/ô 'image' phải bị từ chối và cửa hàng vẫn hiển thị bình thường:
+
+    python scripts/check_product_import.py      # thoát mã 1 nếu có kiểm tra sai
+"""
+import io
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    db_dir = tempfile.mkdtemp(prefix='product_import_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(db_dir, 'import.db')
+    os.environ['CATALOG_CACHE_TTL'] = '0'
+    os.environ['METRICS_DIR'] = os.path.join(db_dir, 'metrics')
+    os.environ['JOB_WORKERS'] = '0'
+    sys.path.insert(0, ROOT)
+    from app import app, db, Product, initialize_data
+
+    with app.app_context():
+        db.create_all()
+    initialize_data()
+    # Ảnh đã có sẵn trên máy chủ để CSV (không kèm ZIP) tham chiếu tới
+    upload_folder = tempfile.mkdtemp(prefix='product_images_', dir=db_dir)
+    app.config['PRODUCT_UPLOAD_FOLDER'] = upload_folder
+    with open(os.path.join(upload_folder, 'co-anh.jpg'), 'wb') as f:
+        f.write(b'jpg')
+
+    admin = app.test_client()
+    admin.post('/quanlybanhang/login', json={'phone': '000000001', 'password': 'admin_hoahuongduong_1'})
+
+    def import_csv(text):
+        return admin.post('/quanlybanhang/api/products/import', content_type='multipart/form-data',
+                          data={'file': (io.BytesIO(text.encode('utf-8')), 'products.csv')})
+
+    def product_count():
+        with app.app_context():
+            return db.session.query(Product).count()
+
+    failures = []
+
+    def check(label, ok, detail=''):
+        print(f"{'OK ' if ok else 'LỖI'}  {label}{'' if ok else f' ({detail})'}")
+        if not ok:
+            failures.append(label)
+
+    response = import_csv('name,price,stock_quantity\nHoa không ảnh,10000,5\n')
+    check("CSV không có cột image bị từ chối",
+          response.status_code == 400 and 'image' in response.get_json()['message'], response.get_json())
+    check("không tạo sản phẩm nào", product_count() == 0, product_count())
+
+    response = import_csv('name,price,image\nHoa ô ảnh trống,10000,\nHoa có ảnh,20000,co-anh.jpg\n')
+    report = response.get_json()
+    check("dòng có ô image trống bị báo lỗi theo dòng",
+          response.status_code == 200 and report['created'] == 1 and report['error_count'] == 1
+          and report['errors'][0]['line'] == 2, report)
+    with app.app_context():
+        missing_image = db.session.query(Product).filter(Product.image_filename.is_(None)).count()
+    check("không có sản phẩm nào thiếu ảnh", missing_image == 0, missing_image)
+
+    page = app.test_client().get('/').get_data(as_text=True)
+    check("trang cửa hàng vẫn hiện sản phẩm vừa nhập", 'Hoa có ảnh' in page)
+
+    print(f"{5 - len(failures)}/5 kiểm tra đạt")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
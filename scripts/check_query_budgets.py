@@ -0,0 +1,151 @@
+"""Kiểm tra ngân sách truy vấn (@query_budget) của các route chính trên DB tạm.
+
+Dữ liệu mẫu có nhiều sản phẩm/đơn hàng/tin nhắn để truy vấn N+1 lộ ra
+(một dạng câu lệnh lặp lại theo số dòng). Cache catalog tắt để đo trường
+hợp xấu nhất:
+
+    python scripts/check_query_budgets.py            # thoát mã 1 nếu có route vượt
+    python scripts/check_query_budgets.py --report   # chỉ in số truy vấn từng route
+
+Dùng trong CI hoặc trước khi merge thay đổi chạm tới model/template.
+"""
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CUSTOMER_PHONE = '0912345678'
+CUSTOMER_PASSWORD = 'khachhang123'
+
+
+def seed(app, db, models, products, orders, messages):
+    Product, User, Order, OrderItem, Message = models
+    with app.app_context():
+        product_rows = [
+            Product(name=f'Hoa {i}', price=10000 + i, description=f'Mô tả hoa {i}',
+                    image_filename='budget.jpg', stock_quantity=1000)
+            for i in range(products)
+        ]
+        db.session.add_all(product_rows)
+        db.session.flush()
+        customer = db.session.query(User).filter_by(phone=CUSTOMER_PHONE).first()
+        base = datetime.datetime(2025, 1, 1)
+        for i in range(orders):
+            order = Order(customer_id=customer.id, customer_name='Khách', customer_phone=CUSTOMER_PHONE,
+                          customer_address='Hà Nội', total_price=30000, status='pending',
+                          created_at=base + datetime.timedelta(hours=i))
+            db.session.add(order)
+            db.session.flush()
+            db.session.add_all([
+                OrderItem(order_id=order.id, product_id=product_rows[(i + k) % products].id,
+                          quantity=1, price_at_purchase=10000)
+                for k in range(3)
+            ])
+        db.session.add_all([
+            Message(name='Khách', phone=CUSTOMER_PHONE, content=f'Tin nhắn {i}')
+            for i in range(messages)
+        ])
+        db.session.commit()
+        return product_rows[0].id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=30)
+    parser.add_argument('--orders', type=int, default=40)
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--report', action='store_true', help='chỉ in số truy vấn, không kiểm tra ngân sách')
+    args = parser.parse_args()
+
+    db_dir = tempfile.mkdtemp(prefix='query_budget_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(db_dir, 'budget.db')
+    os.environ['CATALOG_CACHE_TTL'] = '0'
+    os.environ['METRICS_DIR'] = os.path.join(db_dir, 'metrics')
+    # Worker việc nền truy vấn DB ở luồng riêng, sẽ bị đếm lẫn vào request đang đo
+    os.environ['JOB_WORKERS'] = '0'
+    sys.path.insert(0, ROOT)
+    from app import (app, db, Product, User, Order, OrderItem, Message, initialize_data,
+                     rebuild_sales_rollup, rebuild_dashboard_counters)
+    from query_guard import QueryBudgetExceeded, assert_query_budget, count_queries
+
+    with app.app_context():
+        db.create_all()
+    initialize_data()
+
+    customer = app.test_client()
+    customer.post('/quanlybanhang/register', json={'phone': CUSTOMER_PHONE, 'password': CUSTOMER_PASSWORD})
+    product_id = seed(app, db, (Product, User, Order, OrderItem, Message),
+                      args.products, args.orders, args.messages)
+    # Đơn được nạp thẳng qua ORM: tính lại bảng tổng hợp để trang thống kê/KPI đọc dữ liệu thật
+    with app.app_context():
+        rebuild_sales_rollup()
+        rebuild_dashboard_counters()
+        db.session.commit()
+    customer.post('/quanlybanhang/login', json={'phone': CUSTOMER_PHONE, 'password': CUSTOMER_PASSWORD})
+
+    admin = app.test_client()
+    admin.post('/quanlybanhang/login', json={'phone': '000000001', 'password': 'admin_hoahuongduong_1'})
+
+    guest = app.test_client()
+    # (client, method, path, tham số request) theo thứ tự một phiên mua hàng và quản trị
+    checks = [
+        (guest, 'GET', '/', {}),
+        (guest, 'GET', '/?search=hoa', {}),
+        (guest, 'GET', f'/product/{product_id}', {}),
+        (guest, 'GET', '/pages', {}),
+        (guest, 'GET', '/api/gallery?cursor=0', {}),
+        (guest, 'GET', '/contact', {}),
+        (guest, 'POST', '/api/cart/add', {'json': {'product_id': product_id, 'quantity': 1}}),
+        (guest, 'POST', '/api/cart/add', {'json': {'product_id': product_id + 1, 'quantity': 1}}),
+        (guest, 'POST', '/api/cart/add', {'json': {'product_id': product_id + 2, 'quantity': 1}}),
+        (guest, 'GET', '/cart', {}),
+        (guest, 'POST', '/checkout', {'data': {'selected_items': [str(product_id + k) for k in range(3)]}}),
+        (guest, 'POST', '/api/checkout/process', {'data': {
+            'name': 'Khách', 'phone': CUSTOMER_PHONE, 'address': 'Hà Nội', 'payment_method': 'cash'}}),
+        (customer, 'GET', '/order-history', {}),
+        (admin, 'GET', '/quanlybanhang/main-page', {}),
+        (admin, 'GET', '/quanlybanhang/api/dashboard', {}),
+        (admin, 'GET', '/quanlybanhang/transaction', {}),
+        (admin, 'GET', '/quanlybanhang/api/orders', {}),
+        (admin, 'GET', '/quanlybanhang/api/orders/export?format=csv', {}),
+        (admin, 'GET', '/quanlybanhang/statistics', {}),
+        (admin, 'GET', '/quanlybanhang/products', {}),
+        (admin, 'GET', '/quanlybanhang/gallery', {}),
+        (admin, 'GET', '/quanlybanhang/messages', {}),
+        (admin, 'GET', '/quanlybanhang/settings', {}),
+        (admin, 'GET', '/quanlybanhang/jobs', {}),
+        (admin, 'POST', '/quanlybanhang/api/products/batch-update', {'json': {'updates': [
+            {'product_id': product_id + k, 'new_price': 20000 + k, 'new_stock': k % 3 * 10}
+            for k in range(20)]}}),
+        (admin, 'POST', '/quanlybanhang/api/orders/bulk-status', {'json': {
+            'order_ids': list(range(1, args.orders + 1)), 'status': 'rejected'}}),
+    ]
+
+    failures = 0
+    for client, method, path, kwargs in checks:
+        if args.report:
+            with app.app_context(), count_queries(db.engine) as shapes:
+                response = client.open(path, method=method, **kwargs)
+                response.get_data()
+            repeated = max(shapes.values(), default=0)
+            print(f"{method:<4} {path:<32} {response.status_code}  {sum(shapes.values()):>3} truy vấn"
+                  f"  (lặp nhiều nhất {repeated})")
+            continue
+        try:
+            with app.app_context():
+                response = assert_query_budget(app, db.engine, client, path, method=method, **kwargs)
+            print(f"OK   {method:<4} {path} ({response.status_code})")
+        except QueryBudgetExceeded as e:
+            failures += 1
+            print(f"LỖI  {e}")
+
+    if not args.report:
+        print(f"{len(checks) - failures}/{len(checks)} route trong ngân sách")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
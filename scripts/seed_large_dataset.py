@@ -0,0 +1,194 @@
+"""Sinh bộ dữ liệu lớn (cố định theo seed) để kiểm tra hiệu năng/dung lượng.
+
+Mặc định: 100k sản phẩm, 100k người dùng, 1M đơn hàng (kèm OrderItem, độ phổ
+biến sản phẩm lệch theo phân phối Zipf, đủ mọi trạng thái) và 100k tin nhắn:
+
+    python scripts/seed_large_dataset.py --database /tmp/capacity.db
+    DATABASE_URL=sqlite:////tmp/capacity.db python app.py
+
+Cùng --seed thì cùng dữ liệu, nên kết quả benchmark so sánh được giữa các lần chạy.
+Ghi bằng INSERT hàng loạt theo lô (executemany của driver với tuple, autoflush tắt)
+trong một transaction.
+Mọi người dùng mẫu có chung mật khẩu 'matkhau123' (chỉ băm một lần).
+"""
+import argparse
+import datetime
+import itertools
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Trọng số trạng thái đơn: phần lớn đã giao, một phần đang xử lý/bị từ chối
+STATUS_WEIGHTS = {'pending': 8, 'confirmed': 7, 'shipped': 10, 'delivered': 65, 'rejected': 10}
+USER_PASSWORD = 'matkhau123'
+FLOWER_NAMES = ['Hướng Dương', 'Hoa Hồng', 'Cẩm Chướng', 'Tulip', 'Lan Hồ Điệp',
+                'Cúc Họa Mi', 'Baby', 'Đồng Tiền', 'Ly Ly', 'Thạch Thảo']
+ADJECTIVES = ['đỏ', 'vàng', 'trắng', 'hồng', 'tím', 'mini', 'bó lớn', 'giỏ', 'hộp', 'lẵng']
+
+
+def sqlite_datetime(value):
+    """Cùng định dạng SQLAlchemy lưu cột DateTime trên SQLite."""
+    return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def bulk_insert(session, table, rows):
+    """INSERT nhiều dòng (tuple theo thứ tự cột của bảng) qua cursor của driver,
+    trong transaction hiện tại của session; bỏ qua bước dựng tham số của SQLAlchemy."""
+    columns = [column.name for column in table.columns]
+    sql = 'INSERT INTO "{}" ({}) VALUES ({})'.format(
+        table.name, ', '.join(f'"{name}"' for name in columns), ', '.join('?' * len(columns)))
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.executemany(sql, rows)
+    finally:
+        cursor.close()
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', required=True, help='đường dẫn tệp SQLite sẽ tạo')
+    parser.add_argument('--force', action='store_true', help='xóa tệp nếu đã tồn tại')
+    parser.add_argument('--products', type=int, default=100_000)
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--orders', type=int, default=1_000_000)
+    parser.add_argument('--messages', type=int, default=100_000)
+    parser.add_argument('--max-items', type=int, default=4, help='số dòng tối đa mỗi đơn')
+    parser.add_argument('--zipf', type=float, default=1.1, help='độ lệch phổ biến sản phẩm (s của Zipf)')
+    parser.add_argument('--days', type=int, default=365, help='đơn hàng trải đều trong N ngày gần nhất')
+    parser.add_argument('--seed', type=int, default=20240601)
+    parser.add_argument('--batch', type=int, default=20_000, help='số dòng mỗi lệnh INSERT hàng loạt')
+    args = parser.parse_args()
+
+    path = os.path.abspath(args.database)
+    if os.path.exists(path):
+        if not args.force:
+            sys.exit(f"{path} đã tồn tại (dùng --force để ghi đè).")
+        os.remove(path)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    sys.path.insert(0, ROOT)
+    from werkzeug.security import generate_password_hash
+    from app import (app, db, User, Product, Order, OrderItem, Message,
+                     initialize_data, ensure_search_index, rebuild_sales_rollup)
+
+    rng = random.Random(args.seed)
+    # Mốc thời gian cố định (không dùng now()) để cùng seed ra cùng dữ liệu
+    end = datetime.datetime(2025, 1, 1)
+    start = end - datetime.timedelta(days=args.days)
+    span_seconds = args.days * 86400
+    started = time.perf_counter()
+
+    def report(label, count):
+        print(f"  {label:<12} {count:>9,} dòng  ({time.perf_counter() - started:6.1f}s)")
+
+    with app.app_context():
+        db.create_all()
+        session = db.session
+        # Chỉ để nạp dữ liệu: bỏ fsync, nhật ký trong bộ nhớ
+        session.execute(db.text("PRAGMA synchronous = OFF"))
+        session.execute(db.text("PRAGMA journal_mode = MEMORY"))
+
+        with session.no_autoflush:
+            # rng.random() gọi trực tiếp nhanh hơn randint() nhiều lần với hàng triệu dòng
+            rand = rng.random
+            prices = [(50 + int(rand() * 1950)) * 1000.0 for _ in range(args.products)]
+            products = (
+                (i + 1, f"{rng.choice(FLOWER_NAMES)} {rng.choice(ADJECTIVES)} #{i + 1}", prices[i],
+                 f"Mẫu hoa số {i + 1}, giao nhanh trong ngày.", 'placeholder.jpg', int(rand() * 500))
+                for i in range(args.products)
+            )
+            for chunk in chunked(products, args.batch):
+                bulk_insert(session, Product.__table__, chunk)
+            report('product', args.products)
+
+            password_hash = generate_password_hash(USER_PASSWORD, method=app.config['PASSWORD_HASH_METHOD'])
+            # Số 08xxxxxxxx không trùng với tài khoản admin 00000000x
+            users = ((i + 1, f"08{i:08d}", password_hash) for i in range(args.users))
+            for chunk in chunked(users, args.batch):
+                bulk_insert(session, User.__table__, chunk)
+            report('user', args.users)
+
+            # Zipf: sản phẩm hạng k có trọng số 1/k^s; thứ hạng xáo trộn theo seed
+            ranked_products = list(range(1, args.products + 1))
+            rng.shuffle(ranked_products)
+            cum_weights = list(itertools.accumulate(1 / (k ** args.zipf) for k in range(1, args.products + 1)))
+            statuses = list(STATUS_WEIGHTS)
+            status_cum = list(itertools.accumulate(STATUS_WEIGHTS.values()))
+
+            order_batch, item_batch = [], []
+            item_id = 0
+            for order_id in range(1, args.orders + 1):
+                # Đơn tăng dần theo thời gian như dữ liệu thật (id lớn = mới hơn)
+                created_at = start + datetime.timedelta(
+                    seconds=span_seconds * (order_id - 1) / args.orders + rand())
+                picks = set(rng.choices(ranked_products, cum_weights=cum_weights,
+                                        k=1 + int(rand() * args.max_items)))
+                total = 0.0
+                for product_id in picks:
+                    item_id += 1
+                    quantity = 1 + int(rand() * 3)
+                    price = prices[product_id - 1]
+                    total += price * quantity
+                    item_batch.append((item_id, order_id, product_id, quantity, price))
+                order_batch.append((
+                    order_id,
+                    # ~60% đơn của khách có tài khoản, còn lại khách vãng lai
+                    1 + int(rand() * args.users) if args.users and rand() < 0.6 else None,
+                    f"Khách {order_id}",
+                    f"09{int(rand() * 10 ** 8):08d}",
+                    f"{1 + int(rand() * 500)} đường số {1 + int(rand() * 50)}, Hà Nội",
+                    total,
+                    'bank_transfer' if rand() < 0.3 else 'cash',
+                    rng.choices(statuses, cum_weights=status_cum)[0],
+                    sqlite_datetime(created_at),
+                    None,
+                ))
+                if len(order_batch) >= args.batch:
+                    bulk_insert(session, Order.__table__, order_batch)
+                    bulk_insert(session, OrderItem.__table__, item_batch)
+                    order_batch, item_batch = [], []
+            if order_batch:
+                bulk_insert(session, Order.__table__, order_batch)
+                bulk_insert(session, OrderItem.__table__, item_batch)
+            report('order', args.orders)
+            report('order_item', item_id)
+
+            subjects = ['Hỏi giá', 'Giao hàng', 'Đặt hoa sự kiện', None]
+            messages = (
+                (i + 1, f"Khách {i + 1}",
+                 f"khach{i + 1}@example.com" if rand() < 0.5 else None,
+                 f"09{int(rand() * 10 ** 8):08d}",
+                 rng.choice(subjects),
+                 f"Nội dung tin nhắn {i + 1}",
+                 # Tin cũ đa số đã đọc, ~5% gần nhất còn chưa đọc
+                 i < args.messages * 0.95 and rand() < 0.97,
+                 sqlite_datetime(start + datetime.timedelta(seconds=span_seconds * i / max(args.messages, 1))))
+                for i in range(args.messages)
+            )
+            for chunk in chunked(messages, args.batch):
+                bulk_insert(session, Message.__table__, chunk)
+            report('message', args.messages)
+
+        session.commit()
+
+    # Dữ liệu phụ trợ: admin/thông tin mặc định, chỉ mục tìm kiếm, bảng tổng hợp doanh số
+    initialize_data()
+    ensure_search_index()
+    with app.app_context():
+        report('sales_rollup', rebuild_sales_rollup())
+    print(f"Xong sau {time.perf_counter() - started:.1f}s -> {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Kiểm tra tải cho luồng thanh toán: nhiều khách mua cùng lúc một sản phẩm ít hàng.
+
+Chạy trên một DB SQLite tạm (không đụng tới users.db, instance/metrics hay hàng đợi việc nền):
+
+    python scripts/stress_checkout.py --clients 16 --checkouts 400 --stock 250
+
+Script in ra số đơn thành công/bị từ chối, số checkout mỗi giây và kiểm tra
+không bán vượt: kho cuối >= 0 và (kho đầu - kho cuối) == tổng số lượng đã bán.
+Thoát với mã 1 nếu phát hiện bán vượt.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=16, help='số khách chạy song song')
+    parser.add_argument('--checkouts', type=int, default=400, help='tổng số lượt thanh toán')
+    parser.add_argument('--stock', type=int, default=250, help='tồn kho ban đầu của sản phẩm')
+    parser.add_argument('--quantity', type=int, default=1, help='số lượng mỗi đơn')
+    args = parser.parse_args()
+
+    db_dir = tempfile.mkdtemp(prefix='stress_checkout_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(db_dir, 'stress.db')
+    # Số liệu và hàng đợi việc nền cũng tách khỏi instance thật
+    os.environ['METRICS_DIR'] = os.path.join(db_dir, 'metrics')
+    os.environ['JOB_WORKERS'] = '0'
+    sys.path.insert(0, ROOT)
+    from app import app, db, Product, OrderItem
+
+    with app.app_context():
+        db.create_all()
+        product = Product(name='Hoa Hướng Dương', price=50000, description='Stress test',
+                          image_filename='stress.jpg', stock_quantity=args.stock)
+        db.session.add(product)
+        db.session.commit()
+        product_id = product.id
+
+    results = {'ok': 0, 'rejected': 0}
+    latencies = []
+    lock = threading.Lock()
+    remaining = [args.checkouts]
+
+    def take_job():
+        with lock:
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def client_loop():
+        while take_job():
+            client = app.test_client()
+            # Giỏ hàng và bước xác nhận; có thể bị từ chối khi kho đã hết
+            client.post('/api/cart/add', json={'product_id': product_id, 'quantity': args.quantity})
+            client.post('/checkout', data={'selected_items': [str(product_id)]})
+            started = time.perf_counter()
+            response = client.post('/api/checkout/process', data={
+                'name': 'Khách tải', 'phone': '0900000000',
+                'address': 'Hà Nội', 'payment_method': 'cash',
+            })
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                results['ok' if response.status_code == 200 else 'rejected'] += 1
+
+    threads = [threading.Thread(target=client_loop) for _ in range(args.clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - started
+
+    with app.app_context():
+        final_stock = db.session.get(Product, product_id).stock_quantity
+        sold = db.session.query(db.func.coalesce(db.func.sum(OrderItem.quantity), 0)) \
+                         .filter(OrderItem.product_id == product_id).scalar()
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    print(f"Khách song song : {args.clients}")
+    print(f"Thành công      : {results['ok']}  |  Bị từ chối: {results['rejected']}")
+    print(f"Thời gian       : {wall_time:.2f}s  ->  {results['ok'] / wall_time:.1f} checkout/s")
+    print(f"Độ trễ checkout : p50={latencies[len(latencies) // 2] * 1000:.1f}ms  p95={p95 * 1000:.1f}ms")
+    print(f"Kho đầu/cuối    : {args.stock} -> {final_stock}  |  Đã bán: {sold}")
+
+    oversold = final_stock < 0 or args.stock - final_stock != sold
+    print("KẾT QUẢ         : " + ("BÁN VƯỢT KHO!" if oversold else "không bán vượt (0 oversell)"))
+    sys.exit(1 if oversold else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+"""Điểm vào WSGI cho production:
+
+    flask --app app setup-deployment          # một lần mỗi lần triển khai (hoặc để gunicorn tự chạy)
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+`app` là app mặc định do app.create_app() tạo khi import module app, cũng là app mà
+setup_deployment() và reset_after_fork() trong gunicorn.conf.py dùng. Cần app với cấu
+hình khác (test, nhiều instance) thì gọi create_app({...}).
+"""
+from app import app